@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Only the Qt-free core is imported here, so this runs on machines without PyQt
+import numpy as np
+
+from TSPSolver import *
+from TSPClasses import *
+from TSPInstrument import peakRSS
+from Proj5CLI import DIFFICULTIES
+
+
+ALGORITHMS = [ alg[1] for alg in TSPSolver.ALGORITHMS ]
+LABELS = { alg[1]:alg[0].strip() for alg in TSPSolver.ALGORITHMS }
+
+DEFAULT_SIZES = [ 10, 15, 50, 200 ]
+DEFAULT_SEEDS = [ 1, 2, 3 ]
+
+# Largest size each algorithm is run on by default; the exact solvers would
+# only spend the whole time allowance above these
+MAX_SIZES = { 'branchAndBound':50, 'parallelBranchAndBound':50, 'heldKarp':16, 'greedy':200 }
+
+# Relative cost tolerance of the algorithms whose tours depend on how much
+# they get done before the deadline (and on their random choices), so two
+# runs of the same code differ; the others are held to --cost-tolerance
+COST_TOLERANCES = { 'branchAndBound':0.02, 'parallelBranchAndBound':0.02, 'multiStart':0.02, \
+					'fancy':0.05, 'antColony':0.05, 'simulatedAnnealing':0.05 }
+
+# A run regresses when it is worse than the baseline by more than the
+# relative tolerance plus the absolute slack, which absorbs timer and
+# allocator noise on small runs
+TIME_SLACK = 0.05			# seconds
+MEMORY_SLACK = 16<<20		# bytes
+COST_SLACK = 1e-6
+
+LOWER_BOUND_TIME = 1.0		# seconds per case spent on the lower bound, after the solve
+
+
+def _key( record ):
+	return '%s|%d|%s|%d' % (record['algorithm'] or 'generate', record['size'], record['difficulty'], record['seed'])
+
+
+''' <summary>
+	One benchmark case, run in a fresh worker process so that its peak
+	resident size is its own.  algorithm None measures scenario generation
+	only.  numpy's global generator is seeded first, which makes the legacy
+	"Hard" thinning repeatable as well; the solvers seed their own
+	generators from the scenario's seed.  The lower bound gets
+	lower_bound_time seconds after the solve (none if None), which are
+	recorded apart from the solve's time.
+	</summary>
+'''
+def runCase( algorithm, size, difficulty, seed, time_allowance, fast, lower_bound_time=LOWER_BOUND_TIME ):
+	np.random.seed( seed )
+	record = { 'algorithm':algorithm, 'size':size, 'difficulty':difficulty, 'seed':seed }
+	start = time.perf_counter()
+	scenario = Scenario.generate( size, seed, difficulty, legacy=not fast )
+	scenario.getCostMatrix()
+	record['generate_time'] = time.perf_counter() - start
+	if algorithm is not None:
+		solver = TSPSolver()
+		solver.setupWithScenario( scenario )
+		solver.setLowerBoundTime( lower_bound_time )
+		start = time.perf_counter()
+		results = getattr( solver, algorithm )( time_allowance=time_allowance )
+		record['lower_bound_time'] = results.get( 'lower_bound_time', 0.0 )
+		record['time'] = time.perf_counter() - start - record['lower_bound_time']
+		record['cost'] = None if results['cost'] == math.inf else float( results['cost'] )
+		record['lower_bound'] = results.get( 'lower_bound' )
+		record['gap'] = results.get( 'gap' )
+	record['memory'] = peakRSS()
+	return record
+
+
+def runSuite( cases, time_allowance, fast, jobs=1, progress=None, lower_bound_time=LOWER_BOUND_TIME ):
+	records = []
+	context = multiprocessing.get_context( 'spawn' )
+	with ProcessPoolExecutor( max_workers=jobs, mp_context=context, max_tasks_per_child=1 ) as pool:
+		futures = [ pool.submit( runCase, *case, time_allowance, fast, lower_bound_time ) for case in cases ]
+		for future in futures:
+			record = future.result()
+			records.append( record )
+			if progress:
+				progress( record )
+	return records
+
+
+def buildCases( algorithms, sizes, difficulties, seeds, max_sizes ):
+	cases = []
+	for size in sizes:
+		for difficulty in difficulties:
+			for seed in seeds:
+				cases.append( (None, size, difficulty, seed) )
+				for algorithm in algorithms:
+					if size <= max_sizes.get( algorithm, size ):
+						cases.append( (algorithm, size, difficulty, seed) )
+	return cases
+
+
+''' <summary>
+	Compares records to the baseline records (matched by algorithm, size,
+	difficulty and seed; cases missing from either are ignored).
+	</summary>
+	<returns>list of (key, metric, baseline value, new value) regressions</returns>
+'''
+def compare( records, baseline, time_tolerance, cost_tolerance, memory_tolerance ):
+	base = { _key(record):record for record in baseline }
+	regressions = []
+	for record in records:
+		key = _key( record )
+		old = base.get( key )
+		if old is None:
+			continue
+		time_metric = 'time' if record['algorithm'] else 'generate_time'
+		if record[time_metric] > old[time_metric]*(1+time_tolerance) + TIME_SLACK:
+			regressions.append( (key, time_metric, old[time_metric], record[time_metric]) )
+		if record['algorithm']:
+			tolerance = max( cost_tolerance, COST_TOLERANCES.get( record['algorithm'], 0.0 ) )
+			if old['cost'] is not None and (record['cost'] is None or \
+					record['cost'] > old['cost']*(1+tolerance) + COST_SLACK):
+				regressions.append( (key, 'cost', old['cost'], record['cost']) )
+		if old['memory'] is not None and record['memory'] is not None and \
+				record['memory'] > old['memory']*(1+memory_tolerance) + MEMORY_SLACK:
+			regressions.append( (key, 'memory', old['memory'], record['memory']) )
+	return regressions
+
+
+def _mean( values ):
+	values = [ v for v in values if v is not None ]
+	return sum( values ) / len( values ) if values else None
+
+
+''' <summary>
+	The algorithms side by side, as in the GUI's dropdown: one row per size
+	and difficulty, one column per algorithm, each cell the mean cost, gap to
+	the lower bound and time over the seeds (and, with a baseline, the change
+	in mean cost and time).  Generation time gets a column of its own.
+	</summary>
+	<returns>the table as Markdown</returns>
+'''
+def comparisonTable( records, baseline=None ):
+	def group( records ):
+		groups = {}
+		for record in records:
+			groups.setdefault( (record['size'], record['difficulty'], record['algorithm']), [] ).append( record )
+		return groups
+	groups = group( records )
+	base_groups = group( baseline ) if baseline else {}
+	algorithms = [ alg for alg in ALGORITHMS if any(key[2] == alg for key in groups) ]
+	rows = sorted( { key[:2] for key in groups }, key=lambda row: (row[0], DIFFICULTIES.index(row[1])) )
+
+	def cell( key ):
+		runs = groups.get( key )
+		if not runs:
+			return '-'
+		cost = _mean( [r['cost'] for r in runs] )
+		gap = _mean( [r['gap'] for r in runs] )
+		seconds = _mean( [r['time'] for r in runs] )
+		text = 'no tour' if cost is None else '%.0f' % cost
+		if gap is not None:
+			text += ' (%.1f%%)' % (100*gap)
+		text += ' %.2fs' % seconds
+		old = base_groups.get( key )
+		if old:
+			old_cost = _mean( [r['cost'] for r in old] )
+			old_seconds = _mean( [r['time'] for r in old] )
+			if cost is not None and old_cost:
+				text += ' [cost %+.1f%%' % (100*(cost-old_cost)/old_cost)
+			else:
+				text += ' [cost n/a'
+			text += ', time %+.0f%%]' % (100*(seconds-old_seconds)/old_seconds) if old_seconds else ']'
+		return text
+
+	lines = [ '| Size | Difficulty | Generate | ' + ' | '.join( LABELS[alg] for alg in algorithms ) + ' |', \
+			  '|' + '---|' * (3+len(algorithms)) ]
+	for size, difficulty in rows:
+		generate = _mean( [r['generate_time'] for r in groups.get( (size, difficulty, None), [] )] )
+		cells = [ str(size), difficulty, '-' if generate is None else '%.3fs' % generate ]
+		cells += [ cell( (size, difficulty, alg) ) for alg in algorithms ]
+		lines.append( '| ' + ' | '.join( cells ) + ' |' )
+	return '\n'.join( lines ) + '\n'
+
+
+def main( argv=None ):
+	parser = argparse.ArgumentParser( description='Benchmark every solver over a grid of scenarios '
+												  'and check for regressions against a baseline.' )
+	parser.add_argument( '--algorithms', nargs='+', choices=ALGORITHMS, default=ALGORITHMS )
+	parser.add_argument( '--sizes', nargs='+', type=int, default=DEFAULT_SIZES )
+	parser.add_argument( '--difficulties', nargs='+', choices=DIFFICULTIES, default=DIFFICULTIES )
+	parser.add_argument( '--seeds', nargs='+', type=int, default=DEFAULT_SEEDS )
+	parser.add_argument( '--time', type=float, default=5.0, help='time limit per solve in seconds' )
+	parser.add_argument( '--all-sizes', action='store_true', \
+						 help='run every algorithm on every size, ignoring the per-algorithm size limits' )
+	parser.add_argument( '--fast', action='store_true', \
+						 help='use the vectorized scenario generator (different instances than the GUI)' )
+	parser.add_argument( '--lower-bound-time', type=float, default=LOWER_BOUND_TIME, \
+						 help='seconds per case spent on the lower bound for the gaps, after the solve; 0 for none' )
+	parser.add_argument( '--jobs', type=int, default=1, \
+						 help='cases run at once; more than 1 makes the timings noisier' )
+	parser.add_argument( '--baseline', metavar='FILE', help='compare against the records in FILE' )
+	parser.add_argument( '--save-baseline', metavar='FILE', help='write this run\'s records to FILE' )
+	parser.add_argument( '--table', metavar='FILE', help='also write the comparison table (Markdown) to FILE' )
+	parser.add_argument( '--time-tolerance', type=float, default=0.25 )
+	parser.add_argument( '--cost-tolerance', type=float, default=0.0, \
+						 help='at least this for every algorithm (see COST_TOLERANCES)' )
+	parser.add_argument( '--memory-tolerance', type=float, default=0.25 )
+	args = parser.parse_args( argv )
+
+	cases = buildCases( args.algorithms, args.sizes, args.difficulties, args.seeds, \
+						{} if args.all_sizes else MAX_SIZES )
+	def report( record ):
+		sys.stderr.write( '%-40s %s\n' % (_key(record), \
+						  'generated in %.3fs' % record['generate_time'] if record['algorithm'] is None else \
+						  'cost %s in %.2fs' % (record['cost'], record['time'])) )
+	records = runSuite( cases, args.time, args.fast, args.jobs, report, args.lower_bound_time or None )
+
+	baseline = None
+	if args.baseline:
+		with open( args.baseline ) as f:
+			baseline = json.load( f )['records']
+	if args.save_baseline:
+		with open( args.save_baseline, 'w' ) as f:
+			json.dump( { 'time':args.time, 'fast':args.fast, 'records':records }, f, indent=1 )
+
+	table = comparisonTable( records, baseline )
+	sys.stdout.write( table )
+	if args.table:
+		with open( args.table, 'w' ) as f:
+			f.write( table )
+
+	if baseline is not None:
+		regressions = compare( records, baseline, args.time_tolerance, args.cost_tolerance, args.memory_tolerance )
+		for key, metric, old, new in regressions:
+			sys.stdout.write( 'REGRESSION %s %s: %s -> %s\n' % (key, metric, old, new) )
+		if regressions:
+			return 1
+		sys.stdout.write( 'No regressions against %s\n' % args.baseline )
+	return 0
+
+
+
+if __name__ == '__main__':
+	sys.exit( main() )
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import math
+import sys
+
+
+# Only the Qt-free core is imported here, so this runs on machines without PyQt
+from TSPSolver import *
+from TSPClasses import *
+from TSPScenarioCache import ScenarioCache
+from TSPInstrument import Instrumentation
+import TSPLIB
+
+
+DIFFICULTIES = ['Easy', 'Normal', 'Hard', 'Hard (Deterministic)']
+
+
+''' <summary>
+	Makes a results dictionary JSON-friendly: the solution becomes its list of
+	city names (and indices), and INF costs become null.
+	</summary>
+'''
+def resultsToJSON( results ):
+	out = {}
+	for key, value in results.items():
+		if key == 'soln':
+			value = None if value is None else \
+					{ 'route': [c._name for c in value.route], \
+					  'indices': [int(c._index) for c in value.route] }
+		elif isinstance(value, float) and math.isinf(value):
+			value = None
+		elif hasattr(value, 'item'):
+			value = value.item()		# numpy scalar
+		out[key] = value
+	return out
+
+
+def main( argv=None ):
+	algorithms = [ alg[1] for alg in TSPSolver.ALGORITHMS ]
+	parser = argparse.ArgumentParser( description='Solve a generated TSP scenario without the GUI.' )
+	parser.add_argument( '--size', type=int, default=15, help='number of cities' )
+	parser.add_argument( '--seed', type=int, default=20, help='random seed used to place the cities' )
+	parser.add_argument( '--difficulty', choices=DIFFICULTIES, default='Hard (Deterministic)' )
+	parser.add_argument( '--algorithm', choices=algorithms, default='branchAndBound' )
+	parser.add_argument( '--time', type=float, default=60.0, help='time limit in seconds' )
+	parser.add_argument( '--lower-bound', metavar='SECONDS', type=float, \
+						 help='then spend up to this long on a lower bound, and report it and the gap to it' )
+	parser.add_argument( '--fast', action='store_true', \
+						 help='use the vectorized scenario generator (different instances than the GUI)' )
+	parser.add_argument( '--cache', metavar='DIR', \
+						 help='reuse generated scenarios from (and store them in) this directory' )
+	parser.add_argument( '--tsplib', metavar='FILE', help='solve this TSPLIB instance instead of a generated one' )
+	parser.add_argument( '--binary', metavar='FILE', help='solve a scenario saved with TSPLIB.writeBinary' )
+	parser.add_argument( '--write-tour', metavar='FILE', help='also write the tour found as a TSPLIB .tour file' )
+	parser.add_argument( '--instrument', metavar='FILE', help='write call counts, phase times and time series as JSON' )
+	parser.add_argument( '--chrome-trace', metavar='FILE', \
+						 help='write the same record in Chrome trace format (chrome://tracing, ui.perfetto.dev)' )
+	parser.add_argument( '--trace-memory', action='store_true', \
+						 help='measure memory with tracemalloc instead of the peak resident size (slower)' )
+	parser.add_argument( '--profile', metavar='FILE', help='profile the solve and write the profile to FILE' )
+	parser.add_argument( '--profiler', choices=Instrumentation.PROFILERS, default='cprofile', \
+						 help='cprofile writes pstats data, sample writes collapsed stacks for a flame graph' )
+	args = parser.parse_args( argv )
+
+	if args.tsplib:
+		scenario, _ = TSPLIB.readTSPLIB( args.tsplib )
+	elif args.binary:
+		scenario = TSPLIB.readBinary( args.binary )
+	elif args.cache:
+		scenario = ScenarioCache( args.cache ).get( args.size, args.seed, args.difficulty, legacy=not args.fast )
+	else:
+		scenario = Scenario.generate( args.size, args.seed, args.difficulty, legacy=not args.fast )
+
+	solver = TSPSolver()
+	solver.setupWithScenario( scenario )
+	solver.setLowerBoundTime( args.lower_bound )
+	instrumentation = None
+	if args.instrument or args.chrome_trace or args.profile:
+		instrumentation = Instrumentation( args.profiler if args.profile else None, args.trace_memory )
+		solver.setInstrumentation( instrumentation )
+	results = getattr( solver, args.algorithm )( time_allowance=args.time )
+	if instrumentation is not None:
+		if args.instrument:
+			instrumentation.writeJSON( args.instrument )
+		if args.chrome_trace:
+			instrumentation.writeChromeTrace( args.chrome_trace )
+		if args.profile:
+			instrumentation.writeProfile( args.profile )
+	if args.write_tour and results['soln'] is not None:
+		TSPLIB.writeTour( results['soln'], args.write_tour )
+
+	json.dump( resultsToJSON(results), sys.stdout, indent=2 )
+	sys.stdout.write( '\n' )
+
+
+
+if __name__ == '__main__':
+	main()
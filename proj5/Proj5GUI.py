@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 
 import math
+import os
 import random
 import signal
 import sys
 import time
+import traceback
 
+import numpy as np
 
 from which_pyqt import PYQT_VER
 if PYQT_VER == 'PYQT5':
@@ -31,9 +34,23 @@ else:
 from TSPSolver import *
 #from TSPSolver_complete import *
 from TSPClasses import *
+from TSPScenarioCache import ScenarioCache
+from TSPInstrument import Instrumentation
 
 
 class PointLineView( QWidget ):
+
+	''' <summary>
+		Level of detail: labels of a colour are only drawn if each would get at
+		least LABEL_MIN_PIXELS of screen area, and arrowheads only on edges at
+		least ARROW_MIN_PIXELS long on screen (and never more than MAX_ARROWS).
+		</summary> '''
+	LABEL_MIN_PIXELS = 600.0
+	ARROW_MIN_PIXELS = 20.0
+	MAX_ARROWS = 2000
+	ARROW_SCALE = 5.0
+	CITY_SIZE = 2.0 # DIAMETER
+
 	def __init__( self, status_bar, data_range ):
 		super(QWidget,self).__init__()
 		self.setMinimumSize(600,400)
@@ -41,16 +58,24 @@ class PointLineView( QWidget ):
 		self.pointList	= {}
 		self.edgeList	= {}
 		self.labelList	 = {}
+		self.edgeLabelList = {}		# labels added by addEdge; they go away with the edges
 		self.status_bar = status_bar
 		self.data_range = data_range
 		self.start_pt = None
 		self.end_pt = None
 
+		# Everything below is derived from the lists above and the widget size,
+		# and rebuilt only when one of them changes
+		self._background = None		# QPixmap of the points and point labels
+		self._edgeLayer = None		# per colour: (QColor, lines, arrowhead path, labels)
+		self._layerSize = None
+
 	def displayStatusText(self, text):
 		self.status_bar.showMessage(text)
 
 	def clearPoints(self):
 		self.pointList = {}
+		self._background = None
 
 	def clearEdges(self,removeColors = None):
 		self.edgeList = {}
@@ -58,8 +83,14 @@ class PointLineView( QWidget ):
 			for color in removeColors:
 				if color in self.labelList:
 					del self.labelList[color]
+					self._background = None
+				if color in self.edgeLabelList:
+					del self.edgeLabelList[color]
 		else:
 			self.labelList = {}
+			self.edgeLabelList = {}
+			self._background = None
+		self._edgeLayer = None
 		self.repaint()
 
 	def addPoints( self, point_list, color ):
@@ -67,6 +98,7 @@ class PointLineView( QWidget ):
 			self.pointList[color].extend( point_list )
 		else:
 			self.pointList[color] = point_list
+		self._background = None
 
 #	def setStartLoc( self, point ):
 #		self.start_pt = point
@@ -93,106 +125,192 @@ class PointLineView( QWidget ):
 
 		midp = QPointF( (edge.x1()*0.2 + edge.x2()*0.8),
 						(edge.y1()*0.2 + edge.y2()*0.8) )
-		self.addLabel( midp, label, labelColor, xoffset=xoffset )
+		self._addLabel( self.edgeLabelList, midp, label, labelColor, xoffset )
+		self._edgeLayer = None
 
 	def addLabel( self, point, label, labelColor,xoffset=0.0 ):
-		if labelColor in self.labelList.keys():
-			self.labelList[labelColor].append( (point,label,xoffset) )
-		else:
-			self.labelList[labelColor] = [(point,label,xoffset)]
-
-
+		self._addLabel( self.labelList, point, label, labelColor, xoffset )
+		self._background = None
 
+	def _addLabel( self, labels, point, label, labelColor, xoffset ):
+		if labelColor in labels.keys():
+			labels[labelColor].append( (point,label,xoffset) )
+		else:
+			labels[labelColor] = [(point,label,xoffset)]
 
-	def paintEvent(self, event):
-		painter = QPainter(self)
-		painter.setRenderHint(QPainter.RenderHint.Antialiasing,True)
 
+	''' <summary>
+		Data coordinates map to the widget with the origin at its centre, y
+		up and the data range fitted to the window.
+		</summary> '''
+	def _scale( self ):
 		xr = self.data_range['x']
 		yr = self.data_range['y']
 		w = self.width()
 		h = self.height()
 		w2h_desired_ratio = (xr[1]-xr[0])/(yr[1]-yr[0])
 		if w / h < w2h_desired_ratio:
-			 scale = w / (xr[1]-xr[0])
+			 return w / (xr[1]-xr[0])
 		else:
-			 scale = h / (yr[1]-yr[0])
+			 return h / (yr[1]-yr[0])
 
-		tform = QTransform()
-		tform.translate(self.width()/2.0,self.height()/2.0)
-		tform.scale(1.0,-1.0)
-		painter.setTransform(tform)
+	def _toScreen( self, xs, ys ):
+		scale = self._scale()
+		return self.width()/2.0 + scale*np.asarray(xs), self.height()/2.0 - scale*np.asarray(ys)
 
-		for color in self.edgeList:
-			c = QColor(color[0],color[1],color[2])
-			painter.setPen( c )
-			for edge in self.edgeList[color]:
-				ln = QLineF( scale*edge.x1(), scale*edge.y1(), scale*edge.x2(), scale*edge.y2() )
-				painter.drawLine( ln )
+	def _labelRects( self, labels ):
+		# Screen-space text boxes, centred like the old per-label transforms
+		R = 1.0E3
+		if len(labels) > self.width()*self.height() / self.LABEL_MIN_PIXELS:
+			return []
+		xs, ys = self._toScreen( [l[0].x() for l in labels], [l[0].y() for l in labels] )
+		return [ (QRectF(x+l[2]-R, y-R, 2.0*R, 2.0*R), l[1]) for x, y, l in zip(xs, ys, labels) ]
 
-		for color in self.edgeList:
-			c = QColor(color[0],color[1],color[2])
-			painter.setPen( c )
-			for edge in self.edgeList[color]:
-				#arrow_scale = .015
-				arrow_scale = 5.0
-				unit_edge = ( edge.x2() - edge.x1(), edge.y2() - edge.y1() )
-				unit_edge_mag = math.sqrt( ( edge.x2() - edge.x1())**2 + ( edge.y2() - edge.y1() )**2 )
-				unit_edge = (unit_edge[0] / unit_edge_mag, unit_edge[1] / unit_edge_mag )
-				unit_edge_perp = (-unit_edge[1], unit_edge[0])
-
-				temp_tform = QTransform()
-				temp_tform.translate(self.width()/2.0,self.height()/2.0)
-				temp_tform.scale(1.0,-1.0)
-				temp_tform.translate(scale*edge.x2(),scale*edge.y2())
-				temp_tform.scale(1.0,-1.0)
-				painter.setTransform(temp_tform)
-				#painter.drawText( RECT, label[1], align )
-
-				tri_pts = []
-				tri_pts.append( QPointF(0,0) )
-				tri_pts.append( QPointF(-arrow_scale*(2*unit_edge[0] + unit_edge_perp[0]),
-										arrow_scale*(2*unit_edge[1] + unit_edge_perp[1])) )
-				tri_pts.append( QPointF(-arrow_scale*(2*unit_edge[0] - unit_edge_perp[0]),
-										arrow_scale*(2*unit_edge[1] - unit_edge_perp[1])) )
-				tri = QPolygonF( tri_pts )
-				b = painter.brush()
-				painter.setBrush( c )
-				painter.drawPolygon( tri )
-				painter.setBrush( b )
-
-		painter.setTransform(tform)
+	def _drawLabels( self, painter, labelLayer ):
 		font = QFont("Monospace")
 		font.setStyleHint(QFont.StyleHint.TypeWriter)
-
-		R = 1.0E3
-		CITY_SIZE = 2.0 # DIAMETER
-		RECT = QRectF(-R,-R,2.0*R,2.0*R)
+		painter.setFont( font )
 		align = QTextOption(Qt.AlignmentFlag.AlignHCenter | Qt.AlignmentFlag.AlignVCenter )
-		for color in self.labelList:
-			c = QColor(color[0],color[1],color[2])
+		for c, rects in labelLayer:
 			painter.setPen( c )
-			for label in self.labelList[color]:
-				temp_tform = QTransform()
-				temp_tform.translate(self.width()/2.0,self.height()/2.0)
-				temp_tform.scale(1.0,-1.0)
-				pt = label[0]
-				xoff = label[2]
-				temp_tform.translate(scale*pt.x()+xoff,scale*pt.y())
-				temp_tform.scale(1.0,-1.0)
-				painter.setTransform(temp_tform)
-				painter.drawText( RECT, label[1], align )
-
-		painter.setTransform(tform)
+			for rect, text in rects:
+				painter.drawText( rect, text, align )
+
+	def _buildBackground( self ):
+		ratio = self.devicePixelRatioF()
+		pixmap = QPixmap( int(self.width()*ratio), int(self.height()*ratio) )
+		pixmap.setDevicePixelRatio( ratio )
+		pixmap.fill( Qt.GlobalColor.transparent )
+		painter = QPainter( pixmap )
+		painter.setRenderHint(QPainter.RenderHint.Antialiasing,True)
+
+		self._drawLabels( painter, [ (QColor(*color), self._labelRects(labels)) \
+									 for color, labels in self.labelList.items() ] )
+
 		for color in self.pointList:
 			c = QColor(color[0],color[1],color[2])
+			points = self.pointList[color]
+			xs, ys = self._toScreen( [p.x() for p in points], [p.y() for p in points] )
+			path = QPainterPath()
+			for x, y in zip( xs.tolist(), ys.tolist() ):
+				path.addEllipse( QPointF(x, y), self.CITY_SIZE, self.CITY_SIZE )
 			painter.setPen( c )
-			b = painter.brush()
-			painter.setBrush(c)
-			for point in self.pointList[color]:
-				pt = QPointF(scale*point.x(), scale*point.y())
-				painter.drawEllipse( pt, CITY_SIZE, CITY_SIZE)
-			painter.setBrush(b)
+			painter.setBrush( c )
+			painter.drawPath( path )
+		painter.end()
+		return pixmap
+
+	''' <summary>
+		Screen-space geometry for every edge colour: the lines (drawn with one
+		drawLines call), the arrowheads that pass the level-of-detail rule as a
+		single QPainterPath, and the edge labels.
+		</summary> '''
+	def _buildEdgeLayer( self ):
+		layer = []
+		edgeCount = sum( len(edges) for edges in self.edgeList.values() )
+		for color in self.edgeList:
+			c = QColor(color[0],color[1],color[2])
+			edges = self.edgeList[color]
+			x1, y1 = self._toScreen( [e.x1() for e in edges], [e.y1() for e in edges] )
+			x2, y2 = self._toScreen( [e.x2() for e in edges], [e.y2() for e in edges] )
+			lines = [ QLineF(*ln) for ln in zip(x1.tolist(), y1.tolist(), x2.tolist(), y2.tolist()) ]
+
+			arrows = None
+			length = np.hypot( x2-x1, y2-y1 )
+			show = length >= self.ARROW_MIN_PIXELS
+			if edgeCount <= self.MAX_ARROWS and show.any():
+				# tip at the end point, base 2*ARROW_SCALE back along the edge
+				ux, uy = (x2-x1)[show]/length[show], (y2-y1)[show]/length[show]
+				tx, ty = x2[show], y2[show]
+				a = self.ARROW_SCALE
+				arrows = QPainterPath()
+				for corners in zip( tx, ty, tx - a*(2*ux - uy), ty - a*(2*uy + ux), \
+										tx - a*(2*ux + uy), ty - a*(2*uy - ux) ):
+					corners = [ float(v) for v in corners ]
+					arrows.addPolygon( QPolygonF( [QPointF(corners[0],corners[1]), \
+												   QPointF(corners[2],corners[3]), \
+												   QPointF(corners[4],corners[5])] ) )
+					arrows.closeSubpath()
+			layer.append( (c, lines, arrows) )
+		labels = [ (QColor(*color), self._labelRects(labels)) for color, labels in self.edgeLabelList.items() ]
+		return layer, labels
+
+	def resizeEvent( self, event ):
+		self._background = None
+		self._edgeLayer = None
+		super(PointLineView,self).resizeEvent( event )
+
+	def paintEvent(self, event):
+		if self._background is None:
+			self._background = self._buildBackground()
+		if self._edgeLayer is None:
+			self._edgeLayer = self._buildEdgeLayer()
+		edgeLayer, edgeLabels = self._edgeLayer
+
+		painter = QPainter(self)
+		painter.setRenderHint(QPainter.RenderHint.Antialiasing,True)
+
+		for c, lines, arrows in edgeLayer:
+			painter.setPen( c )
+			painter.drawLines( lines )
+		for c, lines, arrows in edgeLayer:
+			if arrows is not None:
+				painter.setPen( c )
+				painter.fillPath( arrows, c )
+		self._drawLabels( painter, edgeLabels )
+
+		# Points and their labels go on top, as they always have
+		painter.drawPixmap( 0, 0, self._background )
+
+
+
+''' <summary>
+	Runs one solver call off the GUI thread.  Every BSSF improvement the solver
+	reports is forwarded through bssfImproved, and the final results dictionary
+	through solveFinished, or the error through solveFailed if the solver
+	raises; all are delivered on the GUI thread by Qt.
+	</summary> '''
+class SolverThread( QThread ):
+	bssfImproved = pyqtSignal( object )
+	solveFinished = pyqtSignal( object )
+	solveFailed = pyqtSignal( str )
+
+	def __init__( self, solver, method, time_allowance, instrument_dir=None ):
+		super(SolverThread,self).__init__()
+		self.solver = solver
+		self.method = method
+		self.time_allowance = time_allowance
+		self.instrument_dir = instrument_dir
+
+	def run( self ):
+		self.solver.setBSSFCallback( self.bssfImproved.emit )
+		instrumentation = None
+		if self.instrument_dir:
+			profiler = os.environ.get( 'TSP_PROFILER' ) or None
+			instrumentation = Instrumentation( profiler, bool(os.environ.get('TSP_TRACE_MEMORY')) )
+			self.solver.setInstrumentation( instrumentation )
+		try:
+			results = getattr( self.solver, self.method )( time_allowance=self.time_allowance )
+			if instrumentation is not None:
+				self._writeInstrumentation( instrumentation )
+		except Exception as error:
+			traceback.print_exc()
+			self.solveFailed.emit( '{}: {}'.format( type(error).__name__, error ) )
+			return
+		finally:
+			self.solver.setBSSFCallback( None )
+			self.solver.setInstrumentation( None )
+		self.solveFinished.emit( results )
+
+	def _writeInstrumentation( self, instrumentation ):
+		os.makedirs( self.instrument_dir, exist_ok=True )
+		base = os.path.join( self.instrument_dir, '%s-%s' % (time.strftime('%Y%m%d-%H%M%S'), self.method) )
+		instrumentation.writeJSON( base + '.json' )
+		instrumentation.writeChromeTrace( base + '.trace.json' )
+		if instrumentation.profiler == 'cprofile':
+			instrumentation.writeProfile( base + '.prof' )
+		elif instrumentation.profiler == 'sample':
+			instrumentation.writeProfile( base + '.folded' )
 
 
 
@@ -206,6 +324,13 @@ class Proj5GUI( QMainWindow ):
 		self._MAX_SEED = 1000
 
 		self._scenario = None
+		self._solverThread = None
+		# Set TSP_SCENARIO_CACHE to a directory to reuse generated scenarios
+		cache_dir = os.environ.get( 'TSP_SCENARIO_CACHE' )
+		self._scenarioCache = ScenarioCache( cache_dir ) if cache_dir else None
+		# Set TSP_INSTRUMENT_DIR to a directory to record every solve there
+		# (see TSPInstrument); TSP_PROFILER=cprofile or sample adds a profile
+		self._instrumentDir = os.environ.get( 'TSP_INSTRUMENT_DIR' )
 		self.initUI()
 		self.solver = TSPSolver( self.view )
 		self.genParams = {'size':None,'seed':None,'diff':None}
@@ -215,27 +340,18 @@ class Proj5GUI( QMainWindow ):
 	def newPoints(self):
 		# TODO - ERROR CHECKING!!!!
 		seed = int(self.curSeed.text())
-		random.seed( seed )
-
-		ptlist = []
-		RANGE = self.data_range
-		xr = self.data_range['x']
-		yr = self.data_range['y']
 		npoints = int(self.size.text())
-		while len(ptlist) < npoints:
-			x = random.uniform(0.0,1.0)
-			y = random.uniform(0.0,1.0)
-			if True:
-				xval = xr[0] + (xr[1]-xr[0])*x
-				yval = yr[0] + (yr[1]-yr[0])*y
-				ptlist.append( QPointF(xval,yval) )
-		return ptlist
+		return [ QPointF(x,y) for x, y in generatePoints( npoints, seed, self.data_range ) ]
 
 	def generateNetwork(self):
-		points = self.newPoints() # uses current rand seed
 		diff = self.diffDropDown.currentText()
 		rand_seed = int(self.curSeed.text())
-		self._scenario = Scenario( city_locations=points, difficulty=diff, rand_seed=rand_seed )
+		if self._scenarioCache and ScenarioCache.cacheable( diff, legacy=True ):
+			self._scenario = self._scenarioCache.get( int(self.size.text()), rand_seed, diff, \
+													  self.data_range, legacy=True )
+		else:
+			points = self.newPoints() # uses current rand seed
+			self._scenario = Scenario( city_locations=points, difficulty=diff, rand_seed=rand_seed )
 
 		self.genParams = {'size':self.size.text(),'seed':self.curSeed.text(),'diff':diff}
 		self.view.clearEdges()
@@ -271,7 +387,6 @@ class Proj5GUI( QMainWindow ):
 	def displaySolution( self ) :						# what about calling this somehow every time a new bssf is found?
 		self.view.clearEdges([(64,64,255)])				# get rid of edge labels but not point labels
 		if self._solution:
-			self.addCities()
 			edges = self._solution.enumerateEdges()
 			if edges:
 				edgeColor  = (128,128,255)
@@ -292,10 +407,11 @@ class Proj5GUI( QMainWindow ):
 		self.view.repaint()
 
 	def solveClicked(self):								# need to reset display??? and say "processing..." at bottom???
+		if self._solverThread:
+			return
 		self.solver.setupWithScenario(self._scenario)
 
 		max_time = float( self.timeLimit.text() )
-		# TODO - start on a separate thread
 		self.view.clearEdges([(64,64,255)])				# get rid of edge labels but not point labels
 		self.numSolutions.setText( '--' )
 		self.tourCost.setText( '--' )
@@ -304,35 +420,66 @@ class Proj5GUI( QMainWindow ):
 		self.totalStates.setText( '--' )
 		self.prunedStates.setText( '--' )
 		self.statusBar.showMessage('Processing...')
-		#self.view.repaint()
-		#app.processEvents()
-		solve_func = 'self.solver.'+self.ALGORITHMS[self.algDropDown.currentIndex()][1]
-		results = eval(solve_func)(time_allowance=max_time )
+
+		self._solverThread = SolverThread( self.solver, self.ALGORITHMS[self.algDropDown.currentIndex()][1], max_time, self._instrumentDir )
+		self._solverThread.bssfImproved.connect( self.bssfImproved )
+		self._solverThread.solveFinished.connect( self.solveFinished )
+		self._solverThread.solveFailed.connect( self.solveFailed )
+		self.solveButton.setEnabled(False)
+		self.generateButton.setEnabled(False)
+		self.cancelButton.setEnabled(True)
+		self._solverThread.start()
+
+	def cancelClicked(self):
+		if self._solverThread:
+			self.statusBar.showMessage('Cancelling...')
+			self.solver.requestCancel()
+
+	def showResults( self, results ):
+		self.numSolutions.setText( '{}'.format(results['count']) )
+		self.tourCost.setText( '{}'.format(results['cost']) )
+		self.solvedIn.setText( '{:6.6f} seconds'.format(results['time']) )
+		self._solution = results['soln']
+		if 'max' in results.keys():
+			self.maxQSize.setText( '{}'.format(results['max']))
+		if 'total' in results.keys():
+			self.totalStates.setText( '{}'.format(results['total']))
+		if 'pruned' in results.keys():
+			self.prunedStates.setText( '{}'.format(results['pruned']))
+		self.displaySolution()
+
+	def bssfImproved( self, results ):
+		self.showResults( results )
+		self.statusBar.showMessage('Processing... (cost {} after {:.2f} seconds)'.format(results['cost'],results['time']))
+
+	def _solverThreadDone( self ):
+		self._solverThread.wait()
+		self._solverThread = None
+		self.cancelButton.setEnabled(False)
+		self.checkGenInputs()
+
+	def solveFailed( self, message ):
+		self._solverThreadDone()
+		self.statusBar.showMessage( 'Solver failed: ' + message )
+
+	def solveFinished( self, results ):
+		self._solverThreadDone()
 		if results:
 			self.statusBar.showMessage('')
-			self.numSolutions.setText( '{}'.format(results['count']) )
-			self.tourCost.setText( '{}'.format(results['cost']) )
-			self.solvedIn.setText( '{:6.6f} seconds'.format(results['time']) )
-			self._solution = results['soln']
-			if 'max' in results.keys():
-				self.maxQSize.setText( '{}'.format(results['max']))
-			if 'total' in results.keys():
-				self.totalStates.setText( '{}'.format(results['total']))
-			if 'pruned' in results.keys():
-				self.prunedStates.setText( '{}'.format(results['pruned']))
-			#if self._solution:
-			self.displaySolution()
+			self.showResults( results )
 		else:
 			print( 'GOT NULL SOLUTION BACK!!' )		#probably shouldn't ever use this...
 		self.view.repaint()
-#		app.processEvents()
 
 	def checkGenInputs(self):
 		seed  = self.curSeed.text()
 		size = self.size.text()
 		diff = self.diffDropDown.currentText()
 
-		if self._scenario:
+		if self._solverThread:							# buttons come back when the solve finishes
+			self.generateButton.setEnabled(False)
+			self.solveButton.setEnabled(False)
+		elif self._scenario:
 			if self.genParams['seed'] == seed and \
 			   self.genParams['size'] == size and \
 			   self.genParams['diff'] == diff:
@@ -370,12 +517,7 @@ class Proj5GUI( QMainWindow ):
 
 		return '' if retval==None else retval
 
-	ALGORITHMS = [ \
-		('Default                            ','defaultRandomTour'), \
-		('Greedy','greedy'), \
-		('Branch and Bound','branchAndBound'), \
-		('Fancy','fancy') \
-	]															# whitespace hack to get longest to display correctly
+	ALGORITHMS = TSPSolver.ALGORITHMS
 
 	def initUI( self ):
 		self.setWindowTitle('Traveling Salesperson Problem')
@@ -390,14 +532,13 @@ class Proj5GUI( QMainWindow ):
 		self.setCentralWidget( boxwidget )
 
 
-		SCALE = 1.0
-		self.data_range		= { 'x':[-1.5*SCALE,1.5*SCALE], \
-								'y':[-SCALE,SCALE] }
+		self.data_range		= DEFAULT_DATA_RANGE
 		self.view			= PointLineView( self.statusBar, \
 											 self.data_range )
 		self.randSeedButton = QPushButton('Randomize Seed')
 		self.generateButton = QPushButton('Generate Scenario')
 		self.solveButton	= QPushButton('Solve TSP')
+		self.cancelButton	= QPushButton('Cancel')
 
 		self.curSeed		= QLineEdit('20')
 		self.curSeed.setFixedWidth(100)
@@ -466,6 +607,7 @@ class Proj5GUI( QMainWindow ):
 		h.addWidget( self.timeLimit )
 		h.addWidget( QLabel( 'seconds' ) )
 		h.addWidget( self.solveButton )
+		h.addWidget( self.cancelButton )
 		h.addStretch(1)
 		vbox.addLayout(h)
 
@@ -485,6 +627,7 @@ class Proj5GUI( QMainWindow ):
 
 		self.lastPath = (None,None)
 		self.solveButton.setEnabled(False)
+		self.cancelButton.setEnabled(False)
 
 		self.curSeed.textChanged.connect(self.checkGenInputs)
 		self.size.textChanged.connect(self.checkGenInputs)
@@ -492,6 +635,7 @@ class Proj5GUI( QMainWindow ):
 		self.randSeedButton.clicked.connect(self.randSeedClicked)
 		self.generateButton.clicked.connect(self.generateClicked)
 		self.solveButton.clicked.connect(self.solveClicked)
+		self.cancelButton.clicked.connect(self.cancelClicked)
 
 		self.diffDropDown.addItem('Easy                               ')					# Weird hack to make box wide enough to show all of last item
 		self.diffDropDown.addItem('Normal')
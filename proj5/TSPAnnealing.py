@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+
+
+import math
+import time
+
+import numpy as np
+
+from TSPLocalSearch import candidateLists
+
+
+
+class Annealing:
+
+	MIN_BLOCK = 256
+	MAX_BLOCK = 8192
+	ACCEPTED_PER_BLOCK = 16			# the block size is steered towards this many accepted moves
+	CANDIDATES = 8					# nearest cities a move's new edge is drawn from ...
+	RANDOM_MOVES = 0.1				# ... except for this fraction of moves, which take any city
+	INITIAL_ACCEPTANCE = 0.01		# chance of taking an average uphill move at the start
+	FINAL_TEMPERATURE = 1e-3		# last temperature, relative to the first
+	RESTARTS = 4					# the time is split evenly among this many runs ...
+	REHEAT = 0.5					# ... each starting this much cooler than the one before
+	STALL_MOVES = 50				# per city: moves in a row rejected before a run gives up early
+
+	''' <summary>
+		Simulated annealing of a feasible tour, an array of city indices, under
+		a (possibly asymmetric) cost matrix with np.inf for missing edges.
+
+		Moves are asymmetric 2-opt (reversing a stretch of the tour) and Or-opt
+		(moving a segment of up to three cities elsewhere without reversing
+		it), aimed so that one new edge goes to one of the CANDIDATES nearest
+		cities.  They are drawn and priced in blocks: the delta costs of a
+		whole block come from one gather from the cost matrix, plus prefix sums
+		of the forward and backward edge costs along the tour for the
+		reversals.  Each move is judged by the Metropolis rule, and the
+		accepted ones are applied in random order, except those whose edges
+		overlap a move already applied (their price is stale); moves with
+		disjoint edges don't change each other's price.  The block size follows the
+		acceptance rate, from a few hundred moves while hot to thousands once
+		cold.
+
+		The temperature falls geometrically from a start that accepts an
+		average uphill move with probability INITIAL_ACCEPTANCE to
+		FINAL_TEMPERATURE times that, on the wall clock, over the time left to
+		each run: the time to the deadline (an absolute time.time() value) is
+		split evenly among the RESTARTS runs still to go.  Every run starts
+		from the best tour so far, REHEAT times cooler than the one before,
+		and a run that rejects STALL_MOVES * n moves in a row ends early,
+		leaving its time to the others (runs go on past RESTARTS while there
+		is time).
+		</summary> '''
+	def __init__( self, cost_matrix, route, deadline, rng=None ):
+		self._cost = np.asarray( cost_matrix, dtype=np.float64 )
+		n = self._ncities = self._cost.shape[0]
+		self._rng = rng if rng is not None else np.random.default_rng()
+		self._deadline = deadline
+		self.best_route = np.array( route, dtype=np.intp )
+		self.best_cost = float( self._tourCost( self.best_route ) )
+		self.route = self.best_route.copy()
+		self.cost = self.best_cost
+		self.temperature = None
+		self.accepted = 0
+		self.rejected = 0
+		self.restarts = 0
+		self.improvements = 0
+		self._block = self.MIN_BLOCK
+		if n >= 5:
+			# Nearest successors and predecessors, padded with the city itself
+			# (which makes an invalid move)
+			self._out = self._padded( candidateLists( self._cost, self.CANDIDATES ) )
+			self._in = self._padded( candidateLists( self._cost.T, self.CANDIDATES ) )
+
+	def _padded( self, lists ):
+		n = self._ncities
+		near = np.tile( np.arange(n)[:,None], (1, min(self.CANDIDATES, n-1)) )
+		for city, row in enumerate( lists ):
+			near[city, :len(row)] = row
+		return near
+
+	def _tourCost( self, tour ):
+		return self._cost[ tour, np.roll(tour,-1) ].sum()
+
+	def _prefixSums( self ):
+		# Cumulative forward edge costs along the tour, twice round so that
+		# stretches may wrap, and the backward ones with their missing edges
+		# counted separately, so that differences stay finite
+		t = self.route
+		self._pos = np.empty( self._ncities, dtype=np.intp )
+		self._pos[t] = np.arange( self._ncities )
+		t2 = np.concatenate( (t, t) )
+		forward = self._cost[ t2[:-1], t2[1:] ]
+		backward = self._cost[ t2[1:], t2[:-1] ]
+		missing = np.isinf( backward )
+		self._forward = np.concatenate( ([0.0], np.cumsum( forward )) )
+		self._backward = np.concatenate( ([0.0], np.cumsum( np.where(missing, 0.0, backward) )) )
+		self._missing = np.concatenate( ([0], np.cumsum( missing )) )
+
+	def _partners( self, cities, near ):
+		# A random near city of each of cities, or for RANDOM_MOVES of them any city
+		count = len(cities)
+		partners = near[ cities, self._rng.integers( near.shape[1], size=count ) ]
+		anywhere = self._rng.random( count ) < self.RANDOM_MOVES
+		partners[anywhere] = self._rng.integers( self._ncities, size=anywhere.sum() )
+		return partners
+
+	def _reversals( self, count ):
+		# Reversing the stretch of length positions from a, after position p,
+		# so that the city at p is followed by a partner; changes edges p..p+length
+		n = self._ncities
+		t, C = self.route, self._cost
+		p = self._rng.integers( n, size=count )
+		a = (p + 1) % n
+		b = self._pos[ self._partners( t[p], self._out ) ]
+		length = (b - a) % n + 1
+		before, first, last, after = t[p], t[a], t[b], t[(b+1) % n]
+		end = a + length - 1
+		delta = C[before, last] + C[first, after] - C[before, first] - C[last, after] \
+				+ (self._backward[end] - self._backward[a]) - (self._forward[end] - self._forward[a])
+		delta[ (self._missing[end] != self._missing[a]) | (length < 2) | (length > n-1) ] = math.inf
+		return delta, p, length + 1
+
+	def _segmentMoves( self, count ):
+		# Moving the segment of length cities from position i to after a
+		# partner, the city at position j; changes edges i-1..j
+		n = self._ncities
+		t, C = self.route, self._cost
+		i = self._rng.integers( n, size=count )
+		length = self._rng.integers( 1, min(3, n-3) + 1, size=count )
+		j = self._pos[ self._partners( t[i], self._in ) ]
+		offset = (j - i - length) % n
+		before, first, last, after = t[i-1], t[i], t[(i+length-1) % n], t[(i+length) % n]
+		c, d = t[j], t[(j+1) % n]
+		delta = C[before, after] + C[c, first] + C[last, d] - C[before, first] - C[last, after] - C[c, d]
+		delta[ offset > n - length - 2 ] = math.inf
+		return delta, (i - 1) % n, length + offset + 2, length
+
+	''' <summary>
+		Delta costs of a block of count random moves from the current tour
+		(about half of each kind), the first edge and number of edges each one
+		changes, and, for applying them, the length of each Or-opt segment (0
+		for reversals).
+		</summary> '''
+	def _blockMoves( self, count ):
+		self._prefixSums()
+		reversals = self._rng.binomial( count, 0.5 )
+		reversal, p, reversal_span = self._reversals( reversals )
+		moved, i, moved_span, length = self._segmentMoves( count - reversals )
+		return np.concatenate( (reversal, moved) ), np.concatenate( (p, i) ), \
+			   np.concatenate( (reversal_span, moved_span) ), \
+			   np.concatenate( (np.zeros(reversals, dtype=length.dtype), length) )
+
+	''' <summary>
+		Applies the moves given by index, in that order, skipping any whose
+		edges overlap those of a move already applied.
+		</summary>
+		<returns>the indices of the moves applied</returns>
+	'''
+	def _apply( self, moves, start, span, segment ):
+		n = self._ncities
+		used = np.zeros( n, dtype=bool )
+		source = np.arange( n )
+		applied = []
+		for k in moves:
+			edges = (start[k] + np.arange( span[k] )) % n
+			if used[edges].any():
+				continue
+			used[edges] = True
+			positions = edges[1:]		# the cities between the first and the last edge
+			if segment[k] == 0:
+				source[positions] = positions[::-1]
+			else:
+				source[positions] = np.roll( positions, -segment[k] )
+			applied.append( k )
+		self.route = self.route[source]
+		return applied
+
+	def _startingTemperature( self ):
+		delta = self._blockMoves( self.MIN_BLOCK )[0]
+		uphill = delta[ (delta > 0) & (delta < math.inf) ]
+		if len(uphill) == 0:
+			return 1.0
+		return -float( uphill.mean() ) / math.log( self.INITIAL_ACCEPTANCE )
+
+	''' <summary>
+		The annealing as a generator: yields after every block of moves, True
+		if the best tour (best_route, best_cost) improved, and returns at the
+		deadline.
+		</summary> '''
+	def steps( self ):
+		n = self._ncities
+		if n < 5:
+			return
+		t0 = self._startingTemperature()
+		t_end = t0 * self.FINAL_TEMPERATURE
+		run = 0
+		while time.time() < self._deadline:
+			start = time.time()
+			end = start + (self._deadline - start) / max( 1, self.RESTARTS - run )
+			if run > 0:
+				self.restarts += 1
+				self.route = self.best_route.copy()
+				self.cost = self.best_cost
+			hot = max( t0 * self.REHEAT**min(run, self.RESTARTS-1), t_end )
+			run += 1
+			stalled = 0
+			while True:
+				now = time.time()
+				if now >= end or stalled >= self.STALL_MOVES * n:
+					break
+				self.temperature = hot * (t_end / hot) ** ((now - start) / (end - start))
+				delta, first_edge, span, segment = self._blockMoves( self._block )
+				threshold = -self.temperature * np.log( self._rng.random( len(delta) ) )
+				accept = np.flatnonzero( delta <= threshold )		# Metropolis: exp(-delta/T) > u
+				accept = self._rng.permutation( accept )			# the kinds of move come in two runs
+				applied = self._apply( accept, first_edge, span, segment ) if len(accept) else []
+				self.cost += float( delta[applied].sum() )
+				self.accepted += len(applied)
+				self.rejected += len(delta) - len(applied)
+				stalled = 0 if applied else stalled + len(delta)
+				self._block = int( np.clip( self._block * self.ACCEPTED_PER_BLOCK / max(1, len(accept)), \
+											self.MIN_BLOCK, self.MAX_BLOCK ) )
+				improved = self.cost < self.best_cost
+				if improved:
+					self.best_cost = self.cost
+					self.best_route = self.route.copy()
+					self.improvements += 1
+				yield improved
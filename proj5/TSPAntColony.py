@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+
+
+import math
+
+import numpy as np
+
+from TSPLocalSearch import candidateLists
+
+
+
+class AntColony:
+
+	ANTS = 32
+	ALPHA = 1.0				# weight of the pheromone ...
+	BETA = 3.0				# ... and of the visibility, 1/cost
+	RHO = 0.2				# fraction of the pheromone that evaporates every generation
+	GLOBAL_BEST_EVERY = 5	# deposit on the best tour so far every this many generations
+	STAGNATION = 50			# generations without improvement before the pheromone is reset
+	CANDIDATES = 16			# nearest cities an ant chooses among, while any is unvisited
+	Q0 = 0.9				# chance of taking the heaviest candidate instead of a roulette draw
+
+	''' <summary>
+		Max-min ant system over a (possibly asymmetric) cost matrix, using
+		np.inf for missing edges.  The pheromone tau and the visibility
+		eta = 1/cost are n x n matrices, and missing edges have zero
+		visibility, so they are never taken.
+
+		All the ants of a generation build their tours together: every step,
+		the weights tau^alpha * eta^beta from their current cities to their
+		CANDIDATES nearest cities are gathered at once, the visited ones are
+		zeroed out, and each ant takes the heaviest with probability q0 or
+		else picks by roulette over its row (one cumulative sum and one
+		comparison against a uniform draw per ant).  Ants whose candidates are
+		all visited choose the same way over the whole row.  Ants that
+		dead-end, with no edge left to an unvisited city, or that cannot get
+		back to their start are dropped.
+
+		After each generation the pheromone evaporates and the best tour of
+		the generation (or, every GLOBAL_BEST_EVERY generations, the best so
+		far) deposits 1/cost on its edges.  tau is kept within
+		[tau_max/(2n), tau_max] with tau_max = 1/(rho * best cost), and is
+		reset to tau_max after STAGNATION generations without improvement.
+		Costs below 1 count as 1 in tau_max and the deposits, as they do in
+		the visibility.
+
+		improve, if given, is a function from a tour to a tour that is no
+		worse (e.g. local search); it is applied to the best tour of every
+		generation before that tour deposits.
+		</summary> '''
+	def __init__( self, cost_matrix, ants=ANTS, alpha=ALPHA, beta=BETA, rho=RHO, q0=Q0, \
+				  candidates=CANDIDATES, bssf_route=None, bssf_cost=math.inf, rng=None, improve=None ):
+		self._cost = np.asarray( cost_matrix, dtype=np.float64 )
+		n = self._ncities = self._cost.shape[0]
+		self.ants = ants
+		self.alpha = alpha
+		self.rho = rho
+		self.q0 = q0
+		self._rng = rng if rng is not None else np.random.default_rng()
+		self._improve = improve
+		finite = np.isfinite( self._cost )
+		np.fill_diagonal( finite, False )
+		self._visibility = np.where( finite, 1.0 / np.maximum(self._cost, 1.0), 0.0 ) ** beta
+		# Candidate lists padded with the city itself, whose weight is always 0
+		near = candidateLists( self._cost, candidates ) if n > 1 else [[]]
+		self._near = np.tile( np.arange(n)[:,None], (1, max(1, min(candidates, n-1))) )
+		for city, row in enumerate( near ):
+			self._near[city, :len(row)] = row
+		self.best_route = None if bssf_route is None else np.asarray( bssf_route, dtype=np.intp )
+		self.best_cost = bssf_cost
+		self.generations = 0
+		self.tours = 0			# feasible tours built
+		self.improvements = 0
+		self._since_improvement = 0
+		if not self.best_cost < math.inf:
+			# No tour yet; any rough length estimate does for the bounds
+			self.best_cost = n * float( self._cost[finite].mean() ) if finite.any() else 1.0
+		self._pheromone = np.full( (n,n), self._tauMax() )
+
+	def _tauMax( self ):
+		return 1.0 / ( self.rho * max(self.best_cost, 1.0) )
+
+	def _weights( self ):
+		tau = self._pheromone if self.alpha == 1.0 else self._pheromone ** self.alpha
+		return tau * self._visibility
+
+	''' <summary>
+		Next column of every row of the non-negative weights w (each row with a
+		positive sum): the heaviest with probability q0, otherwise a roulette
+		draw in proportion to the weights.
+		</summary> '''
+	def _choose( self, w ):
+		cumulative = np.cumsum( w, axis=1 )
+		draw = self._rng.random( len(w) ) * cumulative[:,-1]
+		choice = np.minimum( (cumulative <= draw[:,None]).sum( axis=1 ), w.shape[1]-1 )
+		exploit = self._rng.random( len(w) ) < self.q0
+		choice[exploit] = w[exploit].argmax( axis=1 )
+		return choice
+
+	''' <summary>
+		Generator that builds one tour per ant, one step for all the ants per
+		yield, and returns (tours, costs) for the ants that completed a tour.
+		Ants choose among their current city's candidate list while any of it
+		is unvisited, and among all the unvisited cities otherwise.
+		</summary> '''
+	def _construct( self ):
+		n = self._ncities
+		weights = self._weights()
+		starts = self._rng.integers( n, size=self.ants )
+		tours = np.empty( (self.ants,n), dtype=np.intp )
+		tours[:,0] = starts
+		visited = np.zeros( (self.ants,n), dtype=bool )
+		visited[np.arange(self.ants), starts] = True
+		costs = np.zeros( self.ants )
+		current = starts
+
+		for step in range( 1, n ):
+			ants = np.arange( len(current) )
+			near = self._near[current]
+			w = weights[current[:,None], near]
+			w[ visited[ants[:,None], near] ] = 0.0
+			local = w.sum( axis=1 ) > 0.0
+			nxt = np.empty( len(current), dtype=np.intp )
+			nxt[local] = near[local, self._choose( w[local] )]
+
+			far = np.flatnonzero( ~local )
+			if len(far):
+				rows = weights[current[far]]
+				rows[visited[far]] = 0.0
+				alive = rows.sum( axis=1 ) > 0.0
+				nxt[far[alive]] = self._choose( rows[alive] )
+				if not alive.all():
+					keep = np.ones( len(current), dtype=bool )
+					keep[far[~alive]] = False
+					tours, visited, costs = tours[keep], visited[keep], costs[keep]
+					current, nxt, ants = current[keep], nxt[keep], ants[:keep.sum()]
+					if len(current) == 0:
+						break
+
+			costs += self._cost[current, nxt]
+			tours[:,step] = nxt
+			visited[ants, nxt] = True
+			current = nxt
+			yield
+
+		costs = costs + self._cost[tours[:,-1], tours[:,0]]
+		feasible = costs < math.inf
+		return tours[feasible], costs[feasible]
+
+	def _deposit( self, tour, cost ):
+		tau = self._pheromone
+		tau *= 1.0 - self.rho
+		tau[tour, np.roll(tour,-1)] += 1.0 / max( cost, 1.0 )
+		tau_max = self._tauMax()
+		np.clip( tau, tau_max / (2*self._ncities), tau_max, out=tau )
+
+	''' <summary>
+		The colony as a generator that yields after every construction step,
+		and True at the end of a generation that improved on the best tour
+		(best_route, best_cost).  It never returns, except at once for fewer
+		than 3 cities, which have only one tour.
+		</summary> '''
+	def steps( self ):
+		if self._ncities < 3:
+			return
+		while True:
+			tours, costs = yield from self._construct()
+			self.generations += 1
+			self.tours += len(costs)
+			improved = False
+			if len(costs) > 0:
+				best = costs.argmin()
+				if self._improve is not None:
+					tours[best] = self._improve( tours[best] )
+					costs[best] = self._cost[tours[best], np.roll(tours[best],-1)].sum()
+				if costs[best] < self.best_cost or self.best_route is None:
+					self.best_cost = float( costs[best] )
+					self.best_route = tours[best].copy()
+					self.improvements += 1
+					improved = True
+				if self.generations % self.GLOBAL_BEST_EVERY == 0:
+					self._deposit( self.best_route, self.best_cost )
+				else:
+					self._deposit( tours[best], costs[best] )
+			elif self.best_route is not None:
+				self._deposit( self.best_route, self.best_cost )
+
+			self._since_improvement = 0 if improved else self._since_improvement + 1
+			if self._since_improvement >= self.STAGNATION:
+				self._pheromone.fill( self._tauMax() )
+				self._since_improvement = 0
+			yield improved
@@ -0,0 +1,235 @@
+#!/usr/bin/python3
+
+
+import math
+import time
+
+
+
+''' <summary>
+	Everything an anytime solver has to show so far.  A solver owns one
+	Progress and updates it in place; improve() is how it publishes a new
+	BSSF.  The solution passed to improve() may be changed in place later
+	(e.g. by local search), so anyone keeping it must copy it.  Fields that
+	are not part of the standard results (e.g. 'memory' or 'lower_bound') go
+	in extra.  Solvers with a queue can set queue_size to a function
+	returning its current size, and name the phases they go through with
+	phase(); both are only used by instrumentation (see TSPInstrument).
+	</summary>
+'''
+class Progress:
+
+	def __init__( self ):
+		self.soln = None
+		self.count = 0
+		self.max = None
+		self.total = None
+		self.pruned = None
+		self.extra = {}
+		self.improvements = 0
+		self.queue_size = None
+		self.on_phase = None
+
+	def improve( self, soln, count=None ):
+		self.soln = soln
+		if count is not None:
+			self.count = count
+		self.improvements += 1
+
+	def phase( self, name ):
+		if self.on_phase is not None:
+			self.on_phase( name )
+
+
+
+# What a solver step yields to have the clock look at the time after it (see
+# Clock.expired), instead of None or any other value
+EXPENSIVE_STEP = object()
+
+
+
+''' <summary>
+	Deadline and cancellation checks that are cheap enough to make on every
+	step of a solver.  The clock is only read every stride-th call to
+	expired(), and the stride adapts so that reads come about CHECK_INTERVAL
+	seconds apart: after every read it is set to the number of steps that
+	fit in CHECK_INTERVAL at the pace just measured, but no more than double
+	what it was.  A solver whose steps can suddenly get much slower (e.g. a
+	branch-and-bound expansion after a run of pruned states) marks those
+	steps with expired( expensive=True ), which looks at the time after
+	every one of them, so the deadline is never overshot by more than one.
+	should_stop(), and on_read() if given, are called at every full read,
+	which still come no more than about every CHECK_INTERVAL.
+	</summary>
+'''
+class Clock:
+
+	CHECK_INTERVAL = 0.005		# seconds aimed for between clock reads
+	MAX_STRIDE = 1024
+
+	def __init__( self, deadline, should_stop=None, on_read=None ):
+		self.deadline = deadline
+		self._should_stop = should_stop
+		self._on_read = on_read
+		self.stopped = False
+		self.reads = 0
+		self._steps = 0
+		self.now = time.time()
+		self._stride = 1
+		self._countdown = 1
+
+	@property
+	def steps( self ):
+		# calls to expired() so far
+		return self._steps + self._stride - self._countdown
+
+	def expired( self, expensive=False ):
+		self._countdown -= 1
+		if self._countdown > 0:
+			if not expensive:
+				return False
+			now = time.time()
+			if now < self.deadline and now - self.now < self.CHECK_INTERVAL:
+				return False
+		return self.check()
+
+	''' <summary>
+		Reads the clock now, whatever the stride.
+		</summary>
+		<returns>True if the deadline has passed or should_stop() says so</returns>
+	'''
+	def check( self ):
+		now = time.time()
+		self.reads += 1
+		steps = self._stride - self._countdown
+		self._steps += steps
+		interval = now - self.now
+		fits = self.MAX_STRIDE if interval <= 0 else int( self.CHECK_INTERVAL * steps / interval )
+		self._stride = max( 1, min( 2*self._stride, fits, self.MAX_STRIDE ) )
+		self._countdown = self._stride
+		self.now = now
+		if self._on_read is not None:
+			self._on_read()
+		if now >= self.deadline or (self._should_stop is not None and self._should_stop()):
+			self.stopped = True
+		return self.stopped
+
+
+
+''' <summary>
+	Runs the generator steps until it returns or the deadline (an absolute
+	time.time() value) passes.
+	</summary>
+	<returns>the generator's return value, or None if it was stopped first</returns>
+'''
+def runUntil( steps, deadline, should_stop=None ):
+	clock = Clock( deadline, should_stop )
+	try:
+		while True:
+			value = next( steps )
+			if clock.expired( value is EXPENSIVE_STEP ):
+				return None
+	except StopIteration as stop:
+		return stop.value
+	finally:
+		steps.close()
+
+
+
+''' <summary>
+	Shared driver for anytime solvers.  A solver is a generator function
+	solver( progress, deadline, *args ) that updates progress (see Progress)
+	and yields every time it has done a small piece of work: EXPENSIVE_STEP
+	after a piece that may have been much slower than the ones before (see
+	Clock), any other value otherwise.
+	The driver owns the time limit: it starts the clock, checks the deadline
+	and should_stop() between steps (see Clock), timestamps every
+	improvement and closes the generator, so its finally blocks run, when
+	time is up or the solve is cancelled.  The deadline is passed to the
+	solver only for work it hands off elsewhere (e.g. to worker processes).
+
+	on_improvement( progress, elapsed ) is called after every improvement.
+	instrumentation, a TSPInstrument.Instrumentation that has been started,
+	is fed the solver's phases, improvements and a sample at every clock
+	read.
+	</summary>
+'''
+class AnytimeDriver:
+
+	def __init__( self, time_allowance=60.0, should_stop=None, on_improvement=None, instrumentation=None ):
+		self.time_allowance = time_allowance
+		self._should_stop = should_stop
+		self._on_improvement = on_improvement
+		self._instrumentation = instrumentation
+		self._cancelled = False
+		self.start_time = None
+		self.clock = None
+		self.trace = []
+
+	''' <summary>
+		Stops the solve at the next clock read.  Safe to call from another thread.
+		</summary> '''
+	def cancel( self ):
+		self._cancelled = True
+
+	def _stopRequested( self ):
+		return self._cancelled or (self._should_stop is not None and self._should_stop())
+
+	def _improved( self, progress ):
+		elapsed = time.time() - self.start_time
+		cost = progress.soln.cost if progress.soln is not None else math.inf
+		self.trace.append( (elapsed, float(cost), progress.count) )
+		if self._instrumentation is not None:
+			self._instrumentation.improved( progress )
+		if self._on_improvement:
+			self._on_improvement( progress, elapsed )
+
+	''' <summary>
+		Runs solver( progress, deadline, *args, **kwargs ) until it returns,
+		time_allowance seconds have passed or the solve is stopped.
+		</summary>
+		<returns>results dictionary: cost, time, count, soln, max, total and
+		pruned as the solver left them, anything in progress.extra, and
+		'trace', the (time, cost, count) of every improvement (a
+		time-to-target curve)</returns>
+	'''
+	def run( self, solver, *args, **kwargs ):
+		self.start_time = time.time()
+		self.trace = []
+		progress = Progress()
+		instrumentation = self._instrumentation
+		on_read = None
+		if instrumentation is not None:
+			progress.on_phase = instrumentation.phase
+			on_read = lambda: instrumentation.sample( progress )
+		self.clock = clock = Clock( self.start_time + self.time_allowance, self._stopRequested, on_read )
+		seen = 0
+		steps = solver( progress, clock.deadline, *args, **kwargs )
+		try:
+			if not clock.check():
+				for value in steps:
+					if progress.improvements != seen:
+						seen = progress.improvements
+						self._improved( progress )
+					if clock.expired( value is EXPENSIVE_STEP ):
+						break
+		finally:
+			steps.close()
+		if progress.improvements != seen:		# improved on its last step
+			self._improved( progress )
+		if instrumentation is not None:
+			instrumentation.driverFinished( clock )
+		return self.results( progress )
+
+	def results( self, progress ):
+		results = {}
+		results['cost'] = progress.soln.cost if progress.soln is not None else math.inf
+		results['time'] = time.time() - self.start_time
+		results['count'] = progress.count
+		results['soln'] = progress.soln
+		results['max'] = progress.max
+		results['total'] = progress.total
+		results['pruned'] = progress.pruned
+		results.update( progress.extra )
+		results['trace'] = self.trace
+		return results
@@ -0,0 +1,407 @@
+#!/usr/bin/python3
+
+
+import heapq
+import itertools
+import multiprocessing
+import queue
+import time
+
+import numpy as np
+
+from TSPAnytime import Clock
+
+
+
+''' <summary>
+	Row/column reduction of a stack of cost matrices (shape k x n x n), done in
+	place.  Rows and columns that are entirely INF (cities that have already been
+	left/entered) do not contribute to the reduction.
+	</summary>
+	<returns>array of k reduction amounts, one per matrix</returns>
+'''
+def reduceMatrices( matrices ):
+	row_min = matrices.min( axis=2 )
+	row_min[ np.isinf(row_min) ] = 0.0
+	matrices -= row_min[:,:,None]
+	col_min = matrices.min( axis=1 )
+	col_min[ np.isinf(col_min) ] = 0.0
+	matrices -= col_min[:,None,:]
+	return row_min.sum( axis=1 ) + col_min.sum( axis=1 )
+
+
+
+class BBState:
+	__slots__ = ( 'bound', 'path', 'matrix' )
+
+	def __init__( self, bound, path, matrix ):
+		self.bound = bound		# lower bound on any tour that extends path
+		self.path = path		# list of city indices, path[0] is the start city
+		self.matrix = matrix	# reduced cost matrix for the remaining choices
+
+
+
+class BranchAndBound:
+
+	LOWER_BOUND_DEPTH = 0.2		# fraction of the cities a path may cover and still be checked
+	EXPAND_BYTES = 64<<20		# most bytes of child matrices built at once
+
+	''' <summary>
+		Reduced-cost-matrix branch and bound over a (possibly asymmetric) cost
+		matrix, using np.inf for missing edges.  The queue is a heapq ordered by
+		bound, with deeper states first among equal bounds.
+
+		If lower_bound (a TSPLowerBound.LowerBound for the same matrix) is
+		given, shallow states (paths over at most LOWER_BOUND_DEPTH of the
+		cities) are also checked against the 1-arborescence bound on tours
+		starting with their path, using the Lagrangian penalties found so far,
+		before they are expanded.  That bound costs far more than a matrix
+		reduction and gains least on deep states, which are the bulk of the
+		queue.
+
+		With max_matrices, states queued while the queue already holds that
+		many keep only their path, and get their matrix back (see pathState)
+		when they are taken off the queue, which bounds the memory the queue
+		takes to about max_matrices cost matrices.
+		</summary> '''
+	def __init__( self, cost_matrix, bssf_route=None, bssf_cost=np.inf, lower_bound=None, max_matrices=None ):
+		self._cost = np.asarray( cost_matrix, dtype=np.float64 )
+		self._ncities = self._cost.shape[0]
+		self.bssf_route = bssf_route
+		self.bssf_cost = bssf_cost
+		self.count = 0			# number of times the BSSF was improved
+		self.max_queue = 0
+		self.total = 0			# number of states created (including the root)
+		self.pruned = 0
+		self._queue = []
+		self._expanding = None	# [state, chunks of its edges left to expand] once started
+		self._seeded = False
+		self._tiebreak = itertools.count()
+		self.lower_bound = lower_bound
+		self._bound_depth = max( 1, int(self.LOWER_BOUND_DEPTH * self._ncities) )
+		self._max_matrices = max_matrices
+
+	def _routeCost( self, path ):
+		idx = np.array( path )
+		return self._cost[ idx, np.roll(idx,-1) ].sum()
+
+	def _push( self, state ):
+		if self._max_matrices is not None and len(self._queue) >= self._max_matrices:
+			state.matrix = None
+		heapq.heappush( self._queue, (state.bound, -len(state.path), next(self._tiebreak), state) )
+		if len(self._queue) > self.max_queue:
+			self.max_queue = len(self._queue)
+
+	def matrixBytes( self ):
+		return self._cost.nbytes
+
+	def queueSize( self ):
+		return len(self._queue)
+
+	def _rootState( self, start=0 ):
+		matrix = self._cost.copy()[None]
+		bound = reduceMatrices( matrix )[0]
+		self.total += 1
+		return BBState( bound, [start], matrix[0] )
+
+	''' <summary>
+		The state for path (a list of city indices, path[0] the start city),
+		rebuilt from the cost matrix instead of its parent's: the rows left and
+		columns entered by the path, and the edge back to the start, are set to
+		INF and what remains is reduced.  The bound is still a lower bound on
+		every tour that extends path, though not always the same one the
+		parent's reduced matrix would give.
+		</summary> '''
+	def pathState( self, path ):
+		matrix = self._cost.copy()
+		fixed = self._cost[ path[:-1], path[1:] ].sum()
+		matrix[ path[:-1], : ] = np.inf
+		matrix[ :, path[1:] ] = np.inf
+		matrix[ path[-1], path[0] ] = np.inf
+		bound = fixed + reduceMatrices( matrix[None] )[0]
+		return BBState( bound, list(path), matrix )
+
+	''' <summary>
+		Queues the states for paths (e.g. split off another search) instead of
+		the root state.  States not below the BSSF are pruned right away.
+		</summary> '''
+	def seed( self, paths ):
+		self._seeded = True
+		for path in paths:
+			state = self.pathState( path )
+			if state.bound < self.bssf_cost:
+				self._push( state )
+			else:
+				self.pruned += 1
+
+	''' <summary>
+		Takes up to count states off the queue for another search (every one
+		with count=None, after finishing any state part expanded): every other one of the best 2*count, so that both
+		searches keep work as promising as the other's.
+		</summary>
+		<returns>the paths of the states taken, best bound first</returns>
+	'''
+	def split( self, count=None ):
+		if count is None:
+			while self._expanding is not None:
+				self._expandNext()
+			return [ heapq.heappop( self._queue )[-1].path for _ in range(len(self._queue)) ]
+		taken = []
+		kept = []
+		while len(taken) < count and len(self._queue) >= 2:
+			kept.append( heapq.heappop( self._queue ) )
+			taken.append( heapq.heappop( self._queue )[-1].path )
+		for entry in kept:
+			heapq.heappush( self._queue, entry )
+		return taken
+
+	''' <summary>
+		The outgoing edges of state to expand, in chunks: each chunk's children
+		are created at once (see _expandChunk), and chunks hold at most
+		EXPAND_BYTES of matrices, so a state with hundreds of outgoing edges
+		doesn't need hundreds of matrices at once.
+		</summary> '''
+	def _chunks( self, state ):
+		M = state.matrix
+		dsts = np.nonzero( np.isfinite(M[state.path[-1]]) )[0]
+		self.total += len(dsts)
+		chunk = max( 1, self.EXPAND_BYTES // M.nbytes )
+		return [ dsts[c:c+chunk] for c in range( 0, len(dsts), chunk ) ]
+
+	''' <summary>
+		Creates the children of state along the edges to dsts: one matrix copy
+		per edge, then a single vectorized reduction over the whole stack.
+		</summary> '''
+	def _expandChunk( self, state, dsts ):
+		M = state.matrix
+		src = state.path[-1]
+		start = state.path[0]
+		k = len(dsts)
+		rows = np.arange(k)
+
+		children = np.repeat( M[None], k, axis=0 )
+		children[:,src,:] = np.inf
+		children[rows,:,dsts] = np.inf
+		children[rows,dsts,start] = np.inf		# no returning home before the tour is complete
+		bounds = state.bound + M[src,dsts] + reduceMatrices( children )
+
+		depth = len(state.path) + 1
+		for c in np.argsort( bounds, kind='stable' ):
+			if not bounds[c] < self.bssf_cost:
+				self.pruned += 1
+				continue
+			path = state.path + [int(dsts[c])]
+			if depth == self._ncities:
+				cost = self._routeCost( path )
+				if cost < self.bssf_cost:
+					self.bssf_cost = cost
+					self.bssf_route = path
+					self.count += 1
+			else:
+				# A copy, so the chunk's pruned children don't stay in memory with it
+				self._push( BBState( bounds[c], path, children[c].copy() if k > 1 else children[c] ) )
+
+	''' <summary>
+		The search as a generator: yields after every state taken off the queue
+		and every chunk of children created (True if the BSSF improved on that
+		step), and returns True once the queue is exhausted and the BSSF is
+		therefore optimal.  Closing it early leaves the engine as it was, with
+		a state part expanded if need be, so the search can be resumed with a
+		new generator.
+		</summary> '''
+	def steps( self ):
+		if self._ncities < 2:
+			return True
+		if not self._seeded:
+			self._seeded = True
+			self._push( self._rootState() )
+		while self._queue or self._expanding is not None:
+			if self._expanding is None:
+				bound, _, _, state = heapq.heappop( self._queue )
+				if not bound < self.bssf_cost:
+					self.pruned += 1
+					yield False
+					continue
+				if self.lower_bound is not None and len(state.path) <= self._bound_depth:
+					if not self.lower_bound.pathBound( state.path ) < self.bssf_cost:
+						self.pruned += 1
+						yield False
+						continue
+				if state.matrix is None:
+					state = self.pathState( state.path )
+				self._expanding = [ state, self._chunks( state ) ]
+			count = self.count
+			self._expandNext()
+			yield self.count != count
+		return True
+
+	def _expandNext( self ):
+		state, chunks = self._expanding
+		if chunks:
+			self._expandChunk( state, chunks.pop(0) )
+		if not chunks:
+			self._expanding = None
+
+	def finished( self ):
+		return not self._queue and self._expanding is None
+
+	def expanding( self ):
+		# A state is part expanded: its other children are still to come
+		return self._expanding is not None
+
+	''' <summary>
+		Runs the search until the queue is exhausted (the BSSF is then optimal),
+		time_allowance seconds have passed, or should_stop() returns True.
+		on_improvement() is called every time the BSSF improves.
+		</summary>
+		<returns>True if the search finished, i.e. the BSSF is proven optimal</returns>
+	'''
+	def search( self, time_allowance=60.0, should_stop=None, on_improvement=None ):
+		start_time = time.time()
+		for improved in self.steps():
+			if improved and on_improvement:
+				on_improvement()
+			if time.time()-start_time >= time_allowance or (should_stop and should_stop()):
+				break
+		return self.finished()
+
+
+
+class SharedSearch:
+
+	STEAL_STATES = 64			# most states handed over to an idle worker at once
+	IDLE_WAIT = 0.01			# seconds an idle worker waits for work before checking again
+
+	# Slots of the shared values, then STATS per worker
+	COST, IMPROVEMENTS, BUSY, HUNGRY, OFFERED, STOP = range( 6 )
+	TOTAL, PRUNED, MAX_QUEUE, STOLEN, DONATED = range( 5 )
+	STATS = 5
+
+	''' <summary>
+		What the worker processes of a parallel branch and bound share: the
+		incumbent (cost and route) in shared memory, which every worker prunes
+		against as soon as another one improves it, and a queue of work for
+		idle workers.  A worker that runs out of states says so (HUNGRY), and a
+		busy one hands it up to STEAL_STATES of its own.  BUSY counts the
+		workers with states plus the hand-overs on their way, so it only drops
+		to 0 once the whole tree has been searched.  Counters of every worker
+		are published in its own slots for the parent process to add up.
+
+		Made in the parent process and passed to the workers as they start
+		(e.g. through a pool initializer).  Values are read without the lock,
+		and changed under it.
+		</summary> '''
+	def __init__( self, ncities, workers, bssf_route=None, bssf_cost=np.inf ):
+		self._lock = multiprocessing.Lock()
+		self._raw_values = multiprocessing.RawArray( 'd', 6 + self.STATS*workers )
+		self._raw_route = multiprocessing.RawArray( 'q', ncities )
+		self._work = multiprocessing.Queue()
+		self._views()
+		self._values[self.COST] = bssf_cost
+		self._values[self.BUSY] = workers		# each worker counts itself out when it first runs dry
+		if bssf_route is not None:
+			self._route[:] = bssf_route
+
+	def _views( self ):
+		self._values = np.frombuffer( self._raw_values, dtype=np.float64 )
+		self._route = np.frombuffer( self._raw_route, dtype=np.int64 )
+
+	def __getstate__( self ):
+		state = self.__dict__.copy()
+		del state['_values'], state['_route']
+		return state
+
+	def __setstate__( self, state ):
+		self.__dict__.update( state )
+		self._views()
+
+	@property
+	def cost( self ):
+		return self._values[self.COST]
+
+	@property
+	def improvements( self ):
+		return int( self._values[self.IMPROVEMENTS] )
+
+	def route( self ):
+		with self._lock:
+			return self._route.tolist()
+
+	''' <summary>
+		Counters of every worker, one row each, columns TOTAL to DONATED.
+		</summary> '''
+	def stats( self ):
+		return self._values[6:].reshape( -1, self.STATS ).copy()
+
+	def stop( self ):
+		self._values[self.STOP] = 1
+
+	def stopped( self ):
+		return self._values[self.STOP] != 0
+
+	def _publish( self, engine ):
+		with self._lock:
+			if engine.bssf_cost < self._values[self.COST]:
+				self._values[self.COST] = engine.bssf_cost
+				self._route[:] = engine.bssf_route
+				self._values[self.IMPROVEMENTS] += 1
+
+	def _donate( self, engine ):
+		with self._lock:
+			if not self._values[self.HUNGRY] > self._values[self.OFFERED]:
+				return 0
+			self._values[self.OFFERED] += 1
+			self._values[self.BUSY] += 1
+		paths = engine.split( min(self.STEAL_STATES, engine.queueSize()//2) )
+		self._work.put( paths )
+		return len(paths)
+
+	''' <summary>
+		Runs engine (a BranchAndBound) as the given worker (0 to workers-1),
+		starting from paths (maybe none), until the whole tree is searched, the deadline passes or stop() is
+		called, stealing work from the other workers whenever it runs out.
+		</summary>
+		<returns>True if the whole tree was searched</returns>
+	'''
+	def run( self, engine, worker, paths, deadline ):
+		stats = self._values[ 6 + self.STATS*worker : 6 + self.STATS*(worker+1) ]
+		clock = Clock( deadline, should_stop=self.stopped )
+		engine.bssf_cost = min( engine.bssf_cost, self.cost )
+		engine.seed( paths )
+		try:
+			while True:
+				for improved in engine.steps():
+					if improved:
+						self._publish( engine )
+					if self.cost < engine.bssf_cost:
+						engine.bssf_cost = self.cost
+					if engine.queueSize() >= 2 and self._values[self.HUNGRY] > self._values[self.OFFERED]:
+						stats[self.DONATED] += self._donate( engine )
+					stats[self.TOTAL] = engine.total
+					stats[self.PRUNED] = engine.pruned
+					stats[self.MAX_QUEUE] = engine.max_queue
+					if clock.expired( expensive=True ):
+						return False
+
+				# Out of states: wait for some, unless nobody has any left
+				with self._lock:
+					self._values[self.BUSY] -= 1
+					self._values[self.HUNGRY] += 1
+				while True:
+					try:
+						paths = self._work.get( timeout=self.IDLE_WAIT )
+						break
+					except queue.Empty:
+						if self._values[self.BUSY] == 0:
+							return True
+						if clock.check():
+							return False
+				with self._lock:
+					self._values[self.HUNGRY] -= 1
+					self._values[self.OFFERED] -= 1
+				stats[self.STOLEN] += len(paths)
+				engine.bssf_cost = min( engine.bssf_cost, self.cost )
+				engine.seed( paths )
+		finally:
+			# Hand-overs nobody will take must not keep this process from exiting
+			self._work.cancel_join_thread()
@@ -5,38 +5,227 @@ import math
 import numpy as np
 import random
 import time
+from TSPEdgeMask import PackedEdgeMask, ImplicitEdgeMask
+from TSPCostOracle import CostOracle
 
 
 
 class TSPSolution:
+
+	''' <summary>
+		A tour stored as an index permutation of the scenario's cities (perm),
+		the inverse lookup (pos[city] = position of city in perm) and the cached
+		tour cost.  route and enumerateEdges still give the City-based view the
+		GUI uses.
+
+		The *Delta methods price a move against the cached state without
+		changing anything; the matching apply* methods perform it in place and
+		update the cost by the delta.  Positions wrap around the tour.  Swap,
+		insert and segment moves are O(1) to price; reversals are O(1) from
+		prefix sums of the forward and backward edge costs, which are rebuilt
+		(O(n), vectorized) the first time they are needed after a change.
+		Moves are priced relative to a feasible tour; moves that would use a
+		missing edge price as np.inf.
+		</summary> '''
 	def __init__( self, listOfCities):
-		self.route = listOfCities
-		self.cost = self._costOfRoute()
+		scenario = listOfCities[0]._scenario
+		perm = np.fromiter( (c._index for c in listOfCities), dtype=np.intp, count=len(listOfCities) )
+		self._setup( scenario, perm )
+		self._route = listOfCities
 		#print( [c._index for c in listOfCities] )
 
+	@classmethod
+	def fromIndices( cls, scenario, perm ):
+		soln = cls.__new__( cls )
+		soln._setup( scenario, np.array(perm, dtype=np.intp) )
+		return soln
+
+	def _setup( self, scenario, perm ):
+		self._scenario = scenario
+		self._matrix = scenario.getCosts()
+		self.perm = perm
+		self.pos = np.empty( len(perm), dtype=np.intp )
+		self.pos[perm] = np.arange( len(perm) )
+		self._cost = self._edgeCosts().sum()
+		self._route = None
+		self._prefix = None
+
+	@property
+	def route( self ):
+		if self._route is None:
+			cities = self._scenario.getCities()
+			self._route = [ cities[i] for i in self.perm ]
+		return self._route
+
+	@property
+	def cost( self ):
+		return np.inf if self._cost == np.inf else int(self._cost)
+
+	def _edgeCosts( self ):
+		# Cost of every edge of the tour (including the closing edge), gathered
+		# from the scenario's precomputed cost matrix in one shot
+		return self._matrix[self.perm, np.roll(self.perm,-1)]
+
 	def _costOfRoute( self ):
-		cost = 0
-		last = self.route[0]
-		for city in self.route[1:]:
-			cost += last.costTo(city)
-			last = city
-		cost += self.route[-1].costTo( self.route[0] )
-		return cost
+		cost = self._edgeCosts().sum()
+		return np.inf if cost == np.inf else int(cost)
 
 	def enumerateEdges( self ):
-		elist = []
-		c1 = self.route[0]
-		for c2 in self.route[1:]:
-			dist = c1.costTo( c2 )
-			if dist == np.inf:
-				return None
-			elist.append( (c1, c2, int(math.ceil(dist))) )
-			c1 = c2
-		dist = self.route[-1].costTo( self.route[0] )
-		if dist == np.inf:
+		costs = self._edgeCosts()
+		if np.isinf(costs).any():
 			return None
-		elist.append( (self.route[-1], self.route[0], int(math.ceil(dist))) )
-		return elist
+		route = self.route
+		nxt = route[1:] + route[:1]
+		return [ (c1, c2, int(dist)) for c1, c2, dist in zip(route, nxt, costs) ]
+
+	def _changed( self ):
+		self._route = None
+		self._prefix = None
+
+	def _edgesCost( self, edges ):
+		total = 0.0
+		for a, b in edges:
+			total += self._matrix[a,b]
+		return total
+
+	def _moveDelta( self, positions, new_city_at ):
+		# Generic O(1) pricing: the edges leaving each of the given positions,
+		# before and after a move that puts new_city_at(p) at position p
+		n = len(self.perm)
+		perm = self.perm
+		positions = { p % n for p in positions }
+		old = [ (perm[p], perm[(p+1)%n]) for p in positions ]
+		new = [ (new_city_at(p), new_city_at((p+1)%n)) for p in positions ]
+		added = self._edgesCost( new )
+		if added == np.inf:
+			return np.inf
+		return added - self._edgesCost( old )
+
+	''' <summary>
+		Exchanging the cities at positions i and j.
+		</summary> '''
+	def swapDelta( self, i, j ):
+		n = len(self.perm)
+		i, j = i % n, j % n
+		if i == j:
+			return 0.0
+		perm = self.perm
+		def new_city_at( p ):
+			return perm[j] if p == i else perm[i] if p == j else perm[p]
+		return self._moveDelta( (i-1, i, j-1, j), new_city_at )
+
+	def applySwap( self, i, j ):
+		n = len(self.perm)
+		i, j = i % n, j % n
+		delta = self.swapDelta( i, j )
+		self.perm[i], self.perm[j] = self.perm[j], self.perm[i]
+		self.pos[self.perm[i]] = i
+		self.pos[self.perm[j]] = j
+		self._cost += delta
+		self._changed()
+		return delta
+
+	''' <summary>
+		Moving the segment at positions i..j (inclusive, i <= j, not wrapping)
+		to sit between the cities at positions k and k+1, keeping its direction.
+		k must be outside i-1..j.
+		</summary> '''
+	def segmentMoveDelta( self, i, j, k ):
+		n = len(self.perm)
+		k = k % n
+		if i-1 <= k <= j or (i == 0 and k == n-1):
+			return 0.0
+		perm = self.perm
+		M = self._matrix
+		prev, first, last, nxt = perm[i-1], perm[i], perm[j], perm[(j+1)%n]
+		x, y = perm[k], perm[(k+1)%n]
+		added = M[prev,nxt] + M[x,first] + M[last,y]
+		if added == np.inf:
+			return np.inf
+		return added - M[prev,first] - M[last,nxt] - M[x,y]
+
+	def applySegmentMove( self, i, j, k ):
+		n = len(self.perm)
+		k = k % n
+		delta = self.segmentMoveDelta( i, j, k )
+		if i-1 <= k <= j or (i == 0 and k == n-1):
+			return delta
+		perm = self.perm
+		segment = perm[i:j+1].copy()
+		if k > j:
+			perm[i:k-(j-i)] = perm[j+1:k+1]
+			perm[k-(j-i):k+1] = segment
+			lo, hi = i, k+1
+		else:
+			perm[k+1+(j-i+1):j+1] = perm[k+1:i]
+			perm[k+1:k+1+(j-i+1)] = segment
+			lo, hi = k+1, j+1
+		self.pos[perm[lo:hi]] = np.arange( lo, hi )
+		self._cost += delta
+		self._changed()
+		return delta
+
+	''' <summary>
+		Moving the single city at position i to sit between the cities at
+		positions k and k+1.
+		</summary> '''
+	def insertDelta( self, i, k ):
+		return self.segmentMoveDelta( i, i, k )
+
+	def applyInsert( self, i, k ):
+		return self.applySegmentMove( i, i, k )
+
+	def _prefixSums( self ):
+		if self._prefix is None:
+			perm = self.perm
+			forward = self._matrix[perm[:-1], perm[1:]]
+			backward = self._matrix[perm[1:], perm[:-1]]
+			# INF backward edges are counted separately so that sums over
+			# feasible segments never see inf-inf
+			bwd_missing = np.isinf( backward )
+			self._prefix = ( np.concatenate( ([0.0], np.cumsum(forward)) ),
+							 np.concatenate( ([0.0], np.cumsum(np.where(bwd_missing,0.0,backward))) ),
+							 np.concatenate( ([0], np.cumsum(bwd_missing)) ) )
+		return self._prefix
+
+	''' <summary>
+		Reversing the cities at positions i..j (inclusive, 0 <= i < j < n).
+		Every edge inside the segment changes direction, which is what makes
+		this move non-trivial for asymmetric costs.
+		</summary> '''
+	def reverseDelta( self, i, j ):
+		n = len(self.perm)
+		if j <= i:
+			return 0.0
+		fwd, bwd, bwd_missing = self._prefixSums()
+		# edges inside the segment are the ones leaving positions i..j-1
+		if bwd_missing[j] - bwd_missing[i] > 0:
+			return np.inf
+		inside_new = bwd[j] - bwd[i]
+		inside_old = fwd[j] - fwd[i]
+		perm = self.perm
+		M = self._matrix
+		first, last = perm[i], perm[j]
+		if j-i+1 == n:
+			old_close, new_close = M[last,first], M[first,last]
+			if new_close == np.inf:
+				return np.inf
+			return (inside_new + new_close) - (inside_old + old_close)
+		prev, nxt = perm[i-1], perm[(j+1)%n]
+		added = M[prev,last] + M[first,nxt] + inside_new
+		if added == np.inf:
+			return np.inf
+		return added - (M[prev,first] + M[last,nxt] + inside_old)
+
+	def applyReverse( self, i, j ):
+		delta = self.reverseDelta( i, j )
+		if j <= i:
+			return delta
+		self.perm[i:j+1] = self.perm[i:j+1][::-1].copy()
+		self.pos[self.perm[i:j+1]] = np.arange( i, j+1 )
+		self._cost += delta
+		self._changed()
+		return delta
 
 
 def nameForInt( num ):
@@ -54,45 +243,269 @@ def nameForInt( num ):
 
 
 
+DEFAULT_DATA_RANGE = { 'x':[-1.5,1.5], 'y':[-1.0,1.0] }
+
+''' <summary>
+	The random city locations used for a (size, seed) pair.  This is the
+	generator the GUI has always used, so the same seed gives the same points
+	(and, since Scenario keeps drawing elevations from the same random stream,
+	the same cities) with or without the GUI.
+	</summary>
+	<returns>list of (x,y) tuples</returns>
+'''
+def generatePoints( npoints, seed, data_range=DEFAULT_DATA_RANGE ):
+	random.seed( seed )
+
+	ptlist = []
+	xr = data_range['x']
+	yr = data_range['y']
+	while len(ptlist) < npoints:
+		x = random.uniform(0.0,1.0)
+		y = random.uniform(0.0,1.0)
+		xval = xr[0] + (xr[1]-xr[0])*x
+		yval = yr[0] + (yr[1]-yr[0])*y
+		ptlist.append( (xval,yval) )
+	return ptlist
+
+
+
 class Scenario:
 
 	HARD_MODE_FRACTION_TO_REMOVE = 0.20 # Remove 20% of the edges
+	THIN_EDGES_BATCH = 1<<24			# max candidate edges drawn at once by the bulk thinning code
+	IMPLICIT_EDGES_MIN_CITIES = 50000	# generate() switches to a hash-based edge mask from here up
+	DENSE_COSTS_MAX_CITIES = 16384		# getCosts() uses the tiled CostOracle above this (a 2GB matrix)
+	GENERATION_VERSION = 1				# bump whenever generate() would build different scenarios
+
+	_explicit_costs = None				# set by fromCostMatrix
+	_seed = None						# set by the constructor and generate
 
 	def __init__( self, city_locations, difficulty, rand_seed ):
 		self._difficulty = difficulty
+		self._seed = rand_seed
+
+		# city_locations may be QPointF-like objects (with .x()/.y()) or (x,y) pairs
+		city_locations = [ (pt.x(), pt.y()) if hasattr(pt,'x') else pt for pt in city_locations ]
+		xs = [ x for x, y in city_locations ]
+		ys = [ y for x, y in city_locations ]
 
 		if difficulty == "Normal" or difficulty == "Hard":
-			self._cities = [City( pt.x(), pt.y(), \
-								  random.uniform(0.0,1.0) \
-								) for pt in city_locations]
+			elevations = [ random.uniform(0.0,1.0) for pt in city_locations ]
 		elif difficulty == "Hard (Deterministic)":
 			random.seed( rand_seed )
-			self._cities = [City( pt.x(), pt.y(), \
-								  random.uniform(0.0,1.0) \
-								) for pt in city_locations]
+			elevations = [ random.uniform(0.0,1.0) for pt in city_locations ]
 		else:
-			self._cities = [City( pt.x(), pt.y() ) for pt in city_locations]
-
-
-		num = 0
-		for city in self._cities:
-			#if difficulty == "Hard":
-			city.setScenario(self)
-			city.setIndexAndName( num, nameForInt( num+1 ) )
-			num += 1
+			elevations = [ 0.0 for pt in city_locations ]
+		self._setCities( xs, ys, elevations )
 
 		# Assume all edges exists except self-edges
-		ncities = len(self._cities)
-		self._edge_exists = ( np.ones((ncities,ncities)) - np.diag( np.ones((ncities)) ) ) > 0
+		self._edge_exists = self._allEdges( self.getNumCities() )
 
 		if difficulty == "Hard":
 			self.thinEdges()
 		elif difficulty == "Hard (Deterministic)":
 			self.thinEdges(deterministic=True)
 
+	''' <summary>
+		Builds a whole scenario of npoints random cities with bulk numpy
+		operations: one draw for all the points, one for all the elevations, and
+		a row-blocked threshold over raw random bytes to thin the edges (see
+		_thinEdgesFast).  Everything comes from a generator seeded with seed, so
+		every difficulty, "Hard" included, is reproducible.  These are not the
+		same instances the GUI has always generated; pass legacy=True to get those
+		(through generatePoints and the regular constructor), e.g. to reproduce
+		"Hard (Deterministic)" scenarios bit-for-bit.
+
+		implicit_edges picks the edge mask representation: a bit-packed mask
+		(n*n/8 bytes) or an implicit, hash-based one that needs no O(n^2) memory.
+		By default the implicit one is used from IMPLICIT_EDGES_MIN_CITIES up.
+		</summary> '''
+	@classmethod
+	def generate( cls, npoints, seed, difficulty, data_range=DEFAULT_DATA_RANGE, legacy=False, \
+				  implicit_edges=None ):
+		if legacy:
+			return cls( generatePoints( npoints, seed, data_range ), difficulty, seed )
+
+		rng = np.random.Generator( np.random.SFC64( seed ) )
+		xr = data_range['x']
+		yr = data_range['y']
+		unit = rng.random( (2,npoints) )
+		xs = xr[0] + (xr[1]-xr[0])*unit[0]
+		ys = yr[0] + (yr[1]-yr[0])*unit[1]
+		if difficulty == 'Easy':
+			elevations = np.zeros( npoints )
+		else:
+			elevations = rng.random( npoints )
+
+		scenario = cls.__new__( cls )
+		scenario._difficulty = difficulty
+		scenario._seed = seed
+		scenario._setCities( xs, ys, elevations )
+		if implicit_edges is None:
+			implicit_edges = npoints >= cls.IMPLICIT_EDGES_MIN_CITIES
+		if difficulty == "Hard" or difficulty == "Hard (Deterministic)":
+			scenario._edge_exists = scenario._thinEdgesFast( rng, implicit=implicit_edges )
+		elif implicit_edges:
+			scenario._edge_exists = ImplicitEdgeMask( npoints, 0, 0.0, np.arange(npoints) )
+		else:
+			scenario._edge_exists = scenario._allEdges( npoints )
+		return scenario
+
+	''' <summary>
+		A scenario whose costs are given rather than computed from the cities
+		(e.g. a TSPLIB EXPLICIT instance); its difficulty is "Explicit".  Edges
+		with an INF cost do not exist.  The coordinates only matter for drawing
+		and default to all zeros.
+		</summary> '''
+	@classmethod
+	def fromCostMatrix( cls, cost_matrix, xs=None, ys=None ):
+		cost_matrix = np.asarray( cost_matrix, dtype=np.float64 )
+		ncities = cost_matrix.shape[0]
+		scenario = cls.__new__( cls )
+		scenario._difficulty = 'Explicit'
+		scenario._setCities( np.zeros(ncities) if xs is None else xs, \
+							 np.zeros(ncities) if ys is None else ys, np.zeros(ncities) )
+		scenario._explicit_costs = cost_matrix
+		scenario._edge_exists = PackedEdgeMask.fromDense( np.isfinite(cost_matrix) )
+		return scenario
+
+	''' <summary>
+		A scenario with TSPLIB EUC_2D costs: the Euclidean distance between the
+		given coordinates rounded to the nearest integer, with no elevation or
+		MAP_SCALE.  Its difficulty is "EUC_2D" and every edge exists.
+		</summary> '''
+	@classmethod
+	def fromCoordinates( cls, xs, ys ):
+		ncities = len(xs)
+		scenario = cls.__new__( cls )
+		scenario._difficulty = 'EUC_2D'
+		scenario._setCities( xs, ys, np.zeros(ncities) )
+		if ncities >= cls.IMPLICIT_EDGES_MIN_CITIES:
+			scenario._edge_exists = ImplicitEdgeMask( ncities, 0, 0.0, np.arange(ncities) )
+		else:
+			scenario._edge_exists = cls._allEdges( ncities )
+		return scenario
+
+	def _setCities( self, xs, ys, elevations ):
+		# The city data lives here, as contiguous arrays indexed by city index;
+		# City objects are only lightweight views onto it (see getCities)
+		self._xs = np.ascontiguousarray( xs, dtype=np.float64 )
+		self._ys = np.ascontiguousarray( ys, dtype=np.float64 )
+		self._elevations = np.ascontiguousarray( elevations, dtype=np.float64 )
+		self._cost_matrix = None
+		self._cost_oracle = None
+		self._cities = None
+
+	@staticmethod
+	def _allEdges( ncities ):
+		return PackedEdgeMask.allEdges( ncities )
+
+	''' <summary>
+		The seed the scenario was generated from, or None if it was not
+		generated (e.g. read from a TSPLIB file).
+		</summary> '''
+	def getSeed( self ):
+		return self._seed
+
+	def getNumCities( self ):
+		return len(self._xs)
+
+	# The City views are only made the first time someone asks for them
 	def getCities( self ):
+		if self._cities is None:
+			self._cities = [ City( self, i ) for i in range(self.getNumCities()) ]
 		return self._cities
 
+	# Pickle only the flat arrays; the City views (each of which points back
+	# at the scenario) and the cost matrix are rebuilt on the other side
+	def __getstate__( self ):
+		state = self.__dict__.copy()
+		for key in ('_cities', '_xs', '_ys', '_elevations', '_cost_matrix', '_cost_oracle'):
+			del state[key]
+		state['_city_arrays'] = ( self._xs, self._ys, self._elevations )
+		return state
+
+	def __setstate__( self, state ):
+		xs, ys, elevations = state.pop( '_city_arrays' )
+		self.__dict__.update( state )
+		self._setCities( xs, ys, elevations )
+
+
+	''' <summary>
+		Returns the n x n matrix of City.costTo values, computed once with numpy
+		broadcasting and cached.  Entries are integer-valued, but the array is
+		float64 so that removed edges and self-edges can hold np.inf.
+		</summary> '''
+	def getCostMatrix( self ):
+		if self._explicit_costs is not None:
+			return self._explicit_costs
+		if self._cost_matrix is None:
+			self._cost_matrix = self._computeCosts( np.arange(self.getNumCities()), \
+													np.arange(self.getNumCities()) )
+		return self._cost_matrix
+
+	''' <summary>
+		The scenario's CostOracle: the same costs as getCostMatrix(), computed
+		tile by tile on demand and kept in an LRU cache.  Passing a tile_size or
+		memory_budget different from the current oracle's replaces it.
+		</summary> '''
+	def getCostOracle( self, tile_size=None, memory_budget=None ):
+		oracle = self._cost_oracle
+		if oracle is None or (tile_size is not None and tile_size != oracle.tile_size) \
+				or (memory_budget is not None and memory_budget != oracle.memory_budget):
+			self._cost_oracle = CostOracle( self, \
+				tile_size if tile_size is not None else CostOracle.DEFAULT_TILE_SIZE, \
+				memory_budget if memory_budget is not None else CostOracle.DEFAULT_MEMORY_BUDGET )
+		return self._cost_oracle
+
+	''' <summary>
+		Whatever is cheapest to look costs up in: the dense matrix if it has
+		been computed or fits (up to DENSE_COSTS_MAX_CITIES cities), otherwise
+		the CostOracle.  Both are indexed as costs[src, dst] and have .T, which
+		is all TSPSolution and TSPLocalSearch need; the solvers that read whole
+		rows at every step (greedy, branch and bound, ...) use getCostMatrix().
+		</summary> '''
+	def getCosts( self ):
+		if self._cost_matrix is not None or self.getNumCities() <= self.DENSE_COSTS_MAX_CITIES:
+			return self.getCostMatrix()
+		return self.getCostOracle()
+
+	def _computeCosts( self, src, dst ):
+		# Same rules as City.costTo, applied to every (src,dst) pair at once
+		return self._pairCosts( np.asarray(src)[:,None], np.asarray(dst)[None,:] )
+
+	def _costsFitFloat32( self ):
+		# Whether float32 holds every cost exactly.  Generated and EUC_2D costs
+		# are whole numbers, exact below 2**24, which the diagonal of the
+		# cities' bounding box (plus the climb from the lowest to the highest
+		# city) bounds without computing any; explicit ones are checked
+		if self._explicit_costs is not None:
+			finite = self._explicit_costs[ np.isfinite(self._explicit_costs) ]
+			return np.array_equal( finite.astype(np.float32), finite )
+		if len(self._xs) == 0:
+			return True
+		largest = np.hypot( np.ptp(self._xs), np.ptp(self._ys) )
+		if self._difficulty != 'EUC_2D':
+			largest = (largest + np.ptp(self._elevations)) * City.MAP_SCALE
+		return largest + 1 < 2**24
+
+	def _pairCosts( self, src, dst ):
+		# Elementwise version: src and dst broadcast against each other
+		if self._explicit_costs is not None:
+			return self._explicit_costs[src,dst].astype( np.float64 )
+		cost = np.sqrt( (self._xs[dst] - self._xs[src])**2 +
+						(self._ys[dst] - self._ys[src])**2 )
+		if self._difficulty == 'EUC_2D':
+			cost = np.floor( cost + 0.5 )
+			cost[ ~self._edge_exists[src,dst] ] = np.inf
+			return cost
+		if not self._difficulty == 'Easy':
+			cost += self._elevations[dst] - self._elevations[src]
+			np.maximum( cost, 0.0, out=cost )		# Shouldn't it cost something to go downhill, no matter how steep??????
+		cost = np.ceil( cost * City.MAP_SCALE )
+		cost[ ~self._edge_exists[src,dst] ] = np.inf
+		return cost
+
 
 	def randperm( self, n ):				#isn't there a numpy function that does this and even gets called in Solver?
 		perm = np.arange(n)
@@ -104,49 +517,121 @@ class Scenario:
 		return perm
 
 	def thinEdges( self, deterministic=False ):
-		ncities = len(self._cities)
+		ncities = self.getNumCities()
 		edge_count = ncities*(ncities-1) # can't have self-edge
 		num_to_remove = np.floor(self.HARD_MODE_FRACTION_TO_REMOVE*edge_count)
 
-		can_delete	= self._edge_exists.copy()
+		# The legacy thinning works on a dense copy of the mask and packs it again
+		# at the end, so it makes exactly the same random draws as it always has
+		edge_exists = self._edge_exists.toDense()
+		can_delete	= edge_exists.copy()
 
 		# Set aside a route to ensure at least one tour exists
 		route_keep = np.random.permutation( ncities )
 		if deterministic:
 			route_keep = self.randperm( ncities )
-		for i in range(ncities):
-			can_delete[route_keep[i],route_keep[(i+1)%ncities]] = False
+		can_delete[route_keep, np.roll(route_keep,-1)] = False
 
 		# Now remove edges until 
-		while num_to_remove > 0:
-			if deterministic:
+		if deterministic:
+			while num_to_remove > 0:
 				src = random.randint(0,ncities-1)
 				dst = random.randint(0,ncities-1)
-			else:
-				src = np.random.randint(ncities)
-				dst = np.random.randint(ncities)
-			if self._edge_exists[src,dst] and can_delete[src,dst]:
-				self._edge_exists[src,dst] = False
-				num_to_remove -= 1
+				if edge_exists[src,dst] and can_delete[src,dst]:
+					edge_exists[src,dst] = False
+					num_to_remove -= 1
+			self._edge_exists = PackedEdgeMask.fromDense( edge_exists )
+			return
+
+		# Same rejection sampling, but drawing candidate edges in batches: within
+		# a batch only the first draw of each still-deletable edge counts, which
+		# is exactly what the one-at-a-time loop would have kept
+		flat_exists = edge_exists.reshape( -1 )
+		can_delete = can_delete.reshape( -1 )
+		num_to_remove = int( num_to_remove )
+		while num_to_remove > 0:
+			batch = min( int(1.5*num_to_remove) + 64, self.THIN_EDGES_BATCH )
+			src = np.random.randint( ncities, size=batch )
+			dst = np.random.randint( ncities, size=batch )
+			flat = src*ncities + dst
+			flat = flat[ can_delete[flat] ]
+			_, first = np.unique( flat, return_index=True )
+			flat = flat[ np.sort(first)[:num_to_remove] ]
+			flat_exists[flat] = False
+			can_delete[flat] = False
+			num_to_remove -= len(flat)
+		self._edge_exists = PackedEdgeMask.fromDense( edge_exists )
 
+	''' <summary>
+		Bulk version of thinEdges for Scenario.generate.  Instead of removing an
+		exact count of edges by rejection sampling, every edge off the kept
+		route is dropped independently with the probability that gives the same
+		expected count.  With implicit=False that probability is quantized to
+		1/256 so the mask can be drawn as raw random bytes (20% becomes 51/256 =
+		19.9%), a block of rows at a time, and packed to one bit per edge.  With
+		implicit=True nothing is stored per edge: removal is a hash of
+		(seed, src, dst) (see TSPEdgeMask.ImplicitEdgeMask).
+		</summary>
+		<returns>the thinned edge_exists mask</returns>
+	'''
+	def _thinEdgesFast( self, rng, implicit=False ):
+		ncities = self.getNumCities()
+		edge_count = ncities*(ncities-1)
+		removable = edge_count - ncities
+		p_remove = np.floor(self.HARD_MODE_FRACTION_TO_REMOVE*edge_count) / removable if removable > 0 else 0.0
+
+		if implicit:
+			hash_seed = int( rng.integers( 0, 2**63 ) )
+			route_keep = rng.permutation( ncities )
+			return ImplicitEdgeMask( ncities, hash_seed, p_remove, route_keep )
+
+		edge_exists = PackedEdgeMask( ncities )
+		threshold = np.uint8( min(255, round(256*p_remove)) )
+		rows = max( 1, self.THIN_EDGES_BATCH // max(ncities,1) )
+		for r in range( 0, ncities, rows ):
+			nrows = min( rows, ncities-r )
+			draws = rng.bit_generator.random_raw( -(-nrows*ncities//8) ).view( np.uint8 )
+			draws = draws[:nrows*ncities].reshape( (nrows,ncities) )
+			edge_exists.setRows( r, draws >= threshold )
+		diag = np.arange( ncities )
+		edge_exists[diag, diag] = False
+
+		# Set aside a route to ensure at least one tour exists
+		route_keep = rng.permutation( ncities )
+		edge_exists[route_keep, np.roll(route_keep,-1)] = True
+		return edge_exists
 
 
 
 class City:
-	def __init__( self, x, y, elevation=0.0 ):
-		self._x = x
-		self._y = y
-		self._elevation = elevation
-		self._scenario	= None
-		self._index = -1
-		self._name	= None
-
-	def setIndexAndName( self, index, name ):
-		self._index = index
-		self._name = name
 
-	def setScenario( self, scenario ):
+	''' <summary>
+		A city is a view of one slot of its Scenario's coordinate/elevation
+		arrays, so it only stores the scenario and its index.  _x, _y,
+		_elevation and _name read through to the scenario (the name is computed
+		from the index when asked for).
+		</summary> '''
+	__slots__ = ( '_scenario', '_index' )
+
+	def __init__( self, scenario, index ):
 		self._scenario = scenario
+		self._index = index
+
+	@property
+	def _x( self ):
+		return self._scenario._xs[self._index]
+
+	@property
+	def _y( self ):
+		return self._scenario._ys[self._index]
+
+	@property
+	def _elevation( self ):
+		return self._scenario._elevations[self._index]
+
+	@property
+	def _name( self ):
+		return nameForInt( self._index+1 )
 
 	''' <summary>
 		How much does it cost to get from this city to the destination?
@@ -157,23 +642,8 @@ class City:
 	MAP_SCALE = 1000.0
 	def costTo( self, other_city ):
 
-		assert( type(other_city) == City )
-
-		# In hard mode, remove edges; this slows down the calculation...
-		# Use this in all difficulties, it ensures INF for self-edge
-		if not self._scenario._edge_exists[self._index, other_city._index]:
-			return np.inf
-
-		# Euclidean Distance
-		cost = math.sqrt( (other_city._x - self._x)**2 +
-						  (other_city._y - self._y)**2 )
-
-		# For Medium and Hard modes, add in an asymmetric cost (in easy mode it is zero).
-		if not self._scenario._difficulty == 'Easy':
-			cost += (other_city._elevation - self._elevation)
-			if cost < 0.0:
-				cost = 0.0					# Shouldn't it cost something to go downhill, no matter how steep??????
-
-
-		return int(math.ceil(cost * self.MAP_SCALE))
+		# Looked up in the scenario's precomputed matrix (or, for huge
+		# scenarios, its tile cache); removed edges and self-edges are INF there
+		cost = self._scenario.getCosts()[self._index, other_city._index]
+		return np.inf if cost == np.inf else int(cost)
 
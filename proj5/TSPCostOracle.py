@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+
+''' <summary>
+	Lazily computed stand-in for Scenario.getCostMatrix() on instances too big
+	for a dense n x n matrix.  The matrix is split into tile_size x tile_size
+	tiles; a tile is computed (as one vectorized block) the first time any of
+	its entries is asked for and kept in an LRU cache holding at most
+	memory_budget bytes of tiles.
+
+	It is indexed like the matrix, with a (src, dst) pair of ints or integer
+	arrays that broadcast against each other, and returns the same values
+	(np.inf for missing edges and self-edges).  Tiles are stored as float32,
+	so a cache entry is 4*tile_size^2 bytes, when that holds every cost of
+	the scenario exactly; otherwise (e.g. explicit or EUC_2D costs of 2**24
+	and up) they are float64 and take twice that, so lookups never round.
+
+	oracle.T is a view of the transposed costs (e.g. for the cheapest
+	predecessors), indexed the same way.  Solvers that need whole rows (e.g.
+	TSPLocalSearch.candidateLists) read them a block at a time.
+
+	hits/misses count tile lookups, so the hit rate is what to watch when
+	tuning tile_size for a solver's access pattern.  Array lookups that touch
+	fewer than min_tile_fill entries of an uncached tile compute those entries
+	directly instead of the tile; they are counted in direct.
+	</summary>
+'''
+class CostOracle:
+
+	DEFAULT_TILE_SIZE = 256
+	DEFAULT_MEMORY_BUDGET = 256<<20		# bytes of cached tiles
+	DEFAULT_MIN_TILE_FILL = 64
+
+	def __init__( self, scenario, tile_size=DEFAULT_TILE_SIZE, memory_budget=DEFAULT_MEMORY_BUDGET ):
+		ncities = scenario.getNumCities()
+		self.shape = (ncities, ncities)
+		self.tile_size = tile_size
+		self.memory_budget = memory_budget
+		self.min_tile_fill = self.DEFAULT_MIN_TILE_FILL
+		self._scenario = scenario
+		self._tiles_per_row = -(-ncities // tile_size)
+		self.dtype = np.dtype( np.float32 if scenario._costsFitFloat32() else np.float64 )
+		self._max_tiles = max( 1, memory_budget // (self.dtype.itemsize*tile_size*tile_size) )
+		self._tiles = OrderedDict()
+		self.resetStats()
+
+	@property
+	def T( self ):
+		return _Transposed( self )
+
+	def resetStats( self ):
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.direct = 0
+
+	def stats( self ):
+		lookups = self.hits + self.misses
+		return { 'tile_size':self.tile_size, 'hits':self.hits, 'misses':self.misses, \
+				 'evictions':self.evictions, 'direct':self.direct, 'hit_rate':self.hits/lookups if lookups else 0.0, \
+				 'tiles':len(self._tiles), 'bytes':sum( t.nbytes for t in self._tiles.values() ) }
+
+	def clear( self ):
+		self._tiles.clear()
+
+	def _tile( self, key ):
+		tile = self._tiles.get( key )
+		if tile is not None:
+			self.hits += 1
+			self._tiles.move_to_end( key )
+			return tile
+		self.misses += 1
+		row, col = divmod( key, self._tiles_per_row )
+		n, size = self.shape[0], self.tile_size
+		tile = self._scenario._computeCosts( np.arange(row*size, min(n, (row+1)*size)), \
+											 np.arange(col*size, min(n, (col+1)*size)) )
+		tile = tile.astype( self.dtype )
+		self._tiles[key] = tile
+		if len(self._tiles) > self._max_tiles:
+			self._tiles.popitem( last=False )
+			self.evictions += 1
+		return tile
+
+	''' <summary>
+		The tile_size x tile_size block (smaller at the edges) whose top-left
+		entry is (row*tile_size, col*tile_size).
+		</summary> '''
+	def tile( self, row, col ):
+		return self._tile( row*self._tiles_per_row + col )
+
+	def __getitem__( self, index ):
+		src, dst = index
+		size = self.tile_size
+		if np.ndim(src) == 0 and np.ndim(dst) == 0:
+			src, dst = int(src), int(dst)
+			tile = self._tile( (src//size)*self._tiles_per_row + dst//size )
+			return float( tile[src % size, dst % size] )
+
+		src, dst = np.broadcast_arrays( np.asarray(src, dtype=np.intp), np.asarray(dst, dtype=np.intp) )
+		shape = src.shape
+		src, dst = src.ravel(), dst.ravel()
+		keys = (src//size)*self._tiles_per_row + dst//size
+		out = np.empty( len(src), dtype=np.float64 )
+		# each distinct tile touched is looked up once; entries of uncached
+		# tiles that are too sparse to be worth a whole tile (e.g. the edges of
+		# a tour) are computed directly, all in one batch
+		unique, inverse, counts = np.unique( keys, return_inverse=True, return_counts=True )
+		tiled = counts >= self.min_tile_fill
+		tiled |= np.fromiter( (key in self._tiles for key in unique.tolist()), dtype=bool, count=len(unique) )
+		direct = ~tiled[inverse]
+		if direct.any():
+			self.direct += int( direct.sum() )
+			out[direct] = self._scenario._pairCosts( src[direct], dst[direct] )
+		if tiled.any():
+			order = np.argsort( inverse, kind='stable' )
+			starts = np.cumsum( counts ) - counts
+			for u in np.flatnonzero( tiled ).tolist():
+				group = order[starts[u]:starts[u]+counts[u]]
+				tile = self._tile( int(unique[u]) )
+				out[group] = tile[src[group] % size, dst[group] % size]
+		return out.reshape( shape )
+
+
+
+class _Transposed:
+
+	def __init__( self, oracle ):
+		self.T = oracle
+		self.shape = oracle.shape[::-1]
+
+	def __getitem__( self, index ):
+		src, dst = index
+		return self.T[dst, src]
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+
+
+import numpy as np
+
+
+
+''' <summary>
+	Compact replacements for the dense n x n boolean edge_exists array.  Both
+	classes are indexed like that array with a (src, dst) pair, where src and
+	dst are ints or integer arrays (broadcast against each other like numpy
+	fancy indexing), and return bools:
+
+		mask[i, j]						-> bool
+		mask[rows[:,None], cols[None,:]]	-> 2-D bool block
+
+	PackedEdgeMask stores one bit per edge (n*n/8 bytes) and can be modified.
+	ImplicitEdgeMask stores nothing per edge: whether an edge was removed is a
+	deterministic hash of (seed, src, dst), so memory is O(n).
+	</summary>
+'''
+
+
+
+class PackedEdgeMask:
+
+	def __init__( self, ncities, bits=None ):
+		self.shape = (ncities, ncities)
+		if bits is None:
+			bits = np.zeros( (ncities, (ncities+7)//8), dtype=np.uint8 )
+		self._bits = bits
+
+	''' <summary>
+		Every edge except the self-edges.
+		</summary> '''
+	@classmethod
+	def allEdges( cls, ncities ):
+		mask = cls( ncities )
+		mask._bits[:] = 0xFF
+		diag = np.arange( ncities )
+		mask[diag, diag] = False
+		return mask
+
+	@classmethod
+	def fromDense( cls, dense ):
+		dense = np.asarray( dense, dtype=bool )
+		return cls( dense.shape[0], np.packbits( dense, axis=1, bitorder='little' ) )
+
+	''' <summary>
+		Packs one block of rows (a bool array of shape k x n) into rows
+		first..first+k-1, so big masks never need a dense copy.
+		</summary> '''
+	def setRows( self, first, block ):
+		self._bits[first:first+len(block)] = np.packbits( block, axis=1, bitorder='little' )
+
+	def toDense( self ):
+		return np.unpackbits( self._bits, axis=1, count=self.shape[1], bitorder='little' ).astype( bool )
+
+	def copy( self ):
+		return PackedEdgeMask( self.shape[0], self._bits.copy() )
+
+	def count( self ):
+		return int( np.unpackbits( self._bits, axis=1, count=self.shape[1], bitorder='little' ).sum() )
+
+	def __getitem__( self, index ):
+		src, dst = np.broadcast_arrays( *index )
+		byte = self._bits[src, dst >> 3]
+		result = ( (byte >> (dst & 7).astype(np.uint8)) & 1 ).astype( bool )
+		return result if result.ndim else bool(result)
+
+	def __setitem__( self, index, value ):
+		src, dst = np.broadcast_arrays( *[np.asarray(i, dtype=np.intp) for i in index] )
+		value = np.broadcast_to( np.asarray(value, dtype=bool), src.shape )
+		bit = np.left_shift( 1, dst & 7 ).astype( np.uint8 )
+		cols = dst >> 3
+		# ufunc.at so repeated (src,dst) pairs behave like repeated assignment
+		np.bitwise_or.at( self._bits, (src[value], cols[value]), bit[value] )
+		np.bitwise_and.at( self._bits, (src[~value], cols[~value]), ~bit[~value] )
+
+
+
+class ImplicitEdgeMask:
+
+	''' <summary>
+		An edge (src,dst) exists unless src == dst, or it is not on the kept
+		route (route_keep, which guarantees a tour) and the hash of
+		(seed, src, dst) falls below p_remove.  Read-only.
+		</summary> '''
+	def __init__( self, ncities, seed, p_remove, route_keep ):
+		self.shape = (ncities, ncities)
+		self.seed = seed
+		self.p_remove = p_remove
+		self._seed = np.uint64( seed & 0xFFFFFFFFFFFFFFFF )
+		self._threshold = np.uint64( min( int(p_remove * 2.0**64), 2**64-1 ) )
+		self._route_keep = np.asarray( route_keep, dtype=np.intp )
+		self._next = np.empty( ncities, dtype=np.intp )
+		self._next[self._route_keep] = np.roll( self._route_keep, -1 )
+
+	@staticmethod
+	def _mix( x ):
+		# splitmix64 finalizer
+		x = x ^ (x >> np.uint64(30))
+		x = x * np.uint64(0xBF58476D1CE4E5B9)
+		x = x ^ (x >> np.uint64(27))
+		x = x * np.uint64(0x94D049BB133111EB)
+		return x ^ (x >> np.uint64(31))
+
+	def removed( self, src, dst ):
+		src, dst = np.broadcast_arrays( np.atleast_1d(src), np.atleast_1d(dst) )
+		with np.errstate( over='ignore' ):
+			key = src.astype(np.uint64) * np.uint64(self.shape[1]) + dst.astype(np.uint64)
+			hashed = self._mix( self._mix(key) ^ self._seed )
+		return hashed < self._threshold
+
+	def toDense( self ):
+		rows = np.arange( self.shape[0] )
+		return self[rows[:,None], rows[None,:]]
+
+	def copy( self ):
+		return self		# read-only, so sharing is safe
+
+	def count( self ):
+		rows = np.arange( self.shape[0] )
+		return int( sum( self[r, rows].sum() for r in rows ) )
+
+	def __getitem__( self, index ):
+		src, dst = np.broadcast_arrays( *index )
+		scalar = src.ndim == 0
+		src, dst = np.atleast_1d( src ), np.atleast_1d( dst )
+		result = (src != dst) & ( (self._next[src] == dst) | ~self.removed(src, dst) )
+		return bool(result[0]) if scalar else result
+
+	def __setitem__( self, index, value ):
+		raise TypeError( 'ImplicitEdgeMask is read-only' )
@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+
+
+import numpy as np
+
+
+
+class FeasibleTours:
+
+	BUDGET = 4				# search steps per city allowed to the first attempt ...
+	BUDGET_GROWTH = 2		# ... and growth factor of the budget after every restart
+	DIVERSITY = 0.5			# greedy choices price each edge at cost * uniform(1, 1+DIVERSITY)
+	SPARSE = 0.25			# graphs with fewer than this fraction of the edges are sparse
+
+	''' <summary>
+		Constructs feasible tours (Hamiltonian cycles in the graph of finite
+		edges) of a (possibly asymmetric) cost matrix with np.inf for missing
+		edges, by randomized depth-first search from a random start city.
+
+		The search keeps, for every city, how many of its predecessors are
+		still open (unvisited, or the current end of the path) and how many of
+		its successors (unvisited, or the start, to close the tour).  A step
+		that leaves some unvisited city without either is undone at once, and
+		so is one that leaves the start with no open predecessor.  The next
+		city is chosen among the current city's unvisited successors, cities
+		with a single open predecessor first (they cannot wait), then by cost
+		times a random factor (or in random order, unless greedy), so
+		repeated calls give diverse tours that are still reasonable seeds.
+
+		Dead ends are resolved by chronological backtracking.  (Backjumping
+		gains nothing sound here: the cities open at a depth depend on the
+		city chosen at the depth before, so that depth is always to blame.)
+		An attempt that takes more than its budget of steps is abandoned for a
+		fresh start, with a budget BUDGET_GROWTH times larger, so the heavy
+		tail of unlucky starts is cut off.  An attempt that runs out of
+		choices at the start city has tried every path from it, and every
+		tour passes the start, so that proves there is no tour.  If the graph
+		has a Hamiltonian cycle, the search finds it eventually.
+		</summary> '''
+	def __init__( self, cost_matrix, greedy=True, rng=None ):
+		self._cost = np.asarray( cost_matrix, dtype=np.float64 )
+		n = self._ncities = self._cost.shape[0]
+		self._rng = rng if rng is not None else np.random.default_rng()
+		self.greedy = greedy
+		self._adj = np.isfinite( self._cost )
+		np.fill_diagonal( self._adj, False )
+		self._succ = [ np.flatnonzero( row ) for row in self._adj ]
+		self._pred = [ np.flatnonzero( col ) for col in self._adj.T ]
+		self._budget = self.BUDGET * n
+		self._sparse = self._adj.sum() < self.SPARSE * n * (n-1)
+		self.attempts = 0
+		self.nodes = 0			# steps taken, over all attempts
+		self.found = 0
+
+	def _order( self, current, candidates, in_open, out_open ):
+		key = self._rng.random( len(candidates) )
+		if self._sparse:
+			key = out_open[candidates] + key		# Warnsdorff: fewest ways on first
+		elif self.greedy:
+			key = self._cost[current, candidates] * (1 + self.DIVERSITY*key)
+		urgent = in_open[candidates] > 1
+		return candidates[ np.lexsort( (key, urgent) ) ]
+
+	def _reachable( self, source, allowed, edges ):
+		# Cities reachable from source along edges (succ or pred lists) through allowed cities
+		reached = np.zeros( self._ncities, dtype=bool )
+		reached[source] = True
+		frontier = [ source ]
+		while frontier:
+			near = np.concatenate( [ edges[c] for c in frontier ] )
+			near = np.unique( near[ allowed[near] & ~reached[near] ] )
+			reached[near] = True
+			frontier = near.tolist()
+		return reached
+
+	''' <summary>
+		One attempt from start, as a generator that yields after every step.
+		</summary>
+		<returns>the tour as an array of city indices; None if the budget ran
+		out first; False if the search proved there is no tour at all</returns>
+	'''
+	def search( self, start, budget=None ):
+		n = self._ncities
+		adj, succ, pred = self._adj, self._succ, self._pred
+		if n == 1:
+			return np.array( [start], dtype=np.intp )
+		visited = np.zeros( n, dtype=bool )
+		in_open = adj.sum( axis=0 )			# open predecessors
+		out_open = adj.sum( axis=1 )		# open successors
+		if not in_open.all() or not out_open.all():
+			return False
+		path = [ start ]
+		visited[start] = True
+		choices = [ None ]					# per depth: the choices left to try
+		steps = 0
+		failed = False
+
+		def move( current, city ):
+			in_open[ succ[current] ] -= 1
+			out_open[ pred[city] ] -= 1
+			visited[city] = True
+			path.append( city )
+
+		def undo():
+			city = path.pop()
+			current = path[-1]
+			in_open[ succ[current] ] += 1
+			out_open[ pred[city] ] += 1
+			visited[city] = False
+
+		def deadEnd( current, city ):
+			# Whether the step current -> city just made the search fail
+			if len(path) == n:
+				return not adj[city, start]
+			if (in_open[ succ[current] ] == 0)[ ~visited[succ[current]] ].any() or in_open[start] == 0:
+				return True				# an unvisited city (or the start) lost its last predecessor
+			if (out_open[ pred[city] ] == 0)[ ~visited[pred[city]] ].any() or out_open[city] == 0:
+				return True				# an unvisited city (or city) lost its last successor
+			if self._sparse or failed:
+				# Every unvisited city must be reachable from city, and the
+				# start from every one of them, through unvisited cities
+				unvisited = ~visited
+				if not self._reachable( city, unvisited, succ )[unvisited].all():
+					return True
+				unvisited[city] = True
+				if not self._reachable( start, unvisited, pred )[unvisited].all():
+					return True
+			return False
+
+		while True:
+			current = path[-1]
+			if choices[-1] is None:
+				candidates = succ[current][ ~visited[succ[current]] ]
+				choices[-1] = list( self._order( current, candidates, in_open, out_open )[::-1] )
+
+			advanced = False
+			while choices[-1]:
+				city = choices[-1].pop()
+				move( current, city )
+				steps += 1
+				self.nodes += 1
+				if not deadEnd( current, city ):
+					if len(path) == n:
+						return np.array( path, dtype=np.intp )
+					choices.append( None )
+					advanced = True
+					break
+				undo()
+				failed = True
+				yield
+			if not advanced:
+				# Every choice at this depth failed: back to the depth before
+				choices.pop()
+				if len(path) == 1:
+					return False
+				undo()
+			yield
+			if budget is not None and steps > budget:
+				return None
+
+	''' <summary>
+		Generator that keeps making attempts from random start cities and
+		yields after every step, and returns the first tour found, or None if
+		there is none.
+		</summary> '''
+	def tour( self ):
+		n = self._ncities
+		while True:
+			self.attempts += 1
+			start = int( self._rng.integers( n ) )
+			result = yield from self.search( start, self._budget )
+			if result is False:
+				return None
+			if result is not None:
+				self.found += 1
+				return result
+			self._budget *= self.BUDGET_GROWTH
+
+	''' <summary>
+		Generator that returns count feasible tours (an array, one per row,
+		fewer if there is no tour at all), yielding after every step.
+		</summary> '''
+	def sample( self, count ):
+		tours = []
+		for _ in range( count ):
+			tour = yield from self.tour()
+			if tour is None:
+				break
+			tours.append( tour )
+		return np.array( tours, dtype=np.intp ).reshape( -1, self._ncities )
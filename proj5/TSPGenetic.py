@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+
+
+import math
+
+import numpy as np
+
+
+
+''' <summary>
+	Cost of every tour (one permutation per row) under a (possibly
+	asymmetric) cost matrix, gathered in one go; np.inf if a tour uses a
+	missing edge.
+	</summary>
+'''
+def tourCosts( cost_matrix, tours ):
+	return cost_matrix[ tours, np.roll(tours,-1,axis=1) ].sum( axis=1 )
+
+''' <summary>
+	Random cut points 0 <= i < j <= n, one pair per row, with j-i >= 1.
+	</summary>
+'''
+def _cuts( rng, count, n ):
+	i = rng.integers( 0, n, size=count )
+	j = rng.integers( 0, n, size=count )
+	i, j = np.minimum( i, j ), np.maximum( i, j ) + 1
+	return i, j
+
+''' <summary>
+	Order crossover (OX) of every row of first with the same row of second:
+	each child keeps a random segment of its first parent where it is, and
+	gets the other cities in the order they follow that segment in its
+	second parent.  Both parents' cities keep their direction, which is what
+	matters with asymmetric costs.  Fully vectorized over the batch.
+	</summary>
+'''
+def orderCrossover( first, second, rng ):
+	count, n = first.shape
+	rows = np.arange( count )[:,None]
+	cols = np.arange( n )[None,:]
+	i, j = _cuts( rng, count, n )
+	length = (j - i)[:,None]
+
+	# Cities of the segment, per row
+	in_segment = np.empty( (count,n), dtype=bool )
+	in_segment[ rows, first[rows, (i[:,None] + cols) % n] ] = cols < length
+
+	# The second parent read from position j on, with the segment's cities
+	# moved to the back (stable, so the others keep their order)
+	second_from_j = second[ rows, (j[:,None] + cols) % n ]
+	order = np.argsort( in_segment[rows, second_from_j], axis=1, kind='stable' )
+	filler = second_from_j[ rows, order ]
+
+	# The child read from position j on: the filler, then the segment
+	segment = first[ rows, (i[:,None] + cols - (n - length)) % n ]
+	child_from_j = np.where( cols < n - length, filler, segment )
+	child = np.empty_like( first )
+	child[ rows, (j[:,None] + cols) % n ] = child_from_j
+	return child
+
+''' <summary>
+	Reverses a random segment of every row of tours (an asymmetric 2-opt
+	move), in place.
+	</summary>
+'''
+def reverseSegments( tours, rng ):
+	count, n = tours.shape
+	rows = np.arange( count )[:,None]
+	cols = np.arange( n )[None,:]
+	i, j = _cuts( rng, count, n )
+	inside = (cols >= i[:,None]) & (cols < j[:,None])
+	source = np.where( inside, i[:,None] + j[:,None] - 1 - cols, cols )
+	tours[:] = tours[ rows, source ]
+
+''' <summary>
+	Moves a random segment of up to three cities of every row of tours to a
+	random other place (an Or-opt move), in place.
+	</summary>
+'''
+def moveSegments( tours, rng ):
+	count, n = tours.shape
+	rows = np.arange( count )[:,None]
+	cols = np.arange( n )[None,:]
+	length = rng.integers( 1, min(3, n-1) + 1, size=count )[:,None]
+	shift = rng.integers( 1, n - length[:,0] + 1, size=count )[:,None]
+	start = rng.integers( 0, n, size=count )[:,None]
+	# Read the tour from start on: the segment is its first length cities;
+	# it goes after the next shift cities
+	k = cols
+	moved = np.where( k < shift, k + length, np.where(k < shift + length, k - shift, k) )
+	tours[:] = tours[ rows, (start + moved) % n ]
+
+
+
+class Island:
+
+	POPULATION = 64
+	CROSSOVER_RATE = 0.9
+	MUTATION_RATE = 0.3
+
+	''' <summary>
+		Steady, elitist genetic algorithm on one island.  The population is an
+		integer array of permutations (one per row) with their costs.  Every
+		generation produces as many children as there are tours, all at once:
+		binary tournament selection, order crossover (see orderCrossover),
+		segment reversal or move mutation, and batch fitness by gathering from
+		the cost matrix.  The population and the children are then pooled and
+		the best distinct-cost tours survive, so duplicates don't take over.
+		Tours with a missing edge cost np.inf and lose every tournament.
+
+		improve, if given, is a function from a tour to a tour that is no
+		worse (e.g. local search); it is applied to the best child of every
+		generation.
+		</summary> '''
+	def __init__( self, cost_matrix, tours, size=POPULATION, rng=None, improve=None ):
+		self._cost = np.asarray( cost_matrix, dtype=np.float64 )
+		self._rng = rng if rng is not None else np.random.default_rng()
+		self._improve = improve
+		self.size = size
+		self.generations = 0
+		self.evaluated = 0
+		tours = np.asarray( tours, dtype=np.intp ).reshape( -1, self._cost.shape[0] )
+		if len(tours) == 0:
+			n = self._cost.shape[0]
+			tours = np.argsort( self._rng.random( (size,n) ), axis=1 )
+		# Too few starting tours: fill up with mutated copies
+		while len(tours) < size:
+			extra = tours[ self._rng.integers( len(tours), size=min(len(tours), size-len(tours)) ) ].copy()
+			reverseSegments( extra, self._rng )
+			tours = np.concatenate( (tours, extra) )
+		self.tours = tours
+		self.costs = tourCosts( self._cost, tours )
+		self._survive()
+
+	def _survive( self ):
+		_, distinct = np.unique( self.costs, return_index=True )		# sorted by cost
+		keep = distinct[:self.size]
+		if len(keep) < self.size:
+			rest = np.setdiff1d( np.arange(len(self.costs)), keep )
+			keep = np.concatenate( (keep, rest[ np.argsort(self.costs[rest], kind='stable') ][:self.size-len(keep)]) )
+		self.tours = self.tours[keep]
+		self.costs = self.costs[keep]
+
+	@property
+	def best( self ):
+		return self.tours[0], self.costs[0]
+
+	''' <summary>
+		The best count tours, for migration.
+		</summary> '''
+	def elites( self, count ):
+		return self.tours[:count].copy()
+
+	''' <summary>
+		Adds tours from another island; the population is then cut back to
+		size as usual.
+		</summary> '''
+	def immigrate( self, tours ):
+		if tours is None or len(tours) == 0:
+			return
+		self.tours = np.concatenate( (self.tours, tours) )
+		self.costs = np.concatenate( (self.costs, tourCosts(self._cost, tours)) )
+		self._survive()
+
+	def _tournament( self, count ):
+		a = self._rng.integers( len(self.tours), size=count )
+		b = self._rng.integers( len(self.tours), size=count )
+		return np.where( self.costs[a] <= self.costs[b], a, b )		# sorted, so lower index is never worse
+
+	def generation( self ):
+		rng = self._rng
+		count = len(self.tours)
+		first = self.tours[ self._tournament(count) ]
+		second = self.tours[ self._tournament(count) ]
+		children = first.copy()
+		cross = rng.random( count ) < self.CROSSOVER_RATE
+		if cross.any():
+			children[cross] = orderCrossover( first[cross], second[cross], rng )
+		mutate = rng.random( count ) < self.MUTATION_RATE
+		if mutate.any():
+			reverse = mutate & (rng.random( count ) < 0.5)
+			move = mutate & ~reverse
+			if reverse.any():
+				part = children[reverse]
+				reverseSegments( part, rng )
+				children[reverse] = part
+			if move.any():
+				part = children[move]
+				moveSegments( part, rng )
+				children[move] = part
+		costs = tourCosts( self._cost, children )
+		self.evaluated += count
+		if self._improve is not None:
+			best = costs.argmin()
+			if costs[best] < math.inf:
+				children[best] = self._improve( children[best] )
+				costs[best] = tourCosts( self._cost, children[best:best+1] )[0]
+		self.tours = np.concatenate( (self.tours, children) )
+		self.costs = np.concatenate( (self.costs, costs) )
+		self._survive()
+		self.generations += 1
+
+	''' <summary>
+		Generator that runs a generation per step, forever.
+		</summary> '''
+	def steps( self ):
+		while True:
+			self.generation()
+			yield
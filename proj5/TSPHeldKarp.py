@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+
+
+import time
+
+import numpy as np
+
+
+
+class HeldKarp:
+
+	MAX_BYTES = 2<<30		# refuse instances whose tables would need more than this
+	CHUNK_ROWS = 1<<15		# subsets relaxed per vectorized step
+
+	''' <summary>
+		Exact Held-Karp dynamic program over a (possibly asymmetric) cost
+		matrix, using np.inf for missing edges.  City 0 is the start; for the
+		m = n-1 other cities, dp[S, j] is the cheapest path that leaves city 0,
+		visits exactly the cities in bitmask S and ends at city j+1.  The table
+		(2^m x m) is int32 when no tour can overflow it (int64 otherwise), with
+		half the dtype's max standing for INF, and a parallel int8 table remembers
+		the predecessor of every entry so the tour can be rebuilt.
+
+		Subsets are processed a popcount layer at a time; within a layer, every
+		entry ending at j is one min-reduction of dp[S - {j}, :] + cost[:, j]
+		over a whole block of subsets.
+		</summary> '''
+	def __init__( self, cost_matrix, max_bytes=MAX_BYTES ):
+		self._cost = np.asarray( cost_matrix, dtype=np.float64 )
+		self._ncities = self._cost.shape[0]
+		self.dtype = self.tableDtype( self._cost )
+		self.memory = self.estimateMemory( self._ncities, self.dtype )
+		if self.memory > max_bytes:
+			raise MemoryError( 'Held-Karp on %d cities needs about %d MB (limit %d MB)' % \
+							   (self._ncities, self.memory>>20, max_bytes>>20) )
+		self.states = 0			# number of dp entries computed
+		self.route = None
+
+	# Half the dtype's range, so that INF plus INF still fits in an int64
+	@staticmethod
+	def _inf( dtype ):
+		return np.iinfo( dtype ).max // 2
+
+	''' <summary>
+		int32 if the longest possible tour fits in it, else int64.
+		</summary> '''
+	@staticmethod
+	def tableDtype( cost_matrix ):
+		finite = cost_matrix[ np.isfinite(cost_matrix) ]
+		largest = finite.max() if finite.size else 0.0
+		if largest * cost_matrix.shape[0] < HeldKarp._inf( np.int32 ):
+			return np.dtype( np.int32 )
+		return np.dtype( np.int64 )
+
+	''' <summary>
+		Bytes needed to solve an instance of ncities cities: the dp and
+		predecessor tables, the subset ordering and one block of scratch space.
+		</summary> '''
+	@classmethod
+	def estimateMemory( cls, ncities, dtype=np.int32 ):
+		m = ncities - 1
+		if m < 1:
+			return 0
+		rows = 1 << m
+		tables = rows * m * ( np.dtype(dtype).itemsize + 1 )
+		ordering = rows * ( 1 + np.dtype(np.intp).itemsize )
+		scratch = min( rows, cls.CHUNK_ROWS ) * m * 8 * 2
+		return tables + ordering + scratch
+
+	''' <summary>
+		Runs the dynamic program until it finishes, deadline (an absolute
+		time.time() value) passes or should_stop() returns True.
+		</summary>
+		<returns>the optimal tour as a list of city indices starting at 0, or
+		None if there is no tour or the search was stopped</returns>
+	'''
+	def solve( self, deadline=None, should_stop=None ):
+		for _ in self.steps():
+			if (deadline is not None and time.time() > deadline) or (should_stop and should_stop()):
+				return None
+		return self.route
+
+	''' <summary>
+		The dynamic program as a generator, yielding after every block of
+		subsets.  When it returns, route holds the optimal tour (None if there
+		is none).
+		</summary> '''
+	def steps( self ):
+		self.route = None
+		n = self._ncities
+		if n < 2:
+			self.route = list( range(n) )
+			return
+		m = n - 1
+		INF = self._inf( self.dtype )
+		cost = np.where( np.isfinite(self._cost), self._cost, INF ).astype( np.int64 )
+		inner = cost[1:,1:]
+
+		dp = np.full( (1<<m, m), INF, dtype=self.dtype )
+		parent = np.full( (1<<m, m), -1, dtype=np.int8 )
+		singles = np.arange( m )
+		dp[1 << singles, singles] = np.minimum( cost[0,1:], INF )
+		self.states = m
+
+		masks = np.arange( 1<<m )
+		popcount = np.zeros( 1<<m, dtype=np.uint8 )
+		for j in range( m ):
+			popcount += ( (masks >> j) & 1 ).astype( np.uint8 )
+		del masks
+		order = np.argsort( popcount, kind='stable' )
+		layer_start = np.concatenate( ([0], np.cumsum(np.bincount(popcount, minlength=m+1))) )
+		del popcount
+
+		for k in range( 2, m+1 ):
+			layer = order[layer_start[k]:layer_start[k+1]]
+			for j in range( m ):
+				ending = layer[ (layer >> j) & 1 == 1 ]
+				for first in range( 0, len(ending), self.CHUNK_ROWS ):
+					subsets = ending[first:first+self.CHUNK_ROWS]
+					candidates = dp[subsets ^ (1 << j)].astype( np.int64 )
+					candidates += inner[:,j]
+					best = candidates.argmin( axis=1 )
+					dp[subsets, j] = np.minimum( candidates[np.arange(len(subsets)), best], INF )
+					parent[subsets, j] = best
+					self.states += len(subsets)
+					yield
+
+		full = (1 << m) - 1
+		closing = dp[full].astype( np.int64 ) + cost[1:,0]
+		j = int( closing.argmin() )
+		if closing[j] >= INF:
+			return
+
+		route = []
+		subset = full
+		while j >= 0:
+			route.append( j+1 )
+			previous = int( parent[subset, j] )
+			subset ^= 1 << j
+			j = previous
+		self.route = [0] + route[::-1]
@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+
+
+import collections
+import cProfile
+import json
+import math
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+	import resource
+except ImportError:			# not on Windows
+	resource = None
+
+from TSPClasses import City, TSPSolution
+
+
+
+''' <summary>
+	Peak resident memory of this process so far in bytes, or None where the
+	platform cannot tell.
+	</summary>
+'''
+def peakRSS():
+	if resource is None:
+		return None
+	peak = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+	return peak if sys.platform == 'darwin' else peak*1024		# bytes on macOS, KB on Linux
+
+
+
+''' <summary>
+	A minimal sampling profiler: a background thread records the stack of one
+	thread every interval seconds.  The result is written in the collapsed
+	format ("outer;inner;innermost count" per line) that flamegraph.pl and
+	speedscope read.
+	</summary>
+'''
+class SamplingProfiler:
+
+	def __init__( self, interval=0.001 ):
+		self.interval = interval
+		self.samples = collections.Counter()
+		self._stop = threading.Event()
+		self._thread = None
+
+	def start( self, thread_id=None ):
+		self._target = threading.get_ident() if thread_id is None else thread_id
+		self._stop.clear()
+		self._thread = threading.Thread( target=self._run, daemon=True )
+		self._thread.start()
+
+	def stop( self ):
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+
+	def _run( self ):
+		while not self._stop.wait( self.interval ):
+			frame = sys._current_frames().get( self._target )
+			stack = []
+			while frame is not None:
+				code = frame.f_code
+				stack.append( '%s:%s:%d' % (os.path.basename(code.co_filename), code.co_name, code.co_firstlineno) )
+				frame = frame.f_back
+			if stack:
+				self.samples[ ';'.join(reversed(stack)) ] += 1
+
+	def write( self, path ):
+		with open( path, 'w' ) as f:
+			for stack, count in self.samples.most_common():
+				f.write( '%s %d\n' % (stack, count) )
+
+
+
+''' <summary>
+	Opt-in instrumentation of one solver run.  Nothing in the solvers pays
+	for it unless a TSPSolver has been given one with setInstrumentation():
+	the per-call counters work by temporarily wrapping City.costTo and
+	TSPSolution._setup (every TSPSolution is built through it) between
+	start() and stop(), and everything else is sampled from the anytime
+	driver's clock reads (see TSPAnytime.Clock), a few hundred times a second
+	at most.
+
+	Records call counts, the time spent in each phase the solver announces
+	(Progress.phase), time series of the queue size, BSSF cost and memory
+	high-water mark, and the driver's step and clock-read counts.  With
+	trace_memory the memory figures come from tracemalloc (Python
+	allocations, numpy included, at a real cost in speed); otherwise from
+	the process's peak resident size.
+
+	profiler is None, 'cprofile' or 'sample' (see SamplingProfiler); the
+	profile covers the calling thread only.
+	</summary>
+'''
+class Instrumentation:
+
+	PROFILERS = ( 'cprofile', 'sample' )
+
+	def __init__( self, profiler=None, trace_memory=False ):
+		if profiler not in (None,) + self.PROFILERS:
+			raise ValueError( 'unknown profiler %r' % (profiler,) )
+		self.profiler = profiler
+		self.trace_memory = trace_memory
+		self._profile = None
+		self._patched = None
+		self.record = None
+
+	def _memory( self ):
+		if self.trace_memory:
+			return tracemalloc.get_traced_memory()[1]
+		return peakRSS()
+
+	''' <summary>
+		Starts recording a run called name: installs the counting wrappers and
+		starts the profiler.
+		</summary> '''
+	def start( self, name ):
+		self._t0 = time.perf_counter()
+		self.record = { 'name':name, 'counters':{ 'costTo':0, 'TSPSolution':0 }, 'phases':[], \
+						'series':{ 'queue':[], 'bssf':[], 'memory':[] } }
+		self._phase = None
+		calls = self.record['counters']
+
+		cost_to = City.costTo
+		setup = TSPSolution._setup
+		def countedCostTo( city, other_city ):
+			calls['costTo'] += 1
+			return cost_to( city, other_city )
+		def countedSetup( soln, scenario, perm ):
+			calls['TSPSolution'] += 1
+			return setup( soln, scenario, perm )
+		self._patched = ( cost_to, setup )
+		City.costTo = countedCostTo
+		TSPSolution._setup = countedSetup
+
+		if self.trace_memory:
+			tracemalloc.start()
+			tracemalloc.reset_peak()
+		if self.profiler == 'cprofile':
+			self._profile = cProfile.Profile()
+			self._profile.enable()
+		elif self.profiler == 'sample':
+			self._profile = SamplingProfiler()
+			self._profile.start()
+
+	''' <summary>
+		Stops recording and restores everything start() changed.  results,
+		the solver's results dictionary, is summarized into the record.
+		</summary>
+		<returns>the record</returns>
+	'''
+	def stop( self, results=None ):
+		if self.profiler == 'cprofile':
+			self._profile.disable()
+		elif self.profiler == 'sample':
+			self._profile.stop()
+		City.costTo, TSPSolution._setup = self._patched
+		self._patched = None
+		self._endPhase()
+		record = self.record
+		record['time'] = self._elapsed()
+		record['memory_peak'] = self._memory()
+		if self.trace_memory:
+			tracemalloc.stop()
+		if results is not None:
+			record['results'] = { key:results.get(key) for key in ('cost', 'count', 'max', 'total', 'pruned') }
+			record['results']['cost'] = _finite( record['results']['cost'] )
+		return record
+
+	def _elapsed( self ):
+		return time.perf_counter() - self._t0
+
+	def _endPhase( self ):
+		if self._phase is not None:
+			self._phase['end'] = self._elapsed()
+			self._phase = None
+
+	''' <summary>
+		Ends the current phase, if any, and starts one called name.
+		</summary> '''
+	def phase( self, name ):
+		self._endPhase()
+		self._phase = { 'name':name, 'start':self._elapsed() }
+		self.record['phases'].append( self._phase )
+
+	# Hooks for TSPAnytime.AnytimeDriver
+	def driverFinished( self, clock ):
+		counters = self.record['counters']
+		counters['steps'] = counters.get( 'steps', 0 ) + clock.steps
+		counters['clock_reads'] = counters.get( 'clock_reads', 0 ) + clock.reads
+
+	def sample( self, progress ):
+		now = self._elapsed()
+		series = self.record['series']
+		if progress.queue_size is not None:
+			series['queue'].append( (now, progress.queue_size()) )
+		memory = self._memory()
+		if memory is not None:
+			series['memory'].append( (now, memory) )
+
+	def improved( self, progress ):
+		self.record['series']['bssf'].append( (self._elapsed(), float(progress.soln.cost)) )
+
+	def writeJSON( self, path ):
+		with open( path, 'w' ) as f:
+			json.dump( self.record, f, indent=1 )
+
+	''' <summary>
+		Writes the record in the Chrome trace event format, for
+		chrome://tracing or ui.perfetto.dev: the run and its phases as
+		complete events, the series as counters and the counts as arguments
+		of the run event.
+		</summary> '''
+	def writeChromeTrace( self, path ):
+		record = self.record
+		us = lambda seconds: int( seconds*1e6 )
+		pid = os.getpid()
+		events = [ { 'name':record['name'], 'ph':'X', 'ts':0, 'dur':us(record.get('time', self._elapsed())), \
+					 'pid':pid, 'tid':0, 'args':dict(record['counters'], memory_peak=record.get('memory_peak')) } ]
+		for phase in record['phases']:
+			end = phase.get( 'end', record.get('time', self._elapsed()) )
+			events.append( { 'name':phase['name'], 'ph':'X', 'ts':us(phase['start']), \
+							 'dur':us(end-phase['start']), 'pid':pid, 'tid':1 } )
+		for series, points in record['series'].items():
+			for t, value in points:
+				events.append( { 'name':series, 'ph':'C', 'ts':us(t), 'pid':pid, 'args':{ series:value } } )
+		with open( path, 'w' ) as f:
+			json.dump( { 'traceEvents':events, 'displayTimeUnit':'ms' }, f )
+
+	''' <summary>
+		Writes the profile: pstats data for 'cprofile' (snakeviz, or
+		python -m pstats), collapsed stacks for 'sample'.
+		</summary> '''
+	def writeProfile( self, path ):
+		if self.profiler == 'cprofile':
+			self._profile.dump_stats( path )
+		elif self.profiler == 'sample':
+			self._profile.write( path )
+
+
+
+def _finite( value ):
+	return None if value is None or value == math.inf else float( value )
@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+
+
+import json
+
+import numpy as np
+
+from TSPClasses import *
+from TSPEdgeMask import PackedEdgeMask, ImplicitEdgeMask
+
+
+
+''' <summary>
+	Reading and writing scenarios and tours in TSPLIB format, plus a compact
+	binary container for fast bulk loading.
+
+	Supported TSPLIB instances are TYPE TSP or ATSP with EDGE_WEIGHT_TYPE
+	EXPLICIT (FULL_MATRIX, UPPER_ROW, LOWER_ROW, UPPER_DIAG_ROW or
+	LOWER_DIAG_ROW) or EUC_2D.  EXPLICIT instances become
+	Scenario.fromCostMatrix scenarios (with DISPLAY_DATA_SECTION coordinates
+	if there are any), EUC_2D ones Scenario.fromCoordinates scenarios.
+	TSPLIB has no missing edges, so weights of MISSING_EDGE_WEIGHT or more
+	(the usual ATSP convention for "never use this edge") are read as INF,
+	and INF costs are written as MISSING_EDGE_WEIGHT.
+
+	Files are read and written a line (or a block of rows) at a time, so
+	nothing bigger than the cost matrix itself is ever held in memory.
+	</summary>
+'''
+
+MISSING_EDGE_WEIGHT = 100000000
+WRITE_ROWS_PER_BLOCK = 256
+
+BINARY_MAGIC = b'TSPSCEN1'
+BINARY_ALIGNMENT = 64
+
+
+
+def _splitHeader( line ):
+	key, _, value = line.partition( ':' )
+	return key.strip().upper(), value.strip()
+
+''' <summary>
+	Pulls count numbers out of the lines that follow a section keyword,
+	however they are split across lines.
+	</summary> '''
+def _readNumbers( lines, count ):
+	values = np.empty( count, dtype=np.float64 )
+	filled = 0
+	for line in lines:
+		numbers = np.array( line.split(), dtype=np.float64 )
+		take = min( len(numbers), count-filled )
+		values[filled:filled+take] = numbers[:take]
+		filled += take
+		if filled == count:
+			return values
+	raise ValueError( 'TSPLIB file ended %d numbers short' % (count-filled) )
+
+def _readCoordinates( lines, ncities ):
+	rows = _readNumbers( lines, 3*ncities ).reshape( ncities, 3 )
+	xs = np.empty( ncities )
+	ys = np.empty( ncities )
+	ids = rows[:,0].astype( np.intp ) - 1
+	xs[ids] = rows[:,1]
+	ys[ids] = rows[:,2]
+	return xs, ys
+
+def _explicitMatrix( weights, ncities, fmt ):
+	if fmt == 'FULL_MATRIX':
+		matrix = weights.reshape( ncities, ncities ).copy()
+	else:
+		matrix = np.zeros( (ncities, ncities) )
+		diag = fmt.endswith( 'DIAG_ROW' )
+		upper = fmt.startswith( 'UPPER' )
+		# both index generators are row-major, which is the order the files use
+		rows, cols = np.triu_indices( ncities, 0 if diag else 1 ) if upper else \
+					 np.tril_indices( ncities, 0 if diag else -1 )
+		matrix[rows, cols] = weights
+		matrix[cols, rows] = weights
+	matrix[ matrix >= MISSING_EDGE_WEIGHT ] = np.inf
+	np.fill_diagonal( matrix, np.inf )
+	return matrix
+
+def _weightCount( ncities, fmt ):
+	return { 'FULL_MATRIX': ncities*ncities,
+			 'UPPER_ROW': ncities*(ncities-1)//2, 'LOWER_ROW': ncities*(ncities-1)//2,
+			 'UPPER_DIAG_ROW': ncities*(ncities+1)//2, 'LOWER_DIAG_ROW': ncities*(ncities+1)//2 }[fmt]
+
+
+''' <summary>
+	Reads a TSPLIB TSP/ATSP instance.
+	</summary>
+	<returns>(scenario, name)</returns>
+'''
+def readTSPLIB( path ):
+	header = {}
+	weights = coords = display = None
+	with open( path ) as f:
+		lines = iter( f )
+		for line in lines:
+			line = line.strip()
+			if not line:
+				continue
+			key, value = _splitHeader( line )
+			if key == 'EOF':
+				break
+			ncities = int( header.get('DIMENSION', 0) )
+			if key == 'NODE_COORD_SECTION':
+				coords = _readCoordinates( lines, ncities )
+			elif key == 'DISPLAY_DATA_SECTION':
+				display = _readCoordinates( lines, ncities )
+			elif key == 'EDGE_WEIGHT_SECTION':
+				fmt = header.get( 'EDGE_WEIGHT_FORMAT', 'FULL_MATRIX' ).upper()
+				if fmt not in ('FULL_MATRIX', 'UPPER_ROW', 'LOWER_ROW', 'UPPER_DIAG_ROW', 'LOWER_DIAG_ROW'):
+					raise ValueError( 'unsupported EDGE_WEIGHT_FORMAT %s' % fmt )
+				weights = _explicitMatrix( _readNumbers(lines, _weightCount(ncities, fmt)), ncities, fmt )
+			elif key.endswith( '_SECTION' ):
+				raise ValueError( 'unsupported TSPLIB section %s' % key )
+			else:
+				header[key] = value
+
+	kind = header.get( 'TYPE', 'TSP' ).upper()
+	weight_type = header.get( 'EDGE_WEIGHT_TYPE', '' ).upper()
+	if kind not in ('TSP', 'ATSP'):
+		raise ValueError( 'not a TSP or ATSP instance: TYPE %s' % kind )
+	if weight_type == 'EXPLICIT':
+		if weights is None:
+			raise ValueError( 'EXPLICIT instance without an EDGE_WEIGHT_SECTION' )
+		xs, ys = display if display is not None else coords if coords is not None else (None, None)
+		scenario = Scenario.fromCostMatrix( weights, xs, ys )
+	elif weight_type == 'EUC_2D':
+		if coords is None:
+			raise ValueError( 'EUC_2D instance without a NODE_COORD_SECTION' )
+		scenario = Scenario.fromCoordinates( *coords )
+	else:
+		raise ValueError( 'unsupported EDGE_WEIGHT_TYPE %s' % weight_type )
+	return scenario, header.get( 'NAME', '' )
+
+def _costRows( scenario, first, last ):
+	if scenario._explicit_costs is not None:
+		return scenario._explicit_costs[first:last]
+	ncities = scenario.getNumCities()
+	return scenario._computeCosts( np.arange(first, last), np.arange(ncities) )
+
+def _writeCoordinates( f, xs, ys ):
+	for i in range( len(xs) ):
+		f.write( '%d %r %r\n' % (i+1, float(xs[i]), float(ys[i])) )
+
+''' <summary>
+	Writes scenario as a TSPLIB file: EUC_2D scenarios as TYPE TSP with a
+	NODE_COORD_SECTION, everything else as TYPE ATSP with an EXPLICIT
+	FULL_MATRIX (computed a block of rows at a time) and the city
+	coordinates as DISPLAY_DATA_SECTION.
+	</summary> '''
+def writeTSPLIB( scenario, path, name='scenario', comment=None ):
+	ncities = scenario.getNumCities()
+	with open( path, 'w' ) as f:
+		f.write( 'NAME : %s\n' % name )
+		euclidean = scenario._difficulty == 'EUC_2D'
+		f.write( 'TYPE : %s\n' % ('TSP' if euclidean else 'ATSP') )
+		f.write( 'COMMENT : %s\n' % (comment if comment else 'difficulty %s' % scenario._difficulty) )
+		f.write( 'DIMENSION : %d\n' % ncities )
+		if euclidean:
+			f.write( 'EDGE_WEIGHT_TYPE : EUC_2D\n' )
+			f.write( 'NODE_COORD_SECTION\n' )
+			_writeCoordinates( f, scenario._xs, scenario._ys )
+		else:
+			f.write( 'EDGE_WEIGHT_TYPE : EXPLICIT\n' )
+			f.write( 'EDGE_WEIGHT_FORMAT : FULL_MATRIX\n' )
+			f.write( 'DISPLAY_DATA_TYPE : TWOD_DISPLAY\n' )
+			f.write( 'EDGE_WEIGHT_SECTION\n' )
+			for first in range( 0, ncities, WRITE_ROWS_PER_BLOCK ):
+				block = _costRows( scenario, first, min(ncities, first+WRITE_ROWS_PER_BLOCK) )
+				block = np.where( np.isinf(block), MISSING_EDGE_WEIGHT, block ).astype( np.int64 )
+				for row in block:
+					f.write( ' '.join( row.astype(str) ) )
+					f.write( '\n' )
+			f.write( 'DISPLAY_DATA_SECTION\n' )
+			_writeCoordinates( f, scenario._xs, scenario._ys )
+		f.write( 'EOF\n' )
+
+
+''' <summary>
+	Reads a TSPLIB .tour file.
+	</summary>
+	<returns>the tour as an array of 0-based city indices</returns>
+'''
+def readTour( path ):
+	cities = []
+	with open( path ) as f:
+		in_tour = False
+		for line in f:
+			line = line.strip()
+			if not in_tour:
+				in_tour = _splitHeader( line )[0] == 'TOUR_SECTION'
+				continue
+			for token in line.split():
+				city = int( token )
+				if city == -1:
+					return np.array( cities, dtype=np.intp )
+				cities.append( city-1 )
+	return np.array( cities, dtype=np.intp )
+
+''' <summary>
+	Writes a tour (a TSPSolution or a sequence of 0-based city indices) as a
+	TSPLIB .tour file.
+	</summary> '''
+def writeTour( tour, path, name='tour', comment=None ):
+	if isinstance( tour, TSPSolution ):
+		if comment is None:
+			comment = 'cost %s' % tour.cost
+		tour = tour.perm
+	tour = np.asarray( tour )
+	with open( path, 'w' ) as f:
+		f.write( 'NAME : %s\n' % name )
+		f.write( 'TYPE : TOUR\n' )
+		if comment:
+			f.write( 'COMMENT : %s\n' % comment )
+		f.write( 'DIMENSION : %d\n' % len(tour) )
+		f.write( 'TOUR_SECTION\n' )
+		for city in tour.tolist():
+			f.write( '%d\n' % (city+1) )
+		f.write( '-1\nEOF\n' )
+
+
+''' <summary>
+	Writes scenario to a single binary file: BINARY_MAGIC, an 8-byte little
+	endian header length, a JSON header, then the raw arrays (the city data,
+	the edge mask and, for explicit scenarios, the cost matrix), each at a
+	BINARY_ALIGNMENT-aligned offset listed in the header.
+	</summary> '''
+def writeBinary( scenario, path ):
+	arrays = { 'xs': scenario._xs, 'ys': scenario._ys, 'elevations': scenario._elevations }
+	header = { 'difficulty': scenario._difficulty, 'ncities': scenario.getNumCities() }
+	edges = scenario._edge_exists
+	if isinstance( edges, ImplicitEdgeMask ):
+		header.update( edges='implicit', edge_seed=edges.seed, p_remove=edges.p_remove )
+		arrays['route_keep'] = edges._route_keep
+	else:
+		header['edges'] = 'packed'
+		arrays['edges'] = edges._bits
+	if scenario._explicit_costs is not None:
+		arrays['costs'] = scenario._explicit_costs
+
+	arrays = { key: np.ascontiguousarray(value) for key, value in arrays.items() }
+	# offsets are relative to the end of the header, so they do not depend on
+	# its length
+	offset = 0
+	header['arrays'] = {}
+	for key, value in arrays.items():
+		header['arrays'][key] = { 'dtype': value.dtype.str, 'shape': value.shape, 'offset': offset }
+		offset += -(-value.nbytes // BINARY_ALIGNMENT) * BINARY_ALIGNMENT
+	encoded = json.dumps( header ).encode()
+	encoded += b' ' * (-(len(BINARY_MAGIC)+8+len(encoded)) % BINARY_ALIGNMENT)
+
+	with open( path, 'wb' ) as f:
+		f.write( BINARY_MAGIC )
+		f.write( np.uint64(len(encoded)).tobytes() )
+		f.write( encoded )
+		start = f.tell()
+		for key, value in arrays.items():
+			f.seek( start + header['arrays'][key]['offset'] )
+			f.write( value.tobytes() )
+
+''' <summary>
+	Reads a file written by writeBinary.  With mmap=True (the default) the
+	arrays are read-only np.memmap views of the file, so loading is
+	immediate and only the parts actually used are ever read.
+	</summary> '''
+def readBinary( path, mmap=True ):
+	with open( path, 'rb' ) as f:
+		if f.read( len(BINARY_MAGIC) ) != BINARY_MAGIC:
+			raise ValueError( '%s is not a binary scenario file' % path )
+		length = int( np.frombuffer(f.read(8), dtype=np.uint64)[0] )
+		header = json.loads( f.read(length) )
+	start = len(BINARY_MAGIC) + 8 + length
+
+	def array( key ):
+		info = header['arrays'][key]
+		dtype = np.dtype( info['dtype'] )
+		shape = tuple( info['shape'] )
+		if mmap:
+			return np.memmap( path, dtype=dtype, mode='r', offset=start+info['offset'], shape=shape )
+		return np.fromfile( path, dtype=dtype, count=int(np.prod(shape)), \
+							offset=start+info['offset'] ).reshape( shape )
+
+	ncities = header['ncities']
+	scenario = Scenario.__new__( Scenario )
+	scenario._difficulty = header['difficulty']
+	scenario._setCities( array('xs'), array('ys'), array('elevations') )
+	if header['edges'] == 'implicit':
+		scenario._edge_exists = ImplicitEdgeMask( ncities, header['edge_seed'], header['p_remove'], \
+												  array('route_keep') )
+	else:
+		scenario._edge_exists = PackedEdgeMask( ncities, array('edges') )
+	if 'costs' in header['arrays']:
+		scenario._explicit_costs = array( 'costs' )
+	return scenario
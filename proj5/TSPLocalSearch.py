@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+
+
+import time
+from collections import deque
+
+import numpy as np
+
+
+
+CANDIDATE_BLOCK = 1<<22		# costs looked up at once from a cost matrix that isn't an array
+
+''' <summary>
+	For every city, the (up to) k cities reachable from it most cheaply, sorted
+	by cost.  Pass cost_matrix.T to get the k cheapest predecessors instead.
+	Missing (INF) edges are never candidates.  cost_matrix may also be
+	anything indexed like one with arrays (e.g. a TSPCostOracle.CostOracle),
+	whose rows are then read CANDIDATE_BLOCK costs at a time.
+	</summary>
+'''
+def candidateLists( cost_matrix, k ):
+	n = cost_matrix.shape[1]
+	if not isinstance( cost_matrix, np.ndarray ):
+		rows = max( 1, CANDIDATE_BLOCK // n )
+		lists = []
+		for lo in range( 0, cost_matrix.shape[0], rows ):
+			block = np.arange( lo, min(cost_matrix.shape[0], lo+rows) )
+			lists += candidateLists( cost_matrix[block[:,None], np.arange(n)[None,:]], k )
+		return lists
+	k = min( k, n-1 )
+	near = np.argpartition( cost_matrix, k-1, axis=1 )[:,:k]
+	near_cost = np.take_along_axis( cost_matrix, near, axis=1 )
+	order = np.argsort( near_cost, axis=1, kind='stable' )
+	near = np.take_along_axis( near, order, axis=1 )
+	near_cost = np.take_along_axis( near_cost, order, axis=1 )
+	return [ row[np.isfinite(cost)].tolist() for row, cost in zip(near, near_cost) ]
+
+
+
+class LocalSearch:
+
+	OR_OPT_MAX_SEGMENT = 3
+
+	''' <summary>
+		2-opt and Or-opt improvement, in place, of a feasible TSPSolution under
+		its scenario's asymmetric cost matrix (np.inf for missing edges).
+
+		Reversing a segment of an asymmetric tour changes the cost of every edge
+		inside it; TSPSolution.reverseDelta prices that from prefix sums of the
+		forward and backward edge costs along the tour, and rejects reversals
+		that would use a missing edge.  Or-opt moves relocate a segment of up to
+		three cities without changing its direction.  Moves are only generated
+		from candidate neighbour lists, and cities whose neighbourhood has not
+		changed since they last failed to improve are skipped (don't-look bits).
+		</summary> '''
+	def __init__( self, solution, neighbours=8 ):
+		self.solution = solution
+		self._ncities = len(solution.perm)
+		self.improvements = 0
+		self.evaluated = 0
+		if self._ncities > 3:
+			self._out = candidateLists( solution._matrix, neighbours )
+			self._in = candidateLists( solution._matrix.T, neighbours )
+
+	''' <summary>
+		Change in tour cost from reversing tour positions p+1..q (0 <= p, q < n,
+		q >= p+2), or None if the move is out of range or infeasible.
+		</summary> '''
+	def _twoOptDelta( self, p, q ):
+		if p < 0 or q >= self._ncities or q < p+2:
+			return None
+		delta = self.solution.reverseDelta( p+1, q )
+		if delta == np.inf:
+			return None
+		self.evaluated += 1
+		return delta
+
+	def _applyTwoOpt( self, p, q ):
+		t = self.solution.perm
+		touched = [ t[p], t[p+1], t[q], t[(q+1)%self._ncities] ]
+		self.solution.applyReverse( p+1, q )
+		return touched
+
+	def _bestTwoOpt( self, city ):
+		pos = self.solution.pos
+		a = pos[city]
+		best = (-0.5, None)
+		for x in self._out[city]:
+			b = pos[x]
+			for move in ( (a,b), (a-1,b-1) ):
+				delta = self._twoOptDelta( *move )
+				if delta is not None and delta < best[0]:
+					best = (delta, move)
+		for y in self._in[city]:
+			b = pos[y]
+			for move in ( (b,a), (b-1,a-1) ):
+				delta = self._twoOptDelta( *move )
+				if delta is not None and delta < best[0]:
+					best = (delta, move)
+		return best
+
+	''' <summary>
+		Best improving relocation of a segment (of 1..OR_OPT_MAX_SEGMENT cities)
+		that starts or ends at city, reinserted in the same direction between
+		two consecutive cities x -> y elsewhere in the tour.
+		</summary> '''
+	def _bestOrOpt( self, city ):
+		solution = self.solution
+		t = solution.perm
+		pos = solution.pos
+		n = self._ncities
+		best = (-0.5, None)
+		for length in range( 1, min(self.OR_OPT_MAX_SEGMENT, n-3)+1 ):
+			firsts = { pos[city], pos[city]-length+1 }
+			for s in firsts:
+				if s < 0 or s+length > n:
+					continue
+				e = s+length-1
+				# insert after x (a cheap predecessor of the first city) or before
+				# y (a cheap successor of the last one)
+				targets = [ pos[x] for x in self._in[t[s]] ] + [ pos[y]-1 for y in self._out[t[e]] ]
+				for k in targets:
+					if s-1 <= k <= e:
+						continue
+					self.evaluated += 1
+					delta = solution.segmentMoveDelta( s, e, k )
+					if delta < best[0]:
+						best = (delta, (s, e, k))
+		return best
+
+	def _applyOrOpt( self, s, e, k ):
+		t = self.solution.perm
+		n = self._ncities
+		touched = [ t[s-1], t[s], t[e], t[(e+1)%n], t[k%n], t[(k+1)%n] ]
+		self.solution.applySegmentMove( s, e, k )
+		return touched
+
+	''' <summary>
+		The search as a generator: yields after every city it looks at, True
+		if that applied a move, and returns once no city can be improved.
+		</summary> '''
+	def steps( self ):
+		n = self._ncities
+		if n <= 3:
+			return
+		queue = deque( self.solution.perm.tolist() )
+		queued = np.ones( n, dtype=bool )
+		while queue:
+			city = queue.popleft()
+			queued[city] = False
+
+			two_opt = self._bestTwoOpt( city )
+			or_opt = self._bestOrOpt( city )
+			if two_opt[1] is None and or_opt[1] is None:
+				yield False
+				continue		# don't-look bit stays set until a neighbour changes
+
+			if or_opt[1] is None or (two_opt[1] is not None and two_opt[0] <= or_opt[0]):
+				touched = self._applyTwoOpt( *two_opt[1] )
+			else:
+				touched = self._applyOrOpt( *or_opt[1] )
+			self.improvements += 1
+
+			for c in touched + [city]:
+				if not queued[c]:
+					queued[c] = True
+					queue.append( c )
+			yield True
+
+	''' <summary>
+		Applies improving moves until no city can be improved, the deadline
+		(an absolute time.time() value) passes or should_stop() returns True.
+		If on_improvement is given it is called with no arguments after every
+		applied move.
+		</summary> '''
+	def run( self, deadline, on_improvement=None, should_stop=None ):
+		for improved in self.steps():
+			if improved and on_improvement:
+				on_improvement()
+			if time.time() >= deadline or (should_stop and should_stop()):
+				break
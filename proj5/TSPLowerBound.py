@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+
+
+import math
+import time
+
+import numpy as np
+
+
+
+''' <summary>
+	Cycles of a functional graph given as a successor array jump (root
+	points to itself, and so should anything that is to be ignored), found
+	with pointer doubling: the image of jump^(2^L) for 2^L >= n is exactly
+	the set of nodes on cycles.
+	</summary>
+	<returns>cycle label per node (the smallest node on its cycle), or -1
+	for nodes that are on no cycle</returns>
+'''
+def _cycleLabels( jump, root ):
+	n = len(jump)
+	rounds = max( 1, (n-1).bit_length() )
+	reach = jump
+	for _ in range( rounds ):
+		reach = reach[reach]
+	on_cycle = np.zeros( n, dtype=bool )
+	on_cycle[reach] = True
+	on_cycle[root] = False
+
+	label = np.where( on_cycle, np.arange(n), n )
+	step = jump
+	for _ in range( rounds ):
+		label = np.where( on_cycle, np.minimum(label, label[step]), n )
+		step = step[step]
+	return np.where( on_cycle, label, -1 )
+
+''' <summary>
+	Minimum spanning arborescence rooted at root (Chu-Liu/Edmonds) of the
+	dense weight matrix W, where W[i,j] is the cost of edge i -> j and the
+	diagonal and column root are np.inf.
+
+	Works in place on a copy of W whose rows and columns are supernodes
+	(named after one of their cities), with src/dst recording which original
+	edge each entry stands for.  Every round finds all the cycles among the
+	cheapest edges into each supernode at once and contracts each cycle into
+	its first member: its row becomes the elementwise min of the members'
+	rows, its column the min of their columns less the cycle edge each one
+	would give up.  Only the contracted supernodes need a new cheapest
+	incoming edge.  The contractions are then undone in reverse to turn the
+	chosen edges back into a parent array.
+	</summary>
+	<returns>parent array (parent[root] == -1), or None if some node cannot
+	be reached from root</returns>
+'''
+def minArborescence( W, root ):
+	n = W.shape[0]
+	W = np.array( W, dtype=np.float64 )
+	index = np.arange( n, dtype=np.int32 )
+	src = np.repeat( index[:,None], n, axis=1 )
+	dst = np.repeat( index[None,:], n, axis=0 )
+	alive = np.ones( n, dtype=bool )
+	rep = np.arange( n )			# supernode each city currently belongs to
+	par = np.argmin( W, axis=0 )	# cheapest incoming edge of each supernode
+	inw = W[par, np.arange(n)]
+	par[root] = root
+	inw[root] = 0.0
+	if not np.isfinite( inw ).all():
+		return None
+
+	records = []
+	while True:
+		jump = np.where( alive, par, root )
+		label = _cycleLabels( jump, root )
+		on_cycle = np.flatnonzero( label >= 0 )
+		if len(on_cycle) == 0:
+			break
+		on_cycle = on_cycle[ np.argsort(label[on_cycle], kind='stable') ]
+		starts = np.flatnonzero( np.diff(label[on_cycle]) ) + 1
+		merged = []
+		for members in np.split( on_cycle, starts ):
+			r = members[0]
+			cities = np.flatnonzero( np.isin(rep, members) )
+			records.append( (r, members, src[par[members], members], dst[par[members], members], \
+							 cities, rep[cities].copy()) )
+
+			cols = W[:,members] - inw[members]
+			best = np.argmin( cols, axis=1 )
+			pick = members[best]
+			W[:,r] = cols[np.arange(n), best]
+			src[:,r] = src[np.arange(n), pick]
+			dst[:,r] = dst[np.arange(n), pick]
+			rows = W[members,:]
+			best = np.argmin( rows, axis=0 )
+			pick = members[best]
+			W[r,:] = rows[best, np.arange(n)]
+			src[r,:] = src[pick, np.arange(n)]
+			dst[r,:] = dst[pick, np.arange(n)]
+
+			W[members[1:],:] = np.inf
+			W[:,members[1:]] = np.inf
+			W[r,r] = np.inf
+			alive[members[1:]] = False
+			rep[cities] = r
+			merged.append( r )
+
+		par = rep[par]
+		merged = np.array( merged )
+		par[merged] = np.argmin( W[:,merged], axis=0 )
+		inw[merged] = W[par[merged], merged]
+		if not np.isfinite( inw[merged] ).all():
+			return None
+
+	# The edge entering each supernode, then undo the contractions: the
+	# member that edge actually enters takes it over, the others get back
+	# their cycle edges
+	into = np.flatnonzero( alive & (index != root) )
+	enter_src = np.empty( n, dtype=np.intp )
+	enter_dst = np.empty( n, dtype=np.intp )
+	enter_src[into] = src[par[into], into]
+	enter_dst[into] = dst[par[into], into]
+	for r, members, cycle_src, cycle_dst, cities, owner in reversed( records ):
+		u, v = enter_src[r], enter_dst[r]
+		entered = owner[ np.searchsorted(cities, v) ]
+		enter_src[members] = cycle_src
+		enter_dst[members] = cycle_dst
+		enter_src[entered] = u
+		enter_dst[entered] = v
+	enter_src[root] = -1
+	return enter_src
+
+
+
+class LowerBound:
+
+	STALL_ITERATIONS = 10		# halve the step after this many iterations without improvement
+	MIN_STEP_SCALE = 1e-4
+	TARGET_GAP = 0.05			# steps aim this fraction above the best value so far
+
+	''' <summary>
+		Held-Karp style lower bound on any tour of an asymmetric cost matrix
+		(np.inf for missing edges), from minimum 1-arborescences: a spanning
+		arborescence rooted at city 0 plus the cheapest edge back into 0.  In
+		such a graph every city has in-degree 1, as in a tour, so the only
+		relaxed constraints are the out-degrees.  Node penalties pi are added
+		to every edge leaving a city, which leaves every tour's cost up by
+		sum(pi), and are tuned by subgradient optimization:
+		pi += step * (out-degree - 1).
+
+		Steps aim TARGET_GAP above the best value so far rather than at
+		upper_bound, so a poor upper bound (e.g. a random tour's cost) can't
+		make them overshoot and weaken the bound, and the bound doesn't
+		depend on which solver found the tour.  upper_bound only stops the
+		iterations once the bound reaches it.
+
+		improve() can be called repeatedly; each call carries on from where
+		the last one stopped.  bound is the best (integer, rounded up) bound
+		so far and penalties the pi that gave it.
+		</summary> '''
+	def __init__( self, cost_matrix, upper_bound=math.inf ):
+		self._cost = np.asarray( cost_matrix, dtype=np.float64 )
+		self._ncities = self._cost.shape[0]
+		self.upper_bound = upper_bound
+		self.bound = -math.inf
+		self.penalties = np.zeros( self._ncities )
+		self.iterations = 0
+		self.optimal = False		# the best 1-arborescence was itself a tour
+		self._pi = np.zeros( self._ncities )
+		self._step_scale = 2.0
+		self._stall = 0
+		self._best_value = -math.inf
+		# No tour costs more than this, so a bound above it means there is none
+		finite = self._cost[ np.isfinite(self._cost) ]
+		self._most = self._ncities * finite.max() + 1.0 if finite.size else math.inf
+
+	''' <summary>
+		Lagrangian value and out-degrees for penalties pi, or (inf, None) if
+		no 1-arborescence (and therefore no tour) exists.
+		</summary> '''
+	def evaluate( self, pi ):
+		n = self._ncities
+		weights = self._cost + pi[:,None]
+		into_root = int( np.argmin(weights[:,0]) )
+		closing = weights[into_root,0]
+		tree = weights.copy()
+		tree[:,0] = np.inf
+		np.fill_diagonal( tree, np.inf )
+		parent = minArborescence( tree, 0 )
+		if parent is None or not np.isfinite( closing ):
+			return math.inf, None
+		children = np.arange( 1, n )
+		value = weights[parent[children], children].sum() + closing - pi.sum()
+		degrees = np.bincount( parent[children], minlength=n )
+		degrees[into_root] += 1
+		return value, degrees
+
+	def _record( self, value ):
+		bound = math.inf if value == math.inf else math.ceil( value - 1e-6 )
+		if bound > self.bound:
+			self.bound = bound
+			self.penalties = self._pi.copy()
+			return True
+		return False
+
+	''' <summary>
+		Runs subgradient iterations until deadline (an absolute time.time()
+		value) passes, max_iterations more have been done, should_stop()
+		returns True, or the bound cannot be improved any more.
+		</summary>
+		<returns>the bound</returns>
+	'''
+	def improve( self, deadline=None, max_iterations=None, should_stop=None ):
+		n = self._ncities
+		if n < 2:
+			return self.bound
+		done = 0
+		while not self.optimal and self.bound < self.upper_bound and self._step_scale > self.MIN_STEP_SCALE:
+			if max_iterations is not None and done >= max_iterations:
+				break
+			if (deadline is not None and time.time() > deadline) or (should_stop and should_stop()):
+				break
+			with np.errstate( over='ignore', invalid='ignore' ):
+				value, degrees = self.evaluate( self._pi )
+			self.iterations += 1
+			done += 1
+			if degrees is None:
+				self._record( math.inf )
+				break
+			if value > self._most:
+				# The value only grows without limit when there is no tour
+				self._record( math.inf )
+				break
+			if not math.isfinite( value ):
+				break			# the penalties overflowed; keep the bound so far
+			self._best_value = max( self._best_value, value )
+			if self._record( value ):
+				self._stall = 0
+			else:
+				self._stall += 1
+				if self._stall >= self.STALL_ITERATIONS:
+					self._step_scale /= 2.0
+					self._stall = 0
+			subgradient = degrees - 1
+			norm = float( subgradient @ subgradient )
+			if norm == 0:
+				self.optimal = True		# the 1-arborescence is a tour, so the bound is exact
+				break
+			target = self._best_value + self.TARGET_GAP*abs(self._best_value) + 1.0
+			self._pi += self._step_scale * (target - value) / norm * subgradient
+		return self.bound
+
+	''' <summary>
+		Bound on every tour that starts with path (a list of city indices):
+		the cost of the path plus the 1-arborescence bound, with the current
+		penalties, of the graph left after contracting the path into one node
+		(left from path[-1], entered at path[0]).
+		</summary> '''
+	def pathBound( self, path ):
+		C = self._cost
+		path = np.asarray( path )
+		remaining = np.ones( self._ncities, dtype=bool )
+		remaining[path] = False
+		remaining = np.flatnonzero( remaining )
+		fixed = C[path[:-1], path[1:]].sum()
+		if len(remaining) == 0:
+			return fixed + C[path[-1], path[0]]
+		nodes = np.concatenate( ([path[-1]], remaining) )
+		weights = C[nodes[:,None], nodes[None,:]]
+		weights[1:,0] = C[remaining, path[0]]
+		pi = self.penalties[nodes]
+		weights += pi[:,None]
+		closing = weights[1:,0].min()
+		weights[:,0] = np.inf
+		np.fill_diagonal( weights, np.inf )
+		parent = minArborescence( weights, 0 )
+		if parent is None or not np.isfinite( closing ):
+			return math.inf
+		children = np.arange( 1, len(nodes) )
+		return fixed + weights[parent[children], children].sum() + closing - pi.sum()
@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from TSPClasses import *
+from TSPEdgeMask import PackedEdgeMask, ImplicitEdgeMask
+
+
+
+''' <summary>
+	On-disk cache of generated scenarios, so that the same (size, seed,
+	difficulty) is only ever generated once.  Each entry is a directory of
+	.npy files (coordinates, elevations, the edge mask and, if it fits, the
+	cost matrix) plus a meta.json, named by a hash of the generation
+	parameters and Scenario.GENERATION_VERSION.  Entries are reopened with
+	np.load( mmap_mode='r' ), so nothing is copied into memory until it is
+	touched, and the arrays are read-only.
+
+	Only deterministic generation is cached: everything from the fast
+	generator, and every legacy difficulty except "Hard", whose thinning
+	draws from numpy's unseeded global generator.
+
+	When the entries add up to more than max_bytes the least recently used
+	ones are deleted, along with any written by another GENERATION_VERSION.
+	</summary>
+'''
+class ScenarioCache:
+
+	DEFAULT_MAX_BYTES = 4<<30
+
+	def __init__( self, directory, max_bytes=DEFAULT_MAX_BYTES ):
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.hits = 0
+		self.misses = 0
+		os.makedirs( directory, exist_ok=True )
+
+	@staticmethod
+	def cacheable( difficulty, legacy=False ):
+		return not (legacy and difficulty == 'Hard')
+
+	def _params( self, size, seed, difficulty, data_range, legacy ):
+		return { 'version':Scenario.GENERATION_VERSION, 'size':size, 'seed':seed, \
+				 'difficulty':difficulty, 'legacy':bool(legacy), \
+				 'data_range':{ axis:list(data_range[axis]) for axis in ('x','y') } }
+
+	def _entryPath( self, params ):
+		key = hashlib.sha1( json.dumps(params, sort_keys=True).encode() ).hexdigest()
+		return os.path.join( self.directory, key )
+
+	''' <summary>
+		The cached scenario for these parameters, generating and storing it
+		first if it is not in the cache (or cannot be cached).
+		</summary> '''
+	def get( self, size, seed, difficulty, data_range=DEFAULT_DATA_RANGE, legacy=False, store_costs=True ):
+		if not self.cacheable( difficulty, legacy ):
+			return Scenario.generate( size, seed, difficulty, data_range, legacy=legacy )
+		params = self._params( size, seed, difficulty, data_range, legacy )
+		path = self._entryPath( params )
+		scenario = self._load( path )
+		if scenario is not None:
+			self.hits += 1
+			return scenario
+		self.misses += 1
+		scenario = Scenario.generate( size, seed, difficulty, data_range, legacy=legacy )
+		self._store( path, params, scenario, store_costs )
+		self.evict()
+		return scenario
+
+	def _load( self, path ):
+		meta_path = os.path.join( path, 'meta.json' )
+		try:
+			with open( meta_path ) as f:
+				meta = json.load( f )
+		except (OSError, ValueError):
+			return None
+		os.utime( meta_path )		# mark as recently used
+
+		def array( name ):
+			return np.load( os.path.join(path, name+'.npy'), mmap_mode='r' )
+
+		scenario = Scenario.__new__( Scenario )
+		scenario._difficulty = meta['difficulty']
+		scenario._seed = meta['seed']
+		scenario._setCities( array('xs'), array('ys'), array('elevations') )
+		ncities = meta['size']
+		if meta['edges'] == 'implicit':
+			scenario._edge_exists = ImplicitEdgeMask( ncities, meta['edge_seed'], meta['p_remove'], \
+													  array('route_keep') )
+		else:
+			scenario._edge_exists = PackedEdgeMask( ncities, array('edges') )
+		if meta['costs']:
+			scenario._cost_matrix = array( 'costs' )
+		return scenario
+
+	def _store( self, path, params, scenario, store_costs ):
+		# Written to a temporary directory and renamed into place, so a crash
+		# or a concurrent run never leaves a half-written entry behind
+		tmp = tempfile.mkdtemp( dir=self.directory, prefix='.tmp-' )
+		os.chmod( tmp, 0o755 )
+		try:
+			meta = dict( params )
+			np.save( os.path.join(tmp, 'xs.npy'), scenario._xs )
+			np.save( os.path.join(tmp, 'ys.npy'), scenario._ys )
+			np.save( os.path.join(tmp, 'elevations.npy'), scenario._elevations )
+			edges = scenario._edge_exists
+			if isinstance( edges, ImplicitEdgeMask ):
+				meta.update( edges='implicit', edge_seed=edges.seed, p_remove=edges.p_remove )
+				np.save( os.path.join(tmp, 'route_keep.npy'), edges._route_keep )
+			else:
+				meta['edges'] = 'packed'
+				np.save( os.path.join(tmp, 'edges.npy'), edges._bits )
+			meta['costs'] = bool( store_costs and scenario.getNumCities() <= Scenario.DENSE_COSTS_MAX_CITIES )
+			if meta['costs']:
+				np.save( os.path.join(tmp, 'costs.npy'), scenario.getCostMatrix() )
+			with open( os.path.join(tmp, 'meta.json'), 'w' ) as f:
+				json.dump( meta, f )
+			os.rename( tmp, path )
+		except OSError:
+			shutil.rmtree( tmp, ignore_errors=True )	# most likely stored by someone else meanwhile
+
+	def _entries( self ):
+		entries = []
+		for name in os.listdir( self.directory ):
+			path = os.path.join( self.directory, name )
+			if not os.path.isdir( path ) or name.startswith( '.tmp-' ):
+				continue
+			try:
+				with open( os.path.join(path, 'meta.json') ) as f:
+					version = json.load( f ).get( 'version' )
+				used = os.path.getmtime( os.path.join(path, 'meta.json') )
+			except (OSError, ValueError):
+				version, used = None, 0.0
+			size = sum( os.path.getsize(os.path.join(path, f)) for f in os.listdir(path) )
+			entries.append( (used, path, size, version) )
+		return entries
+
+	''' <summary>
+		Deletes entries from other generation versions, then the least
+		recently used ones until the cache fits in max_bytes.
+		</summary>
+		<returns>number of entries deleted</returns>
+	'''
+	def evict( self, max_bytes=None ):
+		max_bytes = self.max_bytes if max_bytes is None else max_bytes
+		entries = []
+		deleted = 0
+		for entry in self._entries():
+			if entry[3] != Scenario.GENERATION_VERSION:
+				shutil.rmtree( entry[1], ignore_errors=True )
+				deleted += 1
+			else:
+				entries.append( entry )
+		total = sum( entry[2] for entry in entries )
+		for used, path, size, version in sorted( entries ):
+			if total <= max_bytes:
+				break
+			shutil.rmtree( path, ignore_errors=True )
+			total -= size
+			deleted += 1
+		return deleted
+
+	def clear( self ):
+		return self.evict( max_bytes=0 )
@@ -1,81 +1,328 @@
 #!/usr/bin/python3
 
-from which_pyqt import PYQT_VER
-if PYQT_VER == 'PYQT5':
-	from PyQt5.QtCore import QLineF, QPointF
-elif PYQT_VER == 'PYQT4':
-	from PyQt4.QtCore import QLineF, QPointF
-elif PYQT_VER == 'PYQT6':
-	from PyQt6.QtCore import QLineF, QPointF
-else:
-	raise Exception('Unsupported Version of PyQt: {}'.format(PYQT_VER))
-
-
-
-
+import functools
+import os
 import time
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from TSPClasses import *
+from TSPAnytime import AnytimeDriver, EXPENSIVE_STEP, runUntil
+from TSPAnnealing import Annealing
+from TSPAntColony import AntColony
+from TSPBranchAndBound import BranchAndBound, SharedSearch
+from TSPFeasible import FeasibleTours
+from TSPGenetic import Island, tourCosts
+from TSPHeldKarp import HeldKarp
+from TSPLocalSearch import LocalSearch
+from TSPLowerBound import LowerBound
 import heapq
 import itertools
 
 
 
+# Process-pool workers for TSPSolver.multiStart, TSPSolver.fancy and
+# TSPSolver.parallelBranchAndBound.  The scenario is sent to each worker once,
+# through the pool initializer, so tasks only carry start cities, seeds, tours,
+# paths and the shared deadline.
+_worker_scenario = None
+
+def _initWorker( scenario ):
+	global _worker_scenario
+	_worker_scenario = scenario
+	_worker_scenario.getCostMatrix()
+
+def _multiStartTask( mode, arg, deadline ):
+	# Returns (pid, tours tried, feasible tours, best route indices, best cost)
+	cost_matrix = _worker_scenario.getCostMatrix()
+	ncities = cost_matrix.shape[0]
+	if mode == 'greedy':
+		batch = runUntil( TSPSolver._greedyBatch( cost_matrix, np.asarray(arg) ), deadline )
+		tried = len(arg) if batch is not None else 0
+		if batch is None:
+			batch = np.empty( (0,ncities), dtype=np.intp ), np.empty( 0 )
+		tours, costs = batch
+	else:
+		rng = np.random.default_rng( arg )
+		tours = []
+		costs = []
+		tried = 0
+		while tried < TSPSolver.MULTISTART_RANDOM_TOURS_PER_TASK and time.time() < deadline:
+			perms = np.argsort( rng.random( (TSPSolver.MULTISTART_RANDOM_BATCH,ncities) ), axis=1 )
+			perm_costs = cost_matrix[perms, np.roll(perms,-1,axis=1)].sum( axis=1 )
+			tried += len(perms)
+			keep = perm_costs < np.inf
+			tours.append( perms[keep] )
+			costs.append( perm_costs[keep] )
+		tours = np.concatenate( tours ) if tours else np.empty( (0,ncities), dtype=np.intp )
+		costs = np.concatenate( costs ) if costs else np.empty( 0 )
+	if len(costs) == 0:
+		return os.getpid(), tried, 0, None, math.inf
+	best = costs.argmin()
+	return os.getpid(), tried, len(costs), tours[best], costs[best]
+
+_worker_search = None
+_worker_lower_bound = None
+
+def _initBranchAndBoundWorker( scenario, search, lower_bound ):
+	global _worker_search, _worker_lower_bound
+	_initWorker( scenario )
+	_worker_search = search
+	_worker_lower_bound = lower_bound
+
+def _branchAndBoundTask( worker, paths, deadline, max_matrices ):
+	# Returns (pid, whether the whole tree was searched); the counters are in _worker_search
+	engine = BranchAndBound( _worker_scenario.getCostMatrix(), lower_bound=_worker_lower_bound, \
+							 max_matrices=max_matrices )
+	return os.getpid(), _worker_search.run( engine, worker, paths, deadline )
+
+def _islandTask( tours, migrants, seed, size, generations, deadline, local_search ):
+	# Returns (pid, population best first, generations run, children evaluated)
+	scenario = _worker_scenario
+	cost_matrix = scenario.getCostMatrix()
+	ncities = cost_matrix.shape[0]
+	rng = np.random.default_rng( seed )
+	if tours is None:
+		# A new island starts from greedy tours from random start cities
+		starts = rng.choice( ncities, size=min(ncities, size), replace=False )
+		batch = runUntil( TSPSolver._greedyBatch( cost_matrix, starts ), deadline )
+		tours = batch[0] if batch is not None else np.empty( (0,ncities), dtype=np.intp )
+		# Starts that dead-ended are made up for with sampled feasible tours,
+		# so thinned graphs don't leave the island with random infeasible ones
+		if len(tours) < size:
+			sample = runUntil( FeasibleTours( cost_matrix, rng=rng ).sample( size-len(tours) ), deadline )
+			if sample is not None:
+				tours = np.concatenate( (tours, sample) )
+	improve = None
+	if local_search:
+		def improve( tour ):
+			search = LocalSearch( TSPSolution.fromIndices( scenario, tour ) )
+			search.run( deadline )
+			return search.solution.perm
+	island = Island( cost_matrix, tours, size, rng, improve )
+	island.immigrate( migrants )
+	while island.generations < generations and time.time() < deadline:
+		island.generation()
+	return os.getpid(), island.tours, island.generations, island.evaluated
+
+
+
+''' <summary>
+	Decorator for the public solver methods.  If a lower bound time has been
+	set (see TSPSolver.setLowerBoundTime), the results of the outermost
+	solver call gain 'lower_bound' (see TSPSolver.lowerBound), 'gap', how far
+	the tour cost is above that bound as a fraction of it, and
+	'lower_bound_time', the seconds spent on the bound after the solver's
+	own time allowance (not counted in 'time').
+	Solvers that prove their tour optimal set 'lower_bound' themselves, and
+	solvers called by other solvers (e.g. to seed a BSSF) are left alone.
+	The outermost call is also what the solver's instrumentation, if it has
+	one, records, and it seeds the solve's random generators (see
+	TSPSolver._rng) from the scenario's seed and the algorithm, without
+	touching numpy's global generator, so every solve of a scenario is
+	repeatable (as far as the clock lets it).  Scenarios without a seed
+	(e.g. TSPLIB instances) count as seed 0.
+	</summary>
+'''
+def _entryPoint( solve ):
+	@functools.wraps( solve )
+	def wrapper( self, time_allowance=60.0, *args, **kwargs ):
+		outermost = self._depth == 0
+		if outermost:
+			seed = self._scenario.getSeed()
+			algorithm = [ alg[1] for alg in self.ALGORITHMS ].index( solve.__name__ )
+			self._seeds = np.random.SeedSequence( 0 if seed is None else seed, spawn_key=(algorithm,) )
+		instrumentation = self._instrumentation if outermost else None
+		if instrumentation is not None:
+			instrumentation.start( solve.__name__ )
+		results = None
+		self._depth += 1
+		try:
+			results = solve( self, time_allowance, *args, **kwargs )
+			if outermost and self._lower_bound_time is not None:
+				if instrumentation is not None:
+					instrumentation.phase( 'lower bound' )
+				start = time.time()
+				self._addLowerBound( results, self._lower_bound_time )
+				results['lower_bound_time'] = time.time() - start
+		finally:
+			self._depth -= 1
+			if instrumentation is not None:
+				instrumentation.stop( results )
+		return results
+	return wrapper
+
+
+
 class TSPSolver:
-	def __init__( self, gui_view ):
+
+	# (label, method name) for every algorithm, in the order the GUI lists them
+	ALGORITHMS = [ \
+		('Default                            ','defaultRandomTour'), \
+		('Greedy','greedy'), \
+		('Branch and Bound','branchAndBound'), \
+		('Branch and Bound (Parallel)','parallelBranchAndBound'), \
+		('Fancy','fancy'), \
+		('Greedy (All Starts)','greedyAllStarts'), \
+		('Multi-Start (Parallel)','multiStart'), \
+		('Held-Karp (Exact)','heldKarp'), \
+		('Ant Colony','antColony'), \
+		('Local Search (2-opt/Or-opt)','localSearch'), \
+		('Simulated Annealing','simulatedAnnealing') \
+	]															# whitespace hack to get longest to display correctly
+
+	BSSF_REPORT_INTERVAL = 0.05		# seconds; improvements found faster than this are not all reported
+	LOWER_BOUND_TIME_FRACTION = 0.1	# of branch and bound's time left, spent improving its lower bound
+	LOWER_BOUND_MAX_CITIES = 1000	# no lower bound (None) above this
+
+	def __init__( self, gui_view=None ):
 		self._scenario = None
+		self._bssf_callback = None
+		self._last_report = 0.0
+		self._cancelled = False
+		self._depth = 0
+		self._lower_bound = None
+		self._instrumentation = None
+		self._lower_bound_time = None
+		self._seeds = np.random.SeedSequence()
 
 	def setupWithScenario( self, scenario ):
 		self._scenario = scenario
+		self._cancelled = False
+		self._lower_bound = None
+
+
+	''' <summary>
+		Registers callback(results) to be called whenever a solver improves its
+		BSSF, with a partial results dictionary (same keys as the final one)
+		holding a copy of the solution.  It is called on whatever thread is
+		running the solver, at most once every BSSF_REPORT_INTERVAL seconds.
+		</summary> '''
+	def setBSSFCallback( self, callback ):
+		self._bssf_callback = callback
+
+	''' <summary>
+		Asks the running solver to stop as soon as it can; it then returns its
+		results as if time had run out.  Safe to call from another thread.
+		</summary> '''
+	def requestCancel( self ):
+		self._cancelled = True
+
+	''' <summary>
+		Records every following solve with instrumentation (a
+		TSPInstrument.Instrumentation), or stops recording if it is None.  The
+		record of the last solve is then in instrumentation.record.
+		</summary> '''
+	def setInstrumentation( self, instrumentation ):
+		self._instrumentation = instrumentation
+
+	''' <summary>
+		Makes every following solve add a lower bound and the gap to it to its
+		results (see _entryPoint), spending up to time_allowance seconds on the
+		bound once the solver is done, or stops adding them if it is None (the
+		default).  The bound is kept per scenario, so it gets tighter with
+		every solve.
+		</summary> '''
+	def setLowerBoundTime( self, time_allowance ):
+		self._lower_bound_time = time_allowance
+
+	''' <summary>
+		Lower bound on the cost of any tour of the scenario (see TSPLowerBound),
+		or None if the scenario has more than LOWER_BOUND_MAX_CITIES cities.
+		One LowerBound is kept per scenario and every call spends up to
+		time_allowance seconds improving it further.  upper_bound, the cost of a
+		known tour, lets the subgradient steps aim better.
+		</summary> '''
+	def lowerBound( self, time_allowance=10.0, upper_bound=math.inf ):
+		if self._scenario.getNumCities() > self.LOWER_BOUND_MAX_CITIES:
+			return None
+		if self._lower_bound is None:
+			self._lower_bound = LowerBound( self._scenario.getCostMatrix() )
+		bound = self._lower_bound
+		bound.upper_bound = min( bound.upper_bound, upper_bound )
+		bound.improve( time.time() + time_allowance, should_stop=lambda: self._cancelled )
+		return bound.bound if bound.bound > -math.inf else None
+
+	def _addLowerBound( self, results, time_allowance ):
+		if 'lower_bound' not in results:
+			results['lower_bound'] = self.lowerBound( time_allowance, results['cost'] )
+		bound = results['lower_bound']
+		cost = results['cost']
+		if bound is not None and 0 < bound < math.inf and cost < math.inf:
+			results['gap'] = (cost - bound) / bound
+		else:
+			results['gap'] = None
+
+	''' <summary>
+		A new random generator for part of the current solve, seeded from the
+		scenario's seed and the algorithm (see _entryPoint).
+		</summary> '''
+	def _rng( self ):
+		return np.random.default_rng( self._seeds.spawn(1)[0] )
+
+	''' <summary>
+		Runs the anytime solver generator function solver (see TSPAnytime) for
+		up to time_allowance seconds and returns its results dictionary.
+		</summary> '''
+	def _solve( self, solver, time_allowance, *args ):
+		driver = AnytimeDriver( time_allowance, should_stop=lambda: self._cancelled, \
+								on_improvement=self._reportProgress, instrumentation=self._instrumentation )
+		return driver.run( solver, *args )
+
+	def _reportProgress( self, progress, elapsed ):
+		if self._bssf_callback is None:
+			return
+		now = time.time()
+		if now-self._last_report < self.BSSF_REPORT_INTERVAL:
+			return
+		self._last_report = now
+		# A copy, since the solver may keep changing its own in place
+		soln = TSPSolution.fromIndices( self._scenario, progress.soln.perm )
+		self._bssf_callback( {'cost':soln.cost, 'time':elapsed, 'count':progress.count, 'soln':soln, \
+							  'max':progress.max, 'total':progress.total, 'pruned':progress.pruned} )
 
 
 	''' <summary>
 		This is the entry point for the default solver
 		which just finds a valid random tour.  Note this could be used to find your
-		initial BSSF.
+		initial BSSF.  The tour is built by randomized depth-first search over the
+		finite edges (see TSPFeasible) rather than drawn as a random permutation,
+		which on thinned (Hard) graphs is almost never feasible past a few dozen cities.
 		</summary>
 		<returns>results dictionary for GUI that contains three ints: cost of solution,
-		time spent to find solution, number of permutations tried during search, the
-		solution found, and three null values for fields not used for this
-		algorithm</returns>
+		time spent to find solution, number of search attempts made, the
+		solution found, and the number of search steps (in 'total')</returns>
 	'''
 
+	@_entryPoint
 	def defaultRandomTour( self, time_allowance=60.0 ):
-		results = {}
-		cities = self._scenario.getCities()
-		ncities = len(cities)
-		foundTour = False
-		count = 0
-		bssf = None
-		start_time = time.time()
-		while not foundTour and time.time()-start_time < time_allowance:
-			# create a random permutation
-			perm = np.random.permutation( ncities )
-			route = []
-			# Now build the route using the random permutation
-			for i in range( ncities ):
-				route.append( cities[ perm[i] ] )
-			bssf = TSPSolution(route)
-			count += 1
-			if bssf.cost < np.inf:
-				# Found a valid route
-				foundTour = True
-		end_time = time.time()
-		results['cost'] = bssf.cost if foundTour else math.inf
-		results['time'] = end_time - start_time
-		results['count'] = count
-		results['soln'] = bssf
-		results['max'] = None
-		results['total'] = None
-		results['pruned'] = None
-		return results
+		return self._solve( self._defaultRandomTourSteps, time_allowance )
+
+	def _defaultRandomTourSteps( self, progress, deadline ):
+		search = FeasibleTours( self._scenario.getCostMatrix(), greedy=False, rng=self._rng() )
+		yield from self._feasibleTourSteps( progress, search )
+
+	''' <summary>
+		Runs search (a TSPFeasible.FeasibleTours) until it finds a tour, which
+		becomes the BSSF.  count is the number of attempts and total the number
+		of search steps.
+		</summary> '''
+	def _feasibleTourSteps( self, progress, search ):
+		try:
+			tour = yield from search.tour()
+		finally:
+			progress.count = search.attempts
+			progress.total = search.nodes
+		if tour is not None:
+			progress.improve( TSPSolution.fromIndices( self._scenario, tour ) )
 
 
 	''' <summary>
 		This is the entry point for the greedy solver, which you must implement for
 		the group project (but it is probably a good idea to just do it for the branch-and
 		bound project as a way to get your feet wet).  Note this could be used to find your
-		initial BSSF.
+		initial BSSF.  If the nearest-neighbour tour from the first city dead-ends,
+		the tour is finished by a feasibility-aware search that still prefers cheap
+		edges (see TSPFeasible), instead of starting over from every other city.
 		</summary>
 		<returns>results dictionary for GUI that contains three ints: cost of best solution,
 		time spent to find best solution, total number of solutions found, the best
@@ -83,66 +330,227 @@ class TSPSolver:
 		algorithm</returns>
 	'''
 
+	@_entryPoint
 	def greedy( self,time_allowance=60.0 ):
-		results = {}
+		return self._solve( self._greedySteps, time_allowance )
+
+	def _greedySteps( self, progress, deadline ):
 		cities = self._scenario.getCities()
 		ncities = len(cities)
-		foundTour = False
-		count = 0
-		bssf = None
-		current_city_idx = 0
-		start_time = time.time()
-		while current_city_idx < ncities and not foundTour and time.time()-start_time < time_allowance: # O(ncities), worst case scenario, final route should start with the last city
-			count += 1
-			route = [cities[current_city_idx]]
-			not_visited = set(range(ncities))
-			not_visited.remove(current_city_idx)
+		progress.count += 1
+		route = [cities[0]]
+		not_visited = set(range(1, ncities))
 
+		# O(ncities)
+		# - when a solution is possible, the route should contain ncities
+		# - when break is called, in worst case scenario, we can construct a route of ncities - 1, and then find out it's not possible to go to the remaining city
+		while len(route) != ncities:
+			# from last city in route
+			# find the city with minimum cost to
+			min_cost = float('inf')
+			next_city_idx = -1
 			# O(ncities)
-			# - when a solution is possible, the route should contain ncities
-			# - when break is called, in worst case scenario, we can construct a route of ncities - 1, and then find out it's not possible to go to the remaining city
-			while len(route) != ncities and time.time()-start_time < time_allowance:
-				# from last city in route
-				# find the city with minimum cost to
-				min_cost = float('inf')
-				next_city_idx = -1
-				# O(ncities)
-				# not_visited has n-1 cities at 1st iteration of the while loop, then n-2 at 2nd, n-3 ... 1 at last
-				for city_idx in not_visited:
-					cost = route[-1].costTo(cities[city_idx])
-					if cost < min_cost:
-						min_cost = cost
-						next_city_idx = city_idx
-
-				if next_city_idx == -1:
+			# not_visited has n-1 cities at 1st iteration of the while loop, then n-2 at 2nd, n-3 ... 1 at last
+			for city_idx in not_visited:
+				cost = route[-1].costTo(cities[city_idx])
+				if cost < min_cost:
+					min_cost = cost
+					next_city_idx = city_idx
+
+			if next_city_idx == -1:
+				break
+			else:
+				not_visited.remove(next_city_idx)
+				route.append(cities[next_city_idx])
+			yield
+
+		if len(route) == ncities and route[-1].costTo(route[0]) < float('inf'):
+			progress.improve( TSPSolution(route) )
+			return
+		# final time complexity O(ncities ^ 2)
+
+		# Dead end: fall back to the search, which backs out of dead ends
+		yield
+		search = FeasibleTours( self._scenario.getCostMatrix(), greedy=True, rng=self._rng() )
+		try:
+			tour = yield from search.tour()
+		finally:
+			progress.total = search.nodes
+		if tour is not None:
+			progress.improve( TSPSolution.fromIndices( self._scenario, tour ) )
+
+
+
+	''' <summary>
+		Batched nearest-neighbour construction: instead of trying one start city
+		at a time, every start city in a batch advances one step together, using a
+		masked argmin over the cost matrix rows of the batch's current cities.
+		Starts that dead-end (no finite edge to an unvisited city) are dropped
+		from the batch as soon as they do.  With num_starts=None every city is
+		used as a start; otherwise num_starts evenly spaced start cities are used,
+		which keeps the work at O(num_starts * n^2) for very large instances.
+		</summary>
+		<returns>results dictionary for GUI that contains the cost of the best tour,
+		time spent, number of start cities that produced a feasible tour, the best
+		solution found, number of start cities tried (in 'total') and two null values</returns>
+	'''
+
+	GREEDY_BATCH_ELEMENTS = 1<<18		# max batch_size*ncities cost entries gathered per step
+
+	@_entryPoint
+	def greedyAllStarts( self, time_allowance=60.0, num_starts=None ):
+		return self._solve( self._greedyAllStartsSteps, time_allowance, num_starts )
+
+	def _greedyAllStartsSteps( self, progress, deadline, num_starts=None ):
+		ncities = self._scenario.getNumCities()
+		cost_matrix = self._scenario.getCostMatrix()
+
+		if num_starts is None or num_starts >= ncities:
+			starts = np.arange( ncities )
+		else:
+			starts = np.arange( num_starts ) * ncities // num_starts
+		batch_size = max( 1, self.GREEDY_BATCH_ELEMENTS // max(ncities,1) )
+
+		progress.total = 0
+		best_cost = math.inf
+		for b in range( 0, len(starts), batch_size ):
+			batch = starts[b:b+batch_size]
+			tours, costs = yield from self._greedyBatch( cost_matrix, batch )
+			progress.total += len(batch)
+			progress.count += len(costs)
+			if len(costs) > 0 and costs.min() < best_cost:
+				best = costs.argmin()
+				best_cost = costs[best]
+				progress.improve( TSPSolution.fromIndices( self._scenario, tours[best] ) )
+
+	''' <summary>
+		Seeds progress with the best greedy tour from num_starts start cities
+		(see greedyAllStarts) or, if every one of them dead-ends, with a tour
+		from the feasibility-aware search (see TSPFeasible).
+		</summary> '''
+	def _seedSteps( self, progress, deadline, num_starts=None ):
+		yield from self._greedyAllStartsSteps( progress, deadline, num_starts )
+		if progress.soln is None:
+			yield from self._feasibleTourSteps( progress, FeasibleTours( self._scenario.getCostMatrix(), rng=self._rng() ) )
+
+	''' <summary>
+		Generator that advances every start in starts one greedy step per
+		yield, and returns (tours, costs) for the starts that made it all the
+		way around.
+		</summary> '''
+	@staticmethod
+	def _greedyBatch( cost_matrix, starts ):
+		ncities = cost_matrix.shape[0]
+		nstarts = len(starts)
+		tours = np.empty( (nstarts,ncities), dtype=np.intp )
+		tours[:,0] = starts
+		visited = np.zeros( (nstarts,ncities), dtype=bool )
+		visited[np.arange(nstarts),starts] = True
+		costs = np.zeros( nstarts )
+		current = starts.copy()
+
+		for step in range( 1, ncities ):
+			yield
+			rows = cost_matrix[current]
+			rows[visited] = np.inf
+			nxt = rows.argmin( axis=1 )
+			step_cost = rows[np.arange(len(nxt)),nxt]
+
+			# Drop the starts that have dead-ended
+			alive = step_cost < np.inf
+			if not alive.all():
+				tours, visited, costs = tours[alive], visited[alive], costs[alive]
+				nxt, step_cost = nxt[alive], step_cost[alive]
+				if len(nxt) == 0:
 					break
-				else:
-					not_visited.remove(next_city_idx)
-					route.append(cities[next_city_idx])
-
-			if len(route) == ncities:
-				if route[-1].costTo(route[0]) < float('inf'):
-					bssf = TSPSolution(route)
-					foundTour = True
-	
-			if not foundTour:
-				current_city_idx += 1
-		# final time complexity O(ncities ^ 3)
-		end_time = time.time()
-		results['cost'] = bssf.cost if foundTour else math.inf
-		results['time'] = end_time - start_time
-		results['count'] = count
-		results['soln'] = bssf
-		results['max'] = None
-		results['total'] = None
-		results['pruned'] = None
+			tours[:,step] = nxt
+			visited[np.arange(len(nxt)),nxt] = True
+			costs += step_cost
+			current = nxt
 
-		return results
+		costs = costs + cost_matrix[tours[:,-1],tours[:,0]]
+		feasible = costs < np.inf
+		return tours[feasible], costs[feasible]
 
 
 
 	''' <summary>
-		This is the entry point for the branch-and-bound algorithm that you will implement
+		Multi-start tour construction spread over a process pool.  In 'greedy'
+		mode the start cities are split into chunks and each chunk is run through
+		the batched greedy construction; in 'random' mode each task samples
+		batches of random permutations from its own seed, and new tasks keep
+		being handed out until the deadline.  All workers share the same
+		absolute deadline, start_time + time_allowance.
+		</summary>
+		<returns>results dictionary for GUI that contains the cost of the best tour,
+		time spent, number of feasible tours found, the best solution found, the
+		number of tours tried (in 'total'), and per-worker counts in 'workers'</returns>
+	'''
+
+	MULTISTART_RANDOM_BATCH = 256
+	MULTISTART_RANDOM_TOURS_PER_TASK = 4096
+
+	@_entryPoint
+	def multiStart( self, time_allowance=60.0, mode='greedy', workers=None ):
+		return self._solve( self._multiStartSteps, time_allowance, mode, workers )
+
+	def _multiStartSteps( self, progress, deadline, mode='greedy', workers=None ):
+		ncities = self._scenario.getNumCities()
+		workers = workers or os.cpu_count() or 1
+
+		if mode == 'greedy':
+			starts = np.arange( ncities )
+			tasks = [chunk.tolist() for chunk in np.array_split( starts, min(ncities, 4*workers) )]
+		else:
+			seeds = self._seeds.spawn(1)[0]
+			tasks = None
+
+		progress.total = 0
+		per_worker = progress.extra['workers'] = {}
+		best_cost = math.inf
+		def collect( future ):
+			nonlocal best_cost
+			pid, task_tried, task_found, tour, cost = future.result()
+			stats = per_worker.setdefault( pid, {'tasks':0, 'tried':0, 'found':0} )
+			stats['tasks'] += 1
+			stats['tried'] += task_tried
+			stats['found'] += task_found
+			progress.total += task_tried
+			progress.count += task_found
+			if cost < best_cost:
+				best_cost = cost
+				progress.improve( TSPSolution.fromIndices( self._scenario, tour ) )
+
+		pool = ProcessPoolExecutor( max_workers=workers, initializer=_initWorker, \
+									initargs=(self._scenario,) )
+		pending = set()
+		try:
+			if mode == 'greedy':
+				pending = { pool.submit( _multiStartTask, mode, task, deadline ) for task in tasks }
+			else:
+				pending = { pool.submit( _multiStartTask, mode, seed, deadline ) \
+							for seed in seeds.spawn( 2*workers ) }
+			while pending:
+				done, pending = wait( pending, timeout=self.BSSF_REPORT_INTERVAL, return_when=FIRST_COMPLETED )
+				for future in done:
+					collect( future )
+					if mode != 'greedy' and time.time() < deadline:
+						pending.add( pool.submit( _multiStartTask, mode, seeds.spawn(1)[0], deadline ) )
+				yield
+		finally:
+			# Stopped at the deadline, the tasks still running give up by then
+			# too, so their results are worth waiting for; on cancel they are not
+			pool.shutdown( wait=not self._cancelled, cancel_futures=True )
+			for future in pending:
+				if future.done() and not future.cancelled():
+					collect( future )
+
+
+
+	''' <summary>
+		This is the entry point for the branch-and-bound algorithm that you will implement.
+		Past BRANCH_AND_BOUND_MEMORY, queued states keep only their path (see
+		BranchAndBound's max_matrices).
 		</summary>
 		<returns>results dictionary for GUI that contains three ints: cost of best solution,
 		time spent to find best solution, total number solutions found during search (does
@@ -150,19 +558,378 @@ class TSPSolver:
 		max queue size, total number of states created, and number of pruned states.</returns>
 	'''
 
+	BRANCH_AND_BOUND_MEMORY = 1<<30		# bytes of reduced matrices the queue (or queues) may hold
+
+	@_entryPoint
 	def branchAndBound( self, time_allowance=60.0 ):
-		pass
+		return self._solve( self._branchAndBoundSteps, time_allowance )
+
+	def _branchAndBoundSteps( self, progress, deadline ):
+		engine = yield from self._branchAndBoundEngine( progress, deadline )
+		progress.phase( 'search' )
+		progress.queue_size = engine.queueSize
+		def sync():
+			progress.max = engine.max_queue
+			progress.total = engine.total
+			progress.pruned = engine.pruned
+		try:
+			for improved in engine.steps():
+				if improved:
+					sync()
+					progress.improve( TSPSolution.fromIndices( self._scenario, engine.bssf_route ), engine.count )
+				yield EXPENSIVE_STEP
+			progress.extra['lower_bound'] = progress.soln.cost if progress.soln else math.inf		# proven optimal
+		finally:
+			sync()
+
+
+
+	''' <summary>
+		Generator that seeds the BSSF and finds the lower bound for branch and
+		bound, and returns a BranchAndBound engine ready to search.
+		</summary> '''
+	def _branchAndBoundEngine( self, progress, deadline ):
+		# Seed the BSSF with the best greedy tour (or a searched one if greedy dead-ends)
+		progress.phase( 'seed' )
+		yield from self._seedSteps( progress, deadline )
+		bssf = progress.soln
+		progress.count = 0
+		# The Lagrangian penalties let the engine prune with 1-arborescence
+		# bounds as well as the reduced matrices
+		progress.phase( 'lower bound' )
+		bound = self.lowerBound( self.LOWER_BOUND_TIME_FRACTION*(deadline-time.time()), \
+								 bssf.cost if bssf else math.inf )
+		yield
+		cost_matrix = self._scenario.getCostMatrix()
+		return BranchAndBound( cost_matrix,
+							   bssf_route=bssf.perm.tolist() if bssf else None,
+							   bssf_cost=bssf.cost if bssf else math.inf,
+							   lower_bound=self._lower_bound if bound is not None else None,
+							   max_matrices=max( 1, self.BRANCH_AND_BOUND_MEMORY // (8*cost_matrix.size) ) )
+
+
+
+	''' <summary>
+		Branch and bound split over a process pool.  The search runs here until
+		its queue holds PARALLEL_BB_SPLIT states per worker, which are then dealt
+		out to the workers; from then on every worker searches its own part of
+		the tree, prunes against the BSSF shared by all of them (see
+		TSPBranchAndBound.SharedSearch), and steals states from the others when
+		it runs out.  The workers share BRANCH_AND_BOUND_MEMORY between them.
+		workers defaults to one per core.
+		</summary>
+		<returns>results dictionary for GUI that contains three ints: cost of best solution,
+		time spent to find best solution, total number solutions found during search (does
+		not include the initial BSSF), the best solution found, and three more ints summed
+		over the workers: max queue size, total number of states created, and number of
+		pruned states.  Per-worker counts, including the states stolen and handed over,
+		are in 'workers'.</returns>
+	'''
+
+	PARALLEL_BB_SPLIT = 8
+	PARALLEL_BB_STOP_WAIT = 0.1		# seconds given to the workers to stop, once time is up
+
+	@_entryPoint
+	def parallelBranchAndBound( self, time_allowance=60.0, workers=None ):
+		return self._solve( self._parallelBranchAndBoundSteps, time_allowance, workers )
+
+	def _parallelBranchAndBoundSteps( self, progress, deadline, workers=None ):
+		workers = workers or os.cpu_count() or 1
+		engine = yield from self._branchAndBoundEngine( progress, deadline )
+		ncities = self._scenario.getNumCities()
+
+		# Grow the tree here until there is enough of it to go round
+		progress.phase( 'split' )
+		progress.queue_size = engine.queueSize
+		finished = True
+		for improved in engine.steps():
+			if improved:
+				progress.improve( TSPSolution.fromIndices( self._scenario, engine.bssf_route ), engine.count )
+			if engine.queueSize() >= self.PARALLEL_BB_SPLIT*workers and not engine.expanding():
+				finished = False
+				break
+			yield EXPENSIVE_STEP
+		progress.max = engine.max_queue
+		progress.total = engine.total
+		progress.pruned = engine.pruned
+		if finished:
+			progress.extra['lower_bound'] = progress.soln.cost if progress.soln else math.inf		# proven optimal
+			return
+		paths = engine.split()
+		yield EXPENSIVE_STEP		# no pool if time is already up
+
+		progress.phase( 'search' )
+		progress.queue_size = None
+		search = SharedSearch( ncities, workers, engine.bssf_route, engine.bssf_cost )
+		max_matrices = max( 1, self.BRANCH_AND_BOUND_MEMORY // (workers * engine.matrixBytes()) )
+		per_worker = progress.extra['workers'] = [ {} for _ in range(workers) ]
+		done_workers = []
+		def sync():
+			stats = search.stats()
+			for worker, row in enumerate( stats ):
+				per_worker[worker].update( total=int(row[search.TOTAL]), pruned=int(row[search.PRUNED]), \
+										   max=int(row[search.MAX_QUEUE]), stolen=int(row[search.STOLEN]), \
+										   donated=int(row[search.DONATED]) )
+			progress.max = engine.max_queue + int( stats[:,search.MAX_QUEUE].sum() )
+			progress.total = engine.total + int( stats[:,search.TOTAL].sum() )
+			progress.pruned = engine.pruned + int( stats[:,search.PRUNED].sum() )
+			if search.improvements and (progress.soln is None or search.cost < progress.soln.cost):
+				progress.improve( TSPSolution.fromIndices( self._scenario, search.route() ), \
+								  engine.count + search.improvements )
+
+		pool = ProcessPoolExecutor( max_workers=workers, initializer=_initBranchAndBoundWorker, \
+									initargs=(self._scenario, search, engine.lower_bound) )
+		pending = set()
+		try:
+			pending = { pool.submit( _branchAndBoundTask, worker, paths[worker::workers], deadline, max_matrices ) \
+						for worker in range(workers) }
+			while pending:
+				done, pending = wait( pending, timeout=self.BSSF_REPORT_INTERVAL, return_when=FIRST_COMPLETED )
+				done_workers.extend( future.result()[1] for future in done )
+				sync()
+				yield EXPENSIVE_STEP
+			if all( done_workers ):
+				progress.extra['lower_bound'] = progress.soln.cost if progress.soln else math.inf		# proven optimal
+		finally:
+			# Workers stop at the deadline by themselves, and at once on stop();
+			# the counters are in shared memory, so workers that are slow to
+			# notice (e.g. still starting up) are not waited for
+			search.stop()
+			wait( pending, timeout=self.PARALLEL_BB_STOP_WAIT )
+			pool.shutdown( wait=False, cancel_futures=True )
+			sync()
+
+
+
+	''' <summary>
+		Exact solution by Held-Karp dynamic programming (see TSPHeldKarp).  Sizes
+		whose tables would not fit in HeldKarp.MAX_BYTES are refused: no solution
+		is returned and 'memory' holds the estimate.
+		</summary>
+		<returns>results dictionary for GUI that contains three ints: cost of the optimal
+		tour, time spent, 1 if a tour was found, the tour, the number of DP entries
+		computed (in 'total') and the estimated memory use in bytes (in 'memory').</returns>
+	'''
+
+	@_entryPoint
+	def heldKarp( self, time_allowance=60.0 ):
+		return self._solve( self._heldKarpSteps, time_allowance )
+
+	def _heldKarpSteps( self, progress, deadline ):
+		cost_matrix = self._scenario.getCostMatrix()
+		progress.total = 0
+		try:
+			engine = HeldKarp( cost_matrix )
+		except MemoryError:
+			progress.extra['memory'] = HeldKarp.estimateMemory( len(cost_matrix), HeldKarp.tableDtype(cost_matrix) )
+			return
+		progress.extra['memory'] = engine.memory
+		try:
+			yield from engine.steps()
+		finally:
+			progress.total = engine.states
+		if engine.route is not None:
+			progress.improve( TSPSolution.fromIndices( self._scenario, engine.route ), 1 )
+			progress.extra['lower_bound'] = progress.soln.cost		# exact
 
 
 
 	''' <summary>
 		This is the entry point for the algorithm you'll write for your group project.
+		An island-model genetic algorithm (see TSPGenetic.Island): the
+		populations of islands evolve in a process pool, one task per island
+		at a time, each running migration_interval generations before handing its
+		population back.  Each island then receives the migrants best tours of
+		its neighbour on a ring and goes on, until time runs out.  Islands start
+		from greedy tours from random start cities, and with local_search the
+		best child of every generation gets 2-opt/Or-opt local search (a memetic
+		algorithm).  islands defaults to one per core.  Below 4 cities the
+		best greedy tour is returned as is.
+		</summary>
+		<returns>results dictionary for GUI that contains the cost of the best tour,
+		time spent, number of times the islands improved on the BSSF, the best
+		solution found, the number of children evaluated (in 'total'), the number
+		of generations (in 'generations') and per-island counts in 'islands'.</returns>
+	'''
+
+	FANCY_POPULATION = Island.POPULATION
+	FANCY_MIGRATION_INTERVAL = 10	# generations per task, between migrations
+	FANCY_MIGRANTS = 2				# elite tours sent to the next island every migration
+
+	@_entryPoint
+	def fancy( self, time_allowance=60.0, islands=None, population=FANCY_POPULATION, \
+			   migration_interval=FANCY_MIGRATION_INTERVAL, migrants=FANCY_MIGRANTS, local_search=True ):
+		return self._solve( self._fancySteps, time_allowance, islands, population, \
+							migration_interval, migrants, local_search )
+
+	def _fancySteps( self, progress, deadline, islands=None, population=FANCY_POPULATION, \
+					 migration_interval=FANCY_MIGRATION_INTERVAL, migrants=FANCY_MIGRANTS, local_search=True ):
+		if self._scenario.getNumCities() < 4:
+			# Too few cities for the mutations, and for more than one or two tours
+			progress.phase( 'seed' )
+			yield from self._seedSteps( progress, deadline )
+			return
+		islands = islands or os.cpu_count() or 1
+		seeds = self._seeds.spawn(1)[0]
+		populations = [ None ] * islands
+		progress.total = 0
+		progress.extra['generations'] = 0
+		stats = progress.extra['islands'] = [ {'epochs':0, 'generations':0, 'best':None} for _ in range(islands) ]
+		best_cost = math.inf
+		def collect( island, future ):
+			nonlocal best_cost
+			pid, tours, generations, evaluated = future.result()
+			populations[island] = tours
+			progress.total += evaluated
+			progress.extra['generations'] += generations
+			stats[island]['epochs'] += 1
+			stats[island]['generations'] += generations
+			if len(tours) == 0:
+				return
+			cost = float( tourCosts( self._scenario.getCostMatrix(), tours[:1] )[0] )
+			stats[island]['best'] = cost if cost < math.inf else None
+			if cost < best_cost:
+				best_cost = cost
+				progress.improve( TSPSolution.fromIndices( self._scenario, tours[0] ), progress.count+1 )
+
+		def submit( island ):
+			neighbour = populations[ (island-1) % islands ] if islands > 1 else None
+			incoming = neighbour[:migrants] if neighbour is not None else None
+			return pool.submit( _islandTask, populations[island], incoming, seeds.spawn(1)[0], \
+								population, migration_interval, deadline, local_search )
+
+		progress.phase( 'islands' )
+		pool = ProcessPoolExecutor( max_workers=islands, initializer=_initWorker, initargs=(self._scenario,) )
+		pending = {}
+		try:
+			pending = { submit( island ):island for island in range(islands) }
+			while pending:
+				done, _ = wait( pending, timeout=self.BSSF_REPORT_INTERVAL, return_when=FIRST_COMPLETED )
+				for future in done:
+					island = pending.pop( future )
+					collect( island, future )
+					if time.time() < deadline:
+						pending[ submit( island ) ] = island
+				yield
+		finally:
+			# As in multiStart: running tasks stop at the deadline by themselves
+			pool.shutdown( wait=not self._cancelled, cancel_futures=True )
+			for future, island in pending.items():
+				if future.done() and not future.cancelled():
+					collect( island, future )
+
+
+
+	''' <summary>
+		Starts from the best greedy tour and improves it with asymmetric 2-opt and
+		Or-opt local search (see TSPLocalSearch) until no improving move is left
+		or time runs out.
 		</summary>
 		<returns>results dictionary for GUI that contains three ints: cost of best solution,
-		time spent to find best solution, total number of solutions found during search, the
-		best solution found.  You may use the other three field however you like.
-		algorithm</returns>
+		time spent to find best solution, number of improving moves applied, the best
+		solution found, and the number of candidate moves evaluated (in 'total').</returns>
+	'''
+
+	FANCY_GREEDY_STARTS = 32
+
+	@_entryPoint
+	def localSearch( self, time_allowance=60.0 ):
+		return self._solve( self._localSearchSteps, time_allowance )
+
+	def _localSearchSteps( self, progress, deadline ):
+		progress.phase( 'seed' )
+		yield from self._seedSteps( progress, deadline, self.FANCY_GREEDY_STARTS )
+		progress.count = 0
+		progress.total = 0
+		if progress.soln is None:
+			return
+		progress.phase( 'local search' )
+		search = LocalSearch( TSPSolution.fromIndices( self._scenario, progress.soln.perm ) )
+		try:
+			for improved in search.steps():
+				if improved:
+					progress.total = search.evaluated
+					progress.improve( search.solution, search.improvements )
+				yield
+		finally:
+			progress.total = search.evaluated
+
+
+
+	''' <summary>
+		Ant colony optimization (see TSPAntColony), seeded with the best of
+		FANCY_GREEDY_STARTS greedy tours, for the rest of time_allowance.  The
+		best ant of every generation is improved by local search (see
+		TSPLocalSearch) before it deposits pheromone.
+		</summary>
+		<returns>results dictionary for GUI that contains the cost of the best tour,
+		time spent, number of times the colony improved on the BSSF, the best
+		solution found, the number of feasible tours the ants built (in 'total'),
+		and the number of generations (in 'generations').</returns>
 	'''
 
-	def fancy( self,time_allowance=60.0 ):
-		pass
+	@_entryPoint
+	def antColony( self, time_allowance=60.0, ants=AntColony.ANTS ):
+		return self._solve( self._antColonySteps, time_allowance, ants )
+
+	def _antColonySteps( self, progress, deadline, ants=AntColony.ANTS ):
+		progress.phase( 'seed' )
+		yield from self._seedSteps( progress, deadline, self.FANCY_GREEDY_STARTS )
+		progress.count = 0
+		progress.total = 0
+		bssf = progress.soln
+		progress.phase( 'colony' )
+		def improve( tour ):
+			search = LocalSearch( TSPSolution.fromIndices( self._scenario, tour ) )
+			search.run( deadline )
+			return search.solution.perm
+		colony = AntColony( self._scenario.getCostMatrix(), ants, \
+							bssf_route=bssf.perm if bssf else None, bssf_cost=bssf.cost if bssf else math.inf, \
+							rng=self._rng(), improve=improve )
+		try:
+			for improved in colony.steps():
+				if improved:
+					progress.improve( TSPSolution.fromIndices( self._scenario, colony.best_route ), colony.improvements )
+				yield
+		finally:
+			progress.total = colony.tours
+			progress.extra['generations'] = colony.generations
+
+
+
+	''' <summary>
+		Simulated annealing (see TSPAnnealing) of the best of FANCY_GREEDY_STARTS
+		greedy tours, cooling over the rest of time_allowance.
+		</summary>
+		<returns>results dictionary for GUI that contains the cost of the best tour,
+		time spent, number of times the annealing improved on the BSSF, the best
+		solution found, the number of moves accepted (in 'max'), judged (in
+		'total') and rejected (in 'pruned'), and the number of restarts from the
+		best tour (in 'restarts').</returns>
+	'''
+
+	@_entryPoint
+	def simulatedAnnealing( self, time_allowance=60.0 ):
+		return self._solve( self._simulatedAnnealingSteps, time_allowance )
+
+	def _simulatedAnnealingSteps( self, progress, deadline ):
+		progress.phase( 'seed' )
+		yield from self._seedSteps( progress, deadline, self.FANCY_GREEDY_STARTS )
+		progress.count = 0
+		if progress.soln is None:
+			return
+		progress.phase( 'annealing' )
+		annealing = Annealing( self._scenario.getCostMatrix(), progress.soln.perm, deadline, self._rng() )
+		def counts():
+			progress.max = annealing.accepted
+			progress.total = annealing.accepted + annealing.rejected
+			progress.pruned = annealing.rejected
+			progress.extra['restarts'] = annealing.restarts
+		try:
+			for improved in annealing.steps():
+				if improved:
+					counts()
+					progress.improve( TSPSolution.fromIndices( self._scenario, annealing.best_route ), annealing.improvements )
+				yield
+		finally:
+			counts()
@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+
+
+import time
+
+import numpy as np
+
+from TSPClasses import Scenario, TSPSolution
+from TSPCostOracle import CostOracle
+from TSPLocalSearch import LocalSearch, candidateLists
+
+
+
+def test_local_search_runs_on_the_oracle( monkeypatch ):
+	def search( scenario ):
+		solution = TSPSolution.fromIndices( scenario, np.arange( scenario.getNumCities() ) )
+		local = LocalSearch( solution )
+		local.run( time.time() + 60.0 )
+		return solution
+
+	dense = search( Scenario.generate( 300, 3, 'Normal', legacy=False ) )
+	monkeypatch.setattr( Scenario, 'DENSE_COSTS_MAX_CITIES', 0 )
+	scenario = Scenario.generate( 300, 3, 'Normal', legacy=False )
+	assert isinstance( scenario.getCosts(), CostOracle )
+	tiled = search( scenario )
+	assert scenario._cost_matrix is None
+	assert scenario.getCostOracle().misses > 0
+	assert tiled.cost == dense.cost < np.inf
+	assert ( tiled.perm == dense.perm ).all()
+
+def test_candidate_lists_match_the_dense_matrix( monkeypatch ):
+	monkeypatch.setattr( Scenario, 'DENSE_COSTS_MAX_CITIES', 0 )
+	scenario = Scenario.generate( 200, 5, 'Hard', legacy=False )
+	oracle = CostOracle( scenario, tile_size=32 )
+	matrix = scenario.getCostMatrix()
+	monkeypatch.setattr( 'TSPLocalSearch.CANDIDATE_BLOCK', 1000 )
+	assert candidateLists( oracle, 8 ) == candidateLists( matrix, 8 )
+	assert candidateLists( oracle.T, 8 ) == candidateLists( matrix.T, 8 )
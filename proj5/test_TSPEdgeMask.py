@@ -0,0 +1,15 @@
+#!/usr/bin/python3
+
+
+import numpy as np
+
+from TSPEdgeMask import PackedEdgeMask
+
+
+
+def test_count_matches_dense_when_rows_end_mid_byte():
+	for ncities in ( 1, 7, 10, 13, 16 ):
+		mask = PackedEdgeMask.allEdges( ncities )
+		assert mask.count() == ncities * (ncities-1)
+		dense = np.random.default_rng( ncities ).random( (ncities,ncities) ) < 0.5
+		assert PackedEdgeMask.fromDense( dense ).count() == dense.sum()
@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+
+
+import itertools
+
+import numpy as np
+
+from TSPFeasible import FeasibleTours
+
+
+
+def _hasTour( adj ):
+	n = len(adj)
+	return any( all( adj[a,b] for a, b in zip( (0,)+rest, rest+(0,) ) ) \
+				for rest in itertools.permutations( range(1,n) ) )
+
+def _tour( cost_matrix, seed ):
+	search = FeasibleTours( cost_matrix, rng=np.random.default_rng( seed ) )
+	tours = search.tour()
+	try:
+		while True:
+			next( tours )
+	except StopIteration as done:
+		return done.value
+
+def _check( adj, seed ):
+	cost_matrix = np.where( adj, 1.0, np.inf )
+	tour = _tour( cost_matrix, seed )
+	if not _hasTour( adj ):
+		assert tour is None
+	else:
+		assert tour is not None and sorted( tour ) == list( range(len(adj)) )
+		assert np.isfinite( cost_matrix[tour, np.roll(tour,-1)] ).all()
+
+def test_finds_a_tour_whenever_there_is_one():
+	# Every digraph on up to 4 cities, and random ones on 5 to 7
+	for n in range( 2, 5 ):
+		off = ~np.eye( n, dtype=bool )
+		for bits in range( 1 << (n*(n-1)) ):
+			adj = np.zeros( (n,n), dtype=bool )
+			adj[off] = [ bool( bits >> i & 1 ) for i in range( n*(n-1) ) ]
+			_check( adj, bits )
+	rng = np.random.default_rng( 0 )
+	for trial in range( 1500 ):
+		n = 5 + trial % 3
+		adj = rng.random( (n,n) ) < rng.uniform( 0.3, 0.7 )
+		np.fill_diagonal( adj, False )
+		_check( adj, trial )
+
+def test_finds_the_tour_past_a_misleading_dead_end():
+	adj = np.zeros( (5,5), dtype=bool )
+	for a, b in ( (0,1), (0,3), (0,4), (1,0), (1,4), (2,0), (2,3), (3,2), (3,4), \
+				  (4,0), (4,1), (4,2), (4,3) ):
+		adj[a,b] = True
+	for seed in range( 200 ):
+		_check( adj, seed )